@@ -1,48 +1,99 @@
-from shiny import ui, App, Session
+import logging
+
+from shiny import ui, App, Session, reactive, render
 import matplotlib
+from starlette.routing import Route
 
+from information import INFORMATION_STRING
 from ui_turbidity import ui_turbidity
 from ui_water import ui_water
 from ui_spatial_turbidity import ui_spatial_turbidity
 from ui_satellite_situ import ui_satellite_situ
 from ui_turbidity_fixed import ui_turbidity_fixed
 from ui_satellite_fixed import ui_satellite_fixed
-from server_water import server_water
-from server_turbidity import server_turbidity
-from server_spatial_turbidity import server_spatial_turbidity
-from server_satellite_situ import server_satellite_situ
-from server_turbidity_fixed import server_turbidity_fixed
-from server_satellite_fixed import server_satellite_fixed
+from turbidity_shiny.instrumentation import (
+    INSTRUMENTATION_ENABLED,
+    REACTIVE_METRICS,
+    install_instrumentation,
+    metrics_endpoint,
+)
+from turbidity_shiny.lazy_server import LazyTabServer
 
 
 matplotlib.use("agg")
+logging.basicConfig(level=logging.INFO)
+
+# Opt-in with TURBIDITY_SHINY_INSTRUMENTATION=1: adds the Diagnostics tab and
+# the /metrics endpoint
+if INSTRUMENTATION_ENABLED:
+    install_instrumentation()
+
+# Server modules are only imported, and their server started, when the tab is
+# first selected
+TAB_SERVER_DICT = {
+    "Détection de l'eau": ("server_water", "server_water"),
+    "Turbidité": ("server_turbidity", "server_turbidity"),
+    "Turbidité Spatiale": ("server_spatial_turbidity", "server_spatial_turbidity"),
+    "Relation Satellite/In-Situ Spatiale": (
+        "server_satellite_situ",
+        "server_satellite_situ",
+    ),
+    "Turbidité Fixe": ("server_turbidity_fixed", "server_turbidity_fixed"),
+    "Relation Satellite/In-Situ Fixe": (
+        "server_satellite_fixed",
+        "server_satellite_fixed",
+    ),
+}
 
 
 ui_info = ui.page_fluid(ui.output_text_verbatim("general_informations"))
+ui_diagnostics = ui.page_fluid(ui.output_table("diagnostics_table"))
+
+nav_list = [
+    ui.nav("Information", ui_info),
+    ui.nav("Détection de l'eau", ui_water),
+    ui.nav("Turbidité", ui_turbidity),
+    ui.nav("Turbidité Spatiale", ui_spatial_turbidity),
+    ui.nav("Relation Satellite/In-Situ Spatiale", ui_satellite_situ),
+    ui.nav("Turbidité Fixe", ui_turbidity_fixed),
+    ui.nav("Relation Satellite/In-Situ Fixe", ui_satellite_fixed),
+]
+if INSTRUMENTATION_ENABLED:
+    nav_list.append(ui.nav("Diagnostics", ui_diagnostics))
 
 app_ui = ui.page_fluid(
     ui.h1("Exploration: Images Satellite et Turbidité"),
     ui.navset_pill_card(
-        ui.nav("Information", ui_info),
-        ui.nav("Détection de l'eau", ui_water),
-        ui.nav("Turbidité", ui_turbidity),
-        ui.nav("Turbidité Spatiale", ui_spatial_turbidity),
-        ui.nav("Relation Satellite/In-Situ Spatiale", ui_satellite_situ),
-        ui.nav("Turbidité Fixe", ui_turbidity_fixed),
-        ui.nav("Relation Satellite/In-Situ Fixe", ui_satellite_fixed),
+        *nav_list,
+        id="main_navset",
         selected="Turbidité",
     ),
 )
 
 
 def server(input, output, session: Session):
-    server_water(input, output, session)
-    server_turbidity(input, output, session)
-    server_spatial_turbidity(input, output, session)
-    server_satellite_situ(input, output, session)
-    server_turbidity_fixed(input, output, session)
-    server_satellite_fixed(input, output, session)
+    @output
+    @render.text
+    def general_informations():
+        return INFORMATION_STRING
+
+    lazy_tab_server = LazyTabServer(TAB_SERVER_DICT, input, output, session)
+
+    @reactive.Effect
+    def start_selected_tab_server():
+        lazy_tab_server.start(input.main_navset())
+
+    if INSTRUMENTATION_ENABLED:
+
+        @output
+        @render.table
+        def diagnostics_table():
+            if input.main_navset() == "Diagnostics":
+                reactive.invalidate_later(2)
+            return REACTIVE_METRICS.to_dataframe()
 
 
 # This is a shiny.App object. It must be named `app`.
 app = App(app_ui, server)
+if INSTRUMENTATION_ENABLED:
+    app.starlette_app.router.routes.insert(0, Route("/metrics", metrics_endpoint))
@@ -0,0 +1,46 @@
+import argparse
+
+from turbidity_shiny.benchmark import run_benchmark, run_raster_dtype_check
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Benchmark of the turbidity pipeline on synthetic image handlers, "
+            "measures and probe data. Runs offline, without the ../data tree."
+        )
+    )
+    parser.add_argument("--scene-size", type=int, default=1000)
+    parser.add_argument("--n-images", type=int, default=4)
+    parser.add_argument("--n-points", type=int, default=50)
+    parser.add_argument("--n-probe-rows", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Also write the results to this csv file, e.g. to compare two commits.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result_df = run_benchmark(
+        scene_size=args.scene_size,
+        n_images=args.n_images,
+        n_points=args.n_points,
+        n_probe_rows=args.n_probe_rows,
+        repeat=args.repeat,
+        seed=args.seed,
+    )
+    result_df["peak_memory_mb"] = result_df.pop("peak_memory_bytes") / 1024**2
+    print(result_df.to_string(index=False, float_format="{:.4f}".format))
+    if args.output is not None:
+        result_df.to_csv(args.output, index=False)
+    print()
+    print(
+        run_raster_dtype_check(scene_size=args.scene_size, seed=args.seed).to_string(
+            index=False
+        )
+    )
@@ -1,70 +1,58 @@
-import lzma
-import gzip  # noqa F401
-import numpy
-from pathlib import Path
-import pickle
-from tqdm import tqdm
+import argparse
 
-from satellite_image_handler.sentinel_image_handler import (  # noqa F401
-    CocagneSentinelImageHandler,
-    BouctoucheSentinelImageHandler,
-    WestSentinelImageHandler,
-    MorellSentinelImageHandler,
-    DunkSentinelImageHandler,
+from turbidity_shiny.build import (
+    ATMOSPHERIC_CORRECTION_LIST,
+    DATASET_LIST,
+    ESTUARY_NAME_LIST,
+    build_band_store,
 )
 
-ESTUARY_NAME_DICT = {
-    "dunk": DunkSentinelImageHandler,
-    "cocagne": CocagneSentinelImageHandler,
-    "bouctouche": BouctoucheSentinelImageHandler,
-    "west": WestSentinelImageHandler,
-    "morell": MorellSentinelImageHandler,
-}
-NO_CLOUD_IDX_2022_DICT = {
-    "bouctouche": 15,
-    "cocagne": 15,
-    "west": 7,
-    "morell": 2,
-    "dunk": 1,
-}
-THRESHOLD_DICT = {
-    "bouctouche": 0.65,
-    "cocagne": 0.65,
-    "west": 0.65,
-    "morell": 0.45,
-    "dunk": 0.65,
-}
 
-
-if __name__ == "__main__":
-    for estuary_name, image_handler_class in ESTUARY_NAME_DICT.items():
-        image_list = list(Path(f"../data/sentinel2_data/{estuary_name}").iterdir())
-        image_list_2022 = list(filter(lambda path: "2022" in str(path), image_list))
-
-        image_handler_2022_list = [
-            image_handler_class(str(image_path)) for image_path in tqdm(image_list_2022)
-        ]
-        image_handler_2022_list = sorted(
-            image_handler_2022_list, key=lambda image_handler: image_handler.date
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Build the band stores of the Sentinel-2 image handlers read by the "
+            "app. Only the products which are not in a store yet are processed."
         )
+    )
+    parser.add_argument("dataset", choices=DATASET_LIST)
+    parser.add_argument(
+        "--estuary", nargs="+", default=ESTUARY_NAME_LIST, choices=ESTUARY_NAME_LIST
+    )
+    parser.add_argument("--years", nargs="+", required=True)
+    parser.add_argument(
+        "--atmospheric-correction",
+        nargs="+",
+        default=["Sen2Cor"],
+        choices=ATMOSPHERIC_CORRECTION_LIST,
+        help="Not used by the water dataset, which is always Sen2Cor.",
+    )
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Process again the products already in the stores.",
+    )
+    return parser.parse_args()
 
-        no_cloud_idx = NO_CLOUD_IDX_2022_DICT[estuary_name]
-        threshold = THRESHOLD_DICT[estuary_name]
-        WATER_MASK = (
-            image_handler_2022_list[no_cloud_idx]
-            .get_smoothed_water_mask(sigma=2, threshold=threshold)
-            .astype(float)
-        )
 
-        cloud_free_images = list(
-            filter(
-                lambda ih: numpy.nanmean(
-                    (WATER_MASK * numpy.isin(ih.scene_clf, [3, 8, 9, 10]).astype(float))
+if __name__ == "__main__":
+    args = parse_args()
+    atmospheric_correction_list = (
+        ["Sen2Cor"] if args.dataset == "water" else args.atmospheric_correction
+    )
+    for estuary_name in args.estuary:
+        for year in args.years:
+            for atmospheric_correction in atmospheric_correction_list:
+                processed_count, image_count = build_band_store(
+                    args.dataset,
+                    estuary_name,
+                    year,
+                    atmospheric_correction,
+                    max_workers=args.max_workers,
+                    rebuild=args.rebuild,
+                )
+                print(
+                    f"{args.dataset} {estuary_name} {year} {atmospheric_correction}: "
+                    f"{processed_count} products processed, {image_count} images"
                 )
-                < 0.01,
-                image_handler_2022_list,
-            )
-        )
-
-        with lzma.open(f"data/{estuary_name}_2022.lzma.pkl", "wb") as f:
-            pickle.dump(cloud_free_images, f)
@@ -0,0 +1,94 @@
+import argparse
+
+from turbidity_shiny.turbidity.sweep import (
+    DEFAULT_BOX_SIZE_LIST,
+    DEFAULT_FIXED_TYPE_OF_TURBIDITY_INDEX_LIST,
+    DEFAULT_NDTI_SMOOTHED_SIGMA_LIST,
+    DEFAULT_SITU_TYPE_OF_TURBIDITY_INDEX_LIST,
+    DEFAULT_TURBIDITY_DF_WINDOW_LIST,
+    DEFAULT_WATER_INDEX_THRESHOLD_LIST,
+    run_sweep,
+)
+
+ESTUARY_NAME_LIST = ["Bouctouche", "Cocagne", "Dunk", "Morell", "West"]
+ATMOSPHERIC_CORRECTION_LIST = ["Sen2Cor", "Acolite"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Hyperparameter sweep of the satellite turbidity index against the "
+            "in-situ measures. Writes the feather files read by the "
+            "Relation Satellite/In-Situ tabs."
+        )
+    )
+    parser.add_argument("mode", choices=["situ", "fixed"])
+    parser.add_argument("--estuary", nargs="+", default=ESTUARY_NAME_LIST)
+    parser.add_argument(
+        "--atmospheric-correction", nargs="+", default=ATMOSPHERIC_CORRECTION_LIST
+    )
+    parser.add_argument(
+        "--years",
+        default="2023",
+        choices=["2022", "2023", "2022/2023"],
+        help="Only used by the fixed mode.",
+    )
+    parser.add_argument(
+        "--ndwi-threshold",
+        nargs="+",
+        type=float,
+        default=DEFAULT_WATER_INDEX_THRESHOLD_LIST,
+    )
+    parser.add_argument(
+        "--box-size", nargs="+", type=int, default=DEFAULT_BOX_SIZE_LIST
+    )
+    parser.add_argument(
+        "--ndti-smoothed-sigma",
+        nargs="+",
+        type=float,
+        default=DEFAULT_NDTI_SMOOTHED_SIGMA_LIST,
+    )
+    parser.add_argument("--type-of-turbidity-index", nargs="+", default=None)
+    parser.add_argument(
+        "--turbidity-df-window",
+        nargs="+",
+        type=int,
+        default=DEFAULT_TURBIDITY_DF_WINDOW_LIST,
+        help="Only used by the fixed mode.",
+    )
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="Recompute the jobs already written in the parts directory.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    grid_kwargs = {
+        "water_index_threshold_list": args.ndwi_threshold,
+        "box_size_list": args.box_size,
+        "ndti_smoothed_sigma_list": args.ndti_smoothed_sigma,
+    }
+    if args.mode == "situ":
+        grid_kwargs["type_of_turbidity_index_list"] = (
+            args.type_of_turbidity_index or DEFAULT_SITU_TYPE_OF_TURBIDITY_INDEX_LIST
+        )
+    else:
+        grid_kwargs["type_of_turbidity_index_list"] = (
+            args.type_of_turbidity_index or DEFAULT_FIXED_TYPE_OF_TURBIDITY_INDEX_LIST
+        )
+        grid_kwargs["turbidity_df_window_list"] = args.turbidity_df_window
+    result_path_list = run_sweep(
+        args.mode,
+        args.estuary,
+        args.atmospheric_correction,
+        years=args.years if args.mode == "fixed" else None,
+        grid_kwargs=grid_kwargs,
+        max_workers=args.max_workers,
+        resume=not args.no_resume,
+    )
+    for result_path in result_path_list:
+        print(result_path)
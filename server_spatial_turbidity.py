@@ -1,10 +1,10 @@
 from itertools import product
 import matplotlib.pyplot as plt
 import numpy
-import pandas
 from shiny import render, reactive, Session
 
 from turbidity_shiny.utils import (
+    ColumnarDataFrameBuilder,
     load_json_data,
 )
 
@@ -23,17 +23,16 @@ def server_spatial_turbidity(input, output, session: Session):
     def create_data_df():
         estuary_name = input.spatial_turbidity_estuary_name()
         data_json = load_measures_data_json()
-        data_df = pandas.DataFrame(
-            columns=[
-                "date",
-                "time",
-                "notes",
-                "global_location",
-                "precise_location",
-                "measures_list",
-            ]
+        data_df_builder = ColumnarDataFrameBuilder(
+            {
+                "date": object,
+                "time": object,
+                "notes": object,
+                "global_location": object,
+                "precise_location": object,
+                "measures_list": object,
+            }
         )
-        i = 0
         for field_work in data_json:
             notes = field_work["notes"]
             date = field_work["date"]
@@ -52,14 +51,16 @@ def server_spatial_turbidity(input, output, session: Session):
                 measures = measure["measures"]
                 if date == "2023-07-25" and time == "15:55":
                     continue
-                data_df.loc[i, "date"] = date
-                data_df.loc[i, "time"] = time
-                data_df.loc[i, "notes"] = notes
-                data_df.loc[i, "precise_location"] = precise_location
-                data_df.loc[i, "global_location"] = global_location
-                data_df.loc[i, "measures_list"] = measures
-                i += 1
+                data_df_builder.append(
+                    date=date,
+                    time=time,
+                    notes=notes,
+                    global_location=global_location,
+                    precise_location=precise_location,
+                    measures_list=measures,
+                )
 
+        data_df = data_df_builder.to_dataframe()
         data_df["year"] = data_df["date"].apply(lambda x: x[:4])
         data_df["month_day"] = data_df["date"].apply(lambda x: x[5:])
         data_df["measure_median"] = data_df["measures_list"].apply(numpy.median)
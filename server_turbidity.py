@@ -1,37 +1,47 @@
+import functools
+
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 import numpy
 from shiny import ui, render, reactive, Session
 from shiny.types import SilentException
 
-from satellite_image_handler.utils.normalize_index import create_water_index_raster
 from shiny.plotutils import near_points
 
 
+from turbidity_shiny.background_task import create_background_calc
+from turbidity_shiny.dataset_registry import get_session_owner
+from turbidity_shiny.image_pyramid import ImagePyramid, get_image_pyramid
+from turbidity_shiny.prefetch import RasterPrefetcher, get_neighbour_index_list
+from turbidity_shiny.scatter_plot import HighlightScatterPlot
 from turbidity_shiny.utils import (
     load_json_data,
     save_json_data,
 )
 from turbidity_shiny.turbidity.turbidity_df import (
-    create_turbidity_df,
+    extract_turbidity_df,
     get_smoothed_turbidity_index_water_index_mask,
+    get_smoothed_turbidity_index_water_index_mask_window,
+    get_water_index_raster,
+    transform_turbidity_df,
 )
 from turbidity_shiny.turbidity.load_data import load_turbidity_data
 
 
 def server_turbidity(input, output, session: Session):
-    @reactive.Calc
-    def get_turbidity_data():
-        (
-            image_handler_list,
-            turbidity_measures_data,
-            turbidity_location_data,
-        ) = load_turbidity_data(
+    dataset_owner = get_session_owner(session, "turbidity")
+
+    # The data loading and the raster extraction run in worker threads, see
+    # create_background_calc
+    get_turbidity_data = create_background_calc(
+        functools.partial(load_turbidity_data, owner=dataset_owner),
+        lambda: (
             input.turbidity_estuary_name(),
             input.modified_turbidity_location_switch(),
             input.turbidity_atmoshperic_correction(),
-        )
-        return image_handler_list, turbidity_measures_data, turbidity_location_data
+        ),
+        "Chargement des images",
+    )
 
     @reactive.Calc
     def get_all_specific_locations():
@@ -45,8 +55,9 @@ def server_turbidity(input, output, session: Session):
     def get_number_of_turbidity_image():
         return len(get_turbidity_data()[0])
 
-    @reactive.Calc
-    def generate_turbidity_df():
+    def get_extraction_argument_tuple():
+        # Only the raster parameters, the display filters are applied by
+        # generate_turbidity_df
         (
             image_handler_list,
             turbidity_measures_data,
@@ -56,7 +67,7 @@ def server_turbidity(input, output, session: Session):
         box_size = int(box_size_string[0])
         water_index_mask_threshold = input.water_index_mask_threshold()
         ndti_smoothed_sigma = input.ndti_smoothed_sigma()
-        turbidity_df = create_turbidity_df(
+        return (
             image_handler_list,
             turbidity_measures_data,
             turbidity_location_data,
@@ -65,6 +76,18 @@ def server_turbidity(input, output, session: Session):
             ndti_smoothed_sigma,
             input.type_of_turbidity_index(),
             True,
+        )
+
+    get_extracted_turbidity_df = create_background_calc(
+        extract_turbidity_df,
+        get_extraction_argument_tuple,
+        "Calcul des indices de turbidité",
+    )
+
+    @reactive.Calc
+    def generate_turbidity_df():
+        turbidity_df = transform_turbidity_df(
+            get_extracted_turbidity_df(),
             input.turbidity_exclude_outlier(),
             input.turbidity_use_log_measure(),
         )
@@ -107,7 +130,7 @@ def server_turbidity(input, output, session: Session):
         )
 
     @reactive.Effect
-    @reactive.event(input.turbidity_estuary_name)
+    @reactive.event(get_turbidity_data)
     def update_turbidity_slider_idx():
         number_of_image = get_number_of_turbidity_image()
         ui.update_slider(
@@ -291,80 +314,173 @@ def server_turbidity(input, output, session: Session):
         row_spot.set(row)
         col_spot.set(col)
 
-    @output
-    @render.plot
-    def generate_turbidity_image():
-        image_handler = get_turbidity_image_handler()
-        fig, ax = plt.subplots(1, 1, frameon=False)
+    def get_visualisation_pyramid_tuple(
+        image_handler,
+        visualisation_mode,
+        water_index_mask_threshold,
+        ndti_smoothed_sigma,
+        type_of_turbidity_index,
+        window=None,
+    ):
+        """
+        Image pyramids of the background image, of the alpha mask and of the
+        overlay of a visualisation mode. Without reactive reads, so it can run
+        in the prefetch threads.
+
+        With a window (min_row, max_row, min_col, max_col), only the window of
+        the rasters is computed, except the background color image which is
+        shared by every view of the image.
+        """
+        if window is None:
+            window_slice = (slice(None), slice(None))
+
+            def get_pyramid(parameters, compute_function):
+                return get_image_pyramid(image_handler, parameters, compute_function)
+
+        else:
+            min_row, max_row, min_col, max_col = window
+            window_slice = (slice(min_row, max_row), slice(min_col, max_col))
+
+            def get_pyramid(parameters, compute_function):
+                return ImagePyramid(
+                    numpy.asarray(compute_function()), origin=(min_row, min_col)
+                )
+
         alpha = None
-        visualisation_mode = input.turbidity_visualisation()
         visualisation = None
-        cmap = None
-        vmin, vmax = None, None
         if visualisation_mode in [
             "Image couleur",
             "water_index_mask",
             "Index Turbidité",
         ]:
-            im = image_handler.true_color_image
+            im = get_image_pyramid(
+                image_handler,
+                ("true_color_image",),
+                lambda: image_handler.true_color_image,
+            )
         elif visualisation_mode == "water_index":
-            im = create_water_index_raster(image_handler)
-        if visualisation_mode in ["water_index_mask", "Index Turbidité"]:
-            water_index_mask = (
-                create_water_index_raster(image_handler)
-                > input.water_index_mask_threshold()
+            im = get_pyramid(
+                ("water_index",),
+                lambda: get_water_index_raster(image_handler)[window_slice],
             )
+        if visualisation_mode in ["water_index_mask", "Index Turbidité"]:
             # Clean Water Mask from bridge
-            water_index_mask = (
-                water_index_mask * image_handler.get_mask_from_bridge_points_handler()
+            alpha = get_pyramid(
+                ("water_index_mask", water_index_mask_threshold, True),
+                lambda: (
+                    (
+                        get_water_index_raster(image_handler)[window_slice]
+                        > water_index_mask_threshold
+                    )
+                    * image_handler.get_mask_from_bridge_points_handler()[window_slice]
+                ).astype(numpy.float32),
             )
-            alpha = water_index_mask.astype(float)
+            visualisation = alpha
             if visualisation_mode == "Index Turbidité":
-                smoothed_ndti_water_index_mask = (
-                    get_smoothed_turbidity_index_water_index_mask(
-                        image_handler,
-                        input.water_index_mask_threshold(),
-                        input.ndti_smoothed_sigma(),
-                        input.type_of_turbidity_index(),
-                        True,
-                    )
+                smoothed_turbidity_index_parameters = (
+                    water_index_mask_threshold,
+                    ndti_smoothed_sigma,
+                    type_of_turbidity_index,
+                    True,
                 )
-                if input.type_of_turbidity_index() == "NDTI":
-                    vmin, vmax = -0.05, 0.05
-                else:
-                    if input.turbidity_atmoshperic_correction() == "Sen2Cor":
-                        vmin, vmax = 1_000, 1_700
-                    elif input.turbidity_atmoshperic_correction() == "Acolite":
-                        vmin, vmax = 0.01, 0.08
-            visualisation = (
-                smoothed_ndti_water_index_mask
-                if visualisation_mode == "Index Turbidité"
-                else water_index_mask
-            )
-            cmap = "Reds" if visualisation_mode == "Index Turbidité" else "Blues"
+                visualisation = get_pyramid(
+                    ("smoothed_turbidity_index_water_index_mask",)
+                    + smoothed_turbidity_index_parameters,
+                    lambda: (
+                        get_smoothed_turbidity_index_water_index_mask(
+                            image_handler, *smoothed_turbidity_index_parameters
+                        )
+                        if window is None
+                        else get_smoothed_turbidity_index_water_index_mask_window(
+                            image_handler, window, *smoothed_turbidity_index_parameters
+                        )
+                    ),
+                )
+        return im, alpha, visualisation
 
+    @reactive.Calc
+    def get_turbidity_visualisation_window():
+        """
+        (min_row, max_row, min_col, max_col) of the view around the selected
+        location, None when no location is selected.
+        """
         get_row_col_of_specific_location()
-        if row_spot.get() is not None and col_spot.get() is not None:
-            offset = int(input.turbidity_visualisation_box_size() / 2)
+        if row_spot.get() is None or col_spot.get() is None:
+            return None
+        n_rows, n_cols = get_turbidity_image_handler().red_band.shape[:2]
+        offset = int(input.turbidity_visualisation_box_size() / 2)
+        row, col = row_spot.get(), col_spot.get()
+        return (
+            max(0, row - offset),
+            min(row + offset, n_rows - 1),
+            max(0, col - offset),
+            min(col + offset, n_cols - 1),
+        )
+
+    prefetcher = RasterPrefetcher()
+    session.on_ended(prefetcher.cancel)
+
+    # Lower priority than the outputs: the neighbours are prefetched once the
+    # image is shown, with the parameters of the image
+    @reactive.Effect(priority=-1)
+    def prefetch_neighbour_turbidity_images():
+        image_handler_list = get_turbidity_data()[0]
+        visualisation_parameters = (
+            input.turbidity_visualisation(),
+            input.water_index_mask_threshold(),
+            input.ndti_smoothed_sigma(),
+            input.type_of_turbidity_index(),
+            get_turbidity_visualisation_window(),
+        )
+        prefetcher.prefetch(
+            [
+                functools.partial(
+                    get_visualisation_pyramid_tuple,
+                    image_handler_list[image_idx],
+                    *visualisation_parameters,
+                )
+                for image_idx in get_neighbour_index_list(
+                    input.turbidity_image_idx(), len(image_handler_list)
+                )
+            ]
+        )
+
+    @output
+    @render.plot
+    def generate_turbidity_image():
+        image_handler = get_turbidity_image_handler()
+        fig, ax = plt.subplots(1, 1, frameon=False)
+        visualisation_mode = input.turbidity_visualisation()
+        cmap = None
+        vmin, vmax = None, None
+        window = get_turbidity_visualisation_window()
+        im, alpha, visualisation = get_visualisation_pyramid_tuple(
+            image_handler,
+            visualisation_mode,
+            input.water_index_mask_threshold(),
+            input.ndti_smoothed_sigma(),
+            input.type_of_turbidity_index(),
+            window,
+        )
+        if visualisation_mode == "Index Turbidité":
+            if input.type_of_turbidity_index() == "NDTI":
+                vmin, vmax = -0.05, 0.05
+            else:
+                if input.turbidity_atmoshperic_correction() == "Sen2Cor":
+                    vmin, vmax = 1_000, 1_700
+                elif input.turbidity_atmoshperic_correction() == "Acolite":
+                    vmin, vmax = 0.01, 0.08
+        if visualisation_mode in ["water_index_mask", "Index Turbidité"]:
+            cmap = "Reds" if visualisation_mode == "Index Turbidité" else "Blues"
+
+        if window is not None:
             box_size_string = input.turbidity_selection_box_size()
             box_size = int(box_size_string[0])
             row, col = row_spot.get(), col_spot.get()
-            # row, col = row_col
-            min_row = max(0, row - offset)
-            max_row = min(row + offset, im.shape[0] - 1)
-            min_col = max(0, col - offset)
-            max_col = min(col + offset, im.shape[1] - 1)
-            im = im[min_row:max_row, min_col:max_col]
-            if alpha is not None:
-                alpha = alpha[min_row:max_row, min_col:max_col]
-                visualisation = visualisation[min_row:max_row, min_col:max_col]
-            row_point = row if min_row == 0 or max_row == im.shape[0] - 1 else offset
-            col_point = col if min_col == 0 or max_col == im.shape[1] - 1 else offset
-            row_box_start = row_point - box_size / 2
-            col_box_start = col_point - box_size / 2
-            ax.scatter(col_point, row_point, s=5)
+            min_row, max_row, min_col, max_col = window
+            ax.scatter(col, row, s=5)
             rect = patches.Rectangle(
-                (col_box_start, row_box_start),
+                (col - box_size / 2, row - box_size / 2),
                 box_size,
                 box_size,
                 linewidth=1,
@@ -372,10 +488,12 @@ def server_turbidity(input, output, session: Session):
                 facecolor="none",
             )
             ax.add_patch(rect)
-        ax.imshow(im)
+        # Only the pixels of the window at the plot resolution are drawn
+        im.imshow(ax, window)
         if visualisation is not None:
-            vis_ax = ax.imshow(
-                visualisation,
+            vis_ax = visualisation.imshow(
+                ax,
+                window,
                 interpolation="nearest",
                 cmap=cmap,
                 alpha=alpha,
@@ -384,18 +502,17 @@ def server_turbidity(input, output, session: Session):
             )
             if visualisation_mode == "Index Turbidité":
                 fig.colorbar(vis_ax, ax=ax, orientation="horizontal")
+        if window is not None:
+            ax.set_xlim(min_col - 0.5, max_col - 0.5)
+            ax.set_ylim(max_row - 0.5, min_row - 0.5)
         plt.title(image_handler.date[:10])
         fig.patch.set_visible(False)
         plt.tight_layout()
         return fig
 
-    @output
-    @render.plot
-    def generate_estuary_turbidity_plot():
+    @reactive.Calc
+    def get_estuary_turbidity_plot():
         turbidity_df = generate_turbidity_df()
-        turbidity_df.to_pickle("ze_test.pkl")
-        image_spot = input.turbidity_precise_location()
-        fig, ax = plt.subplots(1, 1, frameon=False)
         color_mapping_estuaries = {
             "bouctouche": {
                 "2023-05-11": "red",
@@ -414,44 +531,29 @@ def server_turbidity(input, output, session: Session):
             "morell": {"2023-05-10": "orange", "2023-07-24": "blue"},
         }
         estuary_name = input.turbidity_estuary_name().lower()
-        color_estuary_mapping = color_mapping_estuaries[estuary_name]
-        for date, color in color_estuary_mapping.items():
-            date_turbidity_df = turbidity_df.loc[turbidity_df["date"] == date]
-            spot_date_turbidity_df = date_turbidity_df.loc[
-                date_turbidity_df["location"] == image_spot
-            ]
-            non_spot_date_turbidity_df = date_turbidity_df.loc[
-                date_turbidity_df["location"] != image_spot
-            ]
-            alpha = 1 if image_spot == "Aucune" else 0.5
-            ax.scatter(
-                non_spot_date_turbidity_df["turbidity_index_value"].astype(float),
-                non_spot_date_turbidity_df["measure"].astype(float),
-                s=10,
-                c=color,
-                label=date,
-                alpha=alpha,
-                marker=".",
-            )
-            if image_spot != "Aucune":
-                ax.scatter(
-                    spot_date_turbidity_df["turbidity_index_value"].astype(float),
-                    spot_date_turbidity_df["measure"].astype(float),
-                    s=10,
-                    c=f"dark{color}",
-                    marker="x",
-                )
-            ax.set_xlabel(input.type_of_turbidity_index())
-            ylabel = (
-                "Turbidité (FNU)"
-                if input.turbidity_use_log_measure() is False
-                else "Log(Turbidité (FNU))"
-            )
-            ax.set_ylabel(ylabel)
-            ax.set_title(
-                f"Mesure de la turbidity In Situ en fonction d'un indice de {input.type_of_turbidity_index()}"
-            )
-        plt.legend()
-        fig.patch.set_visible(False)
-        plt.tight_layout()
-        return fig
+        ylabel = (
+            "Turbidité (FNU)"
+            if input.turbidity_use_log_measure() is False
+            else "Log(Turbidité (FNU))"
+        )
+        # The base scatter is drawn once per turbidity_df, see generate_estuary_turbidity_plot
+        estuary_turbidity_plot = HighlightScatterPlot(
+            turbidity_df["turbidity_index_value"],
+            turbidity_df["measure"],
+            turbidity_df["date"],
+            color_mapping_estuaries[estuary_name],
+            input.type_of_turbidity_index(),
+            ylabel,
+            f"Mesure de la turbidity In Situ en fonction d'un indice de {input.type_of_turbidity_index()}",
+        )
+        return estuary_turbidity_plot
+
+    @output
+    @render.plot
+    def generate_estuary_turbidity_plot():
+        turbidity_df = generate_turbidity_df()
+        image_spot = input.turbidity_precise_location()
+        alpha = 1 if image_spot == "Aucune" else 0.5
+        return get_estuary_turbidity_plot().render(
+            turbidity_df["location"] == image_spot, base_alpha=alpha
+        )
@@ -1,44 +1,53 @@
+from contextlib import closing
+import functools
+
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 import numpy
 from shiny import ui, render, reactive, Session
 from shiny.types import SilentException
 
-from satellite_image_handler.utils.normalize_index import create_water_index_raster
 from shiny.plotutils import near_points
 
 
-from turbidity_shiny.utils import (
-    load_json_data,
-    save_json_data,
-)
+from turbidity_shiny.background_task import create_background_calc
+from turbidity_shiny.catalog import connect_catalog, set_curation
+from turbidity_shiny.dataset_registry import get_session_owner
+from turbidity_shiny.image_pyramid import ImagePyramid, get_image_pyramid
+from turbidity_shiny.prefetch import RasterPrefetcher, get_neighbour_index_list
+from turbidity_shiny.scatter_plot import HighlightScatterPlot
 from turbidity_shiny.turbidity.turbidity_df import (
-    create_turbidity_fixed_df,
+    extract_turbidity_fixed_df,
     get_smoothed_turbidity_index_water_index_mask,
+    get_smoothed_turbidity_index_water_index_mask_window,
+    get_water_index_raster,
+    transform_turbidity_fixed_df,
 )
 from turbidity_shiny.turbidity.load_data import load_turbidity_fixed_data
 
 
 def server_turbidity_fixed(input, output, session: Session):
-    @reactive.Calc
-    def get_turbidity_data():
-        (
-            image_handler_list,
-            fixed_turbidity_data,
-            turbidity_geo_coordinate_dict,
-        ) = load_turbidity_fixed_data(
+    dataset_owner = get_session_owner(session, "turbidity_fixed")
+
+    # The data loading and the raster extraction run in worker threads, see
+    # create_background_calc
+    get_turbidity_data = create_background_calc(
+        functools.partial(load_turbidity_fixed_data, owner=dataset_owner),
+        lambda: (
             input.turbidity_fixed_estuary_name(),
             input.turbidity_fixed_atmoshperic_correction(),
             input.turbidity_fixed_year(),
-        )
-        return image_handler_list, fixed_turbidity_data, turbidity_geo_coordinate_dict
+        ),
+        "Chargement des images",
+    )
 
     @reactive.Calc
     def get_number_of_turbidity_image():
         return len(get_turbidity_data()[0])
 
-    @reactive.Calc
-    def generate_turbidity_df():
+    def get_extraction_argument_tuple():
+        # Only the raster parameters, the probe window and the outlier test are
+        # applied by generate_turbidity_df
         (
             image_handler_list,
             fixed_turbidity_data,
@@ -48,7 +57,7 @@ def server_turbidity_fixed(input, output, session: Session):
         box_size = int(box_size_string[0])
         water_index_mask_threshold = input.turbidity_fixed_water_index_mask_threshold()
         ndti_smoothed_sigma = input.turbidity_fixed_ndti_smoothed_sigma()
-        turbidity_df = create_turbidity_fixed_df(
+        return (
             image_handler_list,
             fixed_turbidity_data,
             turbidity_geo_coordinate_dict,
@@ -57,14 +66,26 @@ def server_turbidity_fixed(input, output, session: Session):
             ndti_smoothed_sigma,
             input.turbidity_fixed_type_of_turbidity_index(),
             True,
+        )
+
+    get_extracted_turbidity_df = create_background_calc(
+        extract_turbidity_fixed_df,
+        get_extraction_argument_tuple,
+        "Calcul des indices de turbidité",
+    )
+
+    @reactive.Calc
+    def generate_turbidity_df():
+        turbidity_df = transform_turbidity_fixed_df(
+            get_extracted_turbidity_df(),
+            get_turbidity_data()[1],
             input.turbidity_fixed_exclude_outlier(),
-            False,
             input.turbidity_fixed_turdibidty_df_window(),
         )
         return turbidity_df
 
     @reactive.Effect
-    @reactive.event(input.turbidity_fixed_estuary_name, input.turbidity_fixed_year)
+    @reactive.event(get_turbidity_data)
     def update_turbidity_slider_idx():
         number_of_image = get_number_of_turbidity_image()
         ui.update_slider(
@@ -163,98 +184,186 @@ def server_turbidity_fixed(input, output, session: Session):
         image_handler = get_turbidity_image_handler()
         date = image_handler.date[:10]
         estuary_name = input.turbidity_fixed_estuary_name().lower()
-        good_dates_data_path = "data/turbidity_fixed/good_dates.json"
-        good_dates_data = load_json_data(good_dates_data_path)
-        good_dates_data[estuary_name].append(date)
-        good_dates_data[estuary_name] = list(set(good_dates_data[estuary_name]))
-        good_dates_data[estuary_name] = sorted(good_dates_data[estuary_name])
-        save_json_data(good_dates_data, good_dates_data_path)
+        with closing(connect_catalog()) as connection:
+            set_curation(connection, "turbidity_fixed", estuary_name, date)
         ui.notification_show(f"{date} is saved", duration=1)
 
-    @output
-    @render.plot
-    def generate_turbidity_fixed_image():
-        image_handler = get_turbidity_image_handler()
-        fig, ax = plt.subplots(1, 1, frameon=False)
+    def get_visualisation_pyramid_tuple(
+        image_handler,
+        visualisation_mode,
+        water_index_mask_threshold,
+        ndti_smoothed_sigma,
+        type_of_turbidity_index,
+        window=None,
+    ):
+        """
+        Image pyramids of the background image, of the alpha mask and of the
+        overlay of a visualisation mode. Without reactive reads, so it can run
+        in the prefetch threads.
+
+        With a window (min_row, max_row, min_col, max_col), only the window of
+        the rasters is computed, except the background color image which is
+        shared by every view of the image.
+        """
+        if window is None:
+            window_slice = (slice(None), slice(None))
+
+            def get_pyramid(parameters, compute_function):
+                return get_image_pyramid(image_handler, parameters, compute_function)
+
+        else:
+            min_row, max_row, min_col, max_col = window
+            window_slice = (slice(min_row, max_row), slice(min_col, max_col))
+
+            def get_pyramid(parameters, compute_function):
+                return ImagePyramid(
+                    numpy.asarray(compute_function()), origin=(min_row, min_col)
+                )
+
         alpha = None
-        visualisation_mode = input.turbidity_fixed_visualisation()
         visualisation = None
-        cmap = None
-        vmin, vmax = None, None
         if visualisation_mode in [
             "Image couleur",
             "water_index_mask",
             "Index Turbidité",
         ]:
-            im = image_handler.true_color_image
+            im = get_image_pyramid(
+                image_handler,
+                ("true_color_image",),
+                lambda: image_handler.true_color_image,
+            )
         elif visualisation_mode == "water_index":
-            im = create_water_index_raster(image_handler)
+            im = get_pyramid(
+                ("water_index",),
+                lambda: get_water_index_raster(image_handler)[window_slice],
+            )
         elif visualisation_mode == "NIR":
-            im = image_handler.nir_band
-            vmin, vmax = 1_000, 10_000
-            cmap = "Reds"
+            im = get_pyramid(
+                ("nir_band",), lambda: image_handler.nir_band[window_slice]
+            )
             visualisation = im
             alpha = 1
         if visualisation_mode in ["water_index_mask", "Index Turbidité"]:
-            water_index_mask = (
-                create_water_index_raster(image_handler)
-                > input.turbidity_fixed_water_index_mask_threshold()
+            # Clean Water Mask from bridge
+            alpha = get_pyramid(
+                ("water_index_mask", water_index_mask_threshold, True),
+                lambda: (
+                    (
+                        get_water_index_raster(image_handler)[window_slice]
+                        > water_index_mask_threshold
+                    )
+                    * image_handler.get_mask_from_bridge_points_handler()[window_slice]
+                ).astype(numpy.float32),
             )
-            if True:
-                water_index_mask = (
-                    water_index_mask
-                    * image_handler.get_mask_from_bridge_points_handler()
-                )
-            alpha = water_index_mask.astype(float)
+            visualisation = alpha
             if visualisation_mode == "Index Turbidité":
-                smoothed_ndti_water_index_mask = (
-                    get_smoothed_turbidity_index_water_index_mask(
-                        image_handler,
-                        input.turbidity_fixed_water_index_mask_threshold(),
-                        input.turbidity_fixed_ndti_smoothed_sigma(),
-                        input.turbidity_fixed_type_of_turbidity_index(),
-                        True,
-                    )
+                smoothed_turbidity_index_parameters = (
+                    water_index_mask_threshold,
+                    ndti_smoothed_sigma,
+                    type_of_turbidity_index,
+                    True,
                 )
-                if input.turbidity_fixed_type_of_turbidity_index() == "NDTI":
-                    vmin, vmax = -0.05, 0.05
-                elif (
-                    input.turbidity_fixed_type_of_turbidity_index() == "(665nm)/(833nm)"
-                ):
-                    vmin, vmax = 0.8, 1.2
-                else:
-                    if input.turbidity_fixed_atmoshperic_correction() == "Sen2Cor":
-                        vmin, vmax = 1_000, 1_700
-                    elif input.turbidity_fixed_atmoshperic_correction() == "Acolite":
-                        vmin, vmax = 0.01, 0.08
-            visualisation = (
-                smoothed_ndti_water_index_mask
-                if visualisation_mode == "Index Turbidité"
-                else water_index_mask
-            )
+                visualisation = get_pyramid(
+                    ("smoothed_turbidity_index_water_index_mask",)
+                    + smoothed_turbidity_index_parameters,
+                    lambda: (
+                        get_smoothed_turbidity_index_water_index_mask(
+                            image_handler, *smoothed_turbidity_index_parameters
+                        )
+                        if window is None
+                        else get_smoothed_turbidity_index_water_index_mask_window(
+                            image_handler, window, *smoothed_turbidity_index_parameters
+                        )
+                    ),
+                )
+        return im, alpha, visualisation
+
+    @reactive.Calc
+    def get_turbidity_fixed_visualisation_window():
+        """
+        (min_row, max_row, min_col, max_col) of the view around the probe, None
+        when the whole image is shown.
+        """
+        if input.turbidity_fixed_precise_location() != "Mesure de Turbidité":
+            return None
+        row, col = get_row_col_of_turbidity_probe()
+        n_rows, n_cols = get_turbidity_image_handler().red_band.shape[:2]
+        offset = int(input.turbidity_fixed_visualisation_box_size() / 2)
+        return (
+            max(0, row - offset),
+            min(row + offset, n_rows - 1),
+            max(0, col - offset),
+            min(col + offset, n_cols - 1),
+        )
+
+    prefetcher = RasterPrefetcher()
+    session.on_ended(prefetcher.cancel)
+
+    # Lower priority than the outputs: the neighbours are prefetched once the
+    # image is shown, with the parameters of the image
+    @reactive.Effect(priority=-1)
+    def prefetch_neighbour_turbidity_fixed_images():
+        image_handler_list = get_turbidity_data()[0]
+        visualisation_parameters = (
+            input.turbidity_fixed_visualisation(),
+            input.turbidity_fixed_water_index_mask_threshold(),
+            input.turbidity_fixed_ndti_smoothed_sigma(),
+            input.turbidity_fixed_type_of_turbidity_index(),
+            get_turbidity_fixed_visualisation_window(),
+        )
+        prefetcher.prefetch(
+            [
+                functools.partial(
+                    get_visualisation_pyramid_tuple,
+                    image_handler_list[image_idx],
+                    *visualisation_parameters,
+                )
+                for image_idx in get_neighbour_index_list(
+                    input.turbidity_fixed_image_idx(), len(image_handler_list)
+                )
+            ]
+        )
+
+    @output
+    @render.plot
+    def generate_turbidity_fixed_image():
+        image_handler = get_turbidity_image_handler()
+        fig, ax = plt.subplots(1, 1, frameon=False)
+        visualisation_mode = input.turbidity_fixed_visualisation()
+        cmap = None
+        vmin, vmax = None, None
+        window = get_turbidity_fixed_visualisation_window()
+        im, alpha, visualisation = get_visualisation_pyramid_tuple(
+            image_handler,
+            visualisation_mode,
+            input.turbidity_fixed_water_index_mask_threshold(),
+            input.turbidity_fixed_ndti_smoothed_sigma(),
+            input.turbidity_fixed_type_of_turbidity_index(),
+            window,
+        )
+        if visualisation_mode == "NIR":
+            vmin, vmax = 1_000, 10_000
+            cmap = "Reds"
+        elif visualisation_mode == "Index Turbidité":
+            if input.turbidity_fixed_type_of_turbidity_index() == "NDTI":
+                vmin, vmax = -0.05, 0.05
+            elif input.turbidity_fixed_type_of_turbidity_index() == "(665nm)/(833nm)":
+                vmin, vmax = 0.8, 1.2
+            else:
+                if input.turbidity_fixed_atmoshperic_correction() == "Sen2Cor":
+                    vmin, vmax = 1_000, 1_700
+                elif input.turbidity_fixed_atmoshperic_correction() == "Acolite":
+                    vmin, vmax = 0.01, 0.08
+        if visualisation_mode in ["water_index_mask", "Index Turbidité"]:
             cmap = "Reds" if visualisation_mode == "Index Turbidité" else "Blues"
 
         row, col = get_row_col_of_turbidity_probe()
-        if input.turbidity_fixed_precise_location() == "Mesure de Turbidité":
-            offset = int(input.turbidity_fixed_visualisation_box_size() / 2)
+        if window is not None:
             box_size_string = input.turbidity_fixed_selection_box_size()
             box_size = int(box_size_string[0])
-            min_row = max(0, row - offset)
-            max_row = min(row + offset, im.shape[0] - 1)
-            min_col = max(0, col - offset)
-            max_col = min(col + offset, im.shape[1] - 1)
-
-            im = im[min_row:max_row, min_col:max_col]
-            if alpha is not None:
-                alpha = alpha[min_row:max_row, min_col:max_col]
-                visualisation = visualisation[min_row:max_row, min_col:max_col]
-            row_point = row if min_row == 0 or max_row == im.shape[0] - 1 else offset
-            col_point = col if min_col == 0 or max_col == im.shape[1] - 1 else offset
-            row_box_start = row_point - box_size / 2
-            col_box_start = col_point - box_size / 2
-
+            min_row, max_row, min_col, max_col = window
             rect = patches.Rectangle(
-                (col_box_start, row_box_start),
+                (col - box_size / 2, row - box_size / 2),
                 box_size,
                 box_size,
                 linewidth=1,
@@ -262,14 +371,14 @@ def server_turbidity_fixed(input, output, session: Session):
                 facecolor="none",
             )
             ax.add_patch(rect)
-        else:
-            row_point, col_point = row, col
 
-        ax.scatter(col_point, row_point, s=5)
-        ax.imshow(im)
+        ax.scatter(col, row, s=5)
+        # Only the pixels of the window at the plot resolution are drawn
+        im.imshow(ax, window)
         if visualisation is not None:
-            vis_ax = ax.imshow(
-                visualisation,
+            vis_ax = visualisation.imshow(
+                ax,
+                window,
                 interpolation="nearest",
                 cmap=cmap,
                 alpha=alpha,
@@ -278,59 +387,44 @@ def server_turbidity_fixed(input, output, session: Session):
             )
             if visualisation_mode in ["Index Turbidité", "NIR"]:
                 fig.colorbar(vis_ax, ax=ax, orientation="horizontal")
+        if window is not None:
+            ax.set_xlim(min_col - 0.5, max_col - 0.5)
+            ax.set_ylim(max_row - 0.5, min_row - 0.5)
         plt.title(image_handler.date[:10])
         fig.patch.set_visible(False)
         plt.tight_layout()
         return fig
 
-    @output
-    @render.plot
-    def generate_estuary_turbidity_fixed_plot():
+    @reactive.Calc
+    def get_estuary_turbidity_fixed_plot():
         color_mapping_years = {"2022": "orange", "2023": "blue"}
         turbidity_df = generate_turbidity_df()
-        image_handler = get_turbidity_image_handler()
-        image_date = image_handler.date[:10]
-        fig, ax = plt.subplots(1, 1, frameon=False)
-
-        for year, color in color_mapping_years.items():
-            year_turbidity_df = turbidity_df.loc[
-                turbidity_df["date"].apply(lambda date_: date_[:4] == year)
-            ]
-            if len(year_turbidity_df) == 0:
-                continue
-            date_turbidity_df = year_turbidity_df.loc[
-                year_turbidity_df["date"] == image_date
-            ]
-            non_date_turbidity_df = year_turbidity_df.loc[
-                year_turbidity_df["date"] != image_date
-            ]
-            ax.scatter(
-                non_date_turbidity_df["turbidity_index_value"].astype(float),
-                non_date_turbidity_df["measure"].astype(float),
-                s=10,
-                color=color,
-                marker=".",
-                label=year,
-            )
-            ax.scatter(
-                date_turbidity_df["turbidity_index_value"].astype(float),
-                date_turbidity_df["measure"].astype(float),
-                s=10,
-                c=f"dark{color}",
-                marker="x",
-            )
-        ax.set_xlabel(input.turbidity_fixed_type_of_turbidity_index())
+        year_array = turbidity_df["date"].str[:4]
         ylabel = (
             "Turbidité (FNU)"
             if input.turbidity_fixed_use_log_measure() is False
             else "Log(Turbidité (FNU))"
         )
-        ax.set_ylabel(ylabel)
-        ax.set_title(
-            f"Mesure de la turbidity In Situ en fonction d'un indice de {input.turbidity_fixed_type_of_turbidity_index()}"
+        # The base scatter is drawn once per turbidity_df, see generate_estuary_turbidity_fixed_plot
+        return HighlightScatterPlot(
+            turbidity_df["turbidity_index_value"],
+            turbidity_df["measure"],
+            year_array,
+            {
+                year: color
+                for year, color in color_mapping_years.items()
+                if (year_array == year).any()
+            },
+            input.turbidity_fixed_type_of_turbidity_index(),
+            ylabel,
+            f"Mesure de la turbidity In Situ en fonction d'un indice de {input.turbidity_fixed_type_of_turbidity_index()}",
+        )
+
+    @output
+    @render.plot
+    def generate_estuary_turbidity_fixed_plot():
+        turbidity_df = generate_turbidity_df()
+        image_date = get_turbidity_image_handler().date[:10]
+        return get_estuary_turbidity_fixed_plot().render(
+            turbidity_df["date"] == image_date
         )
-        plt.legend()
-        # ax.set_ylim(0,40)
-        fig.patch.set_visible(False)
-        plt.tight_layout()
-        return fig
@@ -1,22 +1,24 @@
 import matplotlib.pyplot as plt
 from shiny import ui, render, reactive, Session
-from skimage import filters
-from scipy import ndimage
-from satellite_image_handler.utils.normalize_index import create_ndwi_raster
 
-from turbidity_shiny.utils import load_pickle_data
+from turbidity_shiny.dataset_registry import get_session_owner
+from turbidity_shiny.image_pyramid import get_image_pyramid
+from turbidity_shiny.turbidity.load_data import load_water_image_handler_list
+from turbidity_shiny.water_mask import get_water_mask_edge_dict
 from information import (
     SCENE_CLF_WATER_MASK_INFO_HTML,
     NDWI_WATER_MASK_INFO_HTML,
-    INFORMATION_STRING,
 )
 
 
 def server_water(input, output, session: Session):
+    dataset_owner = get_session_owner(session, "water")
+
     @reactive.Calc
     def load_water_data():
-        estuary_name = input.water_estuary_name().lower()
-        data = load_pickle_data(f"data/{estuary_name}_2022.lzma.pkl")
+        data = load_water_image_handler_list(
+            input.water_estuary_name(), owner=dataset_owner
+        )
         return data
 
     @reactive.Calc
@@ -140,11 +142,6 @@ def server_water(input, output, session: Session):
             ui.remove_ui("#ndwi-water-1st-threshold")
             ui.remove_ui("#ndwi-water-2nd-threshold")
 
-    @output
-    @render.text
-    def general_informations():
-        return INFORMATION_STRING
-
     @output
     @render.text
     def turbidity_info():
@@ -171,43 +168,39 @@ def server_water(input, output, session: Session):
 
     @reactive.Calc
     def get_water_mask_dict():
-        water_mask_dict = {}
+        scene_clf_parameters = None
         if input.switch_scene_clf_water_mask() is True:
-            sigma = input.scene_clf_water_sigma()
-            threshold = input.scene_clf_water_threshold()
-            image_handler = get_water_image_handler()
-            water_mask = image_handler.get_smoothed_water_mask(
-                sigma=sigma, threshold=threshold
+            scene_clf_parameters = (
+                input.scene_clf_water_sigma(),
+                input.scene_clf_water_threshold(),
             )
-            edge_sobel = filters.sobel(water_mask)
-            edge_sobel_mask = edge_sobel >= 0.25
+        ndwi_parameters = None
+        if input.switch_ndwi_water_mask() is True:
+            ndwi_parameters = (
+                input.ndwi_water_sigma(),
+                input.ndwi_water_1st_threshold(),
+                input.ndwi_water_2nd_threshold(),
+            )
+        # The edges are cached per image and parameters, see
+        # get_water_mask_edge_dict
+        water_mask_edge_dict = get_water_mask_edge_dict(
+            get_water_image_handler(), scene_clf_parameters, ndwi_parameters
+        )
+        water_mask_dict = {}
+        if "scene_clf_water_mask" in water_mask_edge_dict:
             water_mask_dict["scene_clf_water_mask"] = {
                 "label": "Scene Clf",
-                "mask": edge_sobel_mask,
+                "mask": water_mask_edge_dict["scene_clf_water_mask"],
+                "parameters": ("scene_clf_water_mask_edge",) + scene_clf_parameters,
                 "cmap": "Reds",
             }
-
-        if input.switch_ndwi_water_mask() is True:
-            sigma = input.ndwi_water_sigma()
-            threshold_1 = input.ndwi_water_1st_threshold()
-            threshold_2 = input.ndwi_water_2nd_threshold()
-            image_handler = get_water_image_handler()
-            ndwi_water_mask = (
-                create_ndwi_raster(image_handler.green_band, image_handler.nir_band)
-                > threshold_1
-            )
-            ndwi_water_mask = (
-                ndimage.gaussian_filter(ndwi_water_mask.astype(float), sigma=sigma)
-                > threshold_2
-            )
-            ndwi_edge_sobel = filters.sobel(ndwi_water_mask)
-            ndwi_edge_sobel_mask = ndwi_edge_sobel >= 0.25
+        if "ndwi_water_mask" in water_mask_edge_dict:
             water_mask_dict["ndwi_water_mask"] = {
                 "label": "NDWI",
-                "mask": ndwi_edge_sobel_mask,
+                "mask": water_mask_edge_dict["ndwi_water_mask"],
+                "parameters": ("ndwi_water_mask_edge",) + ndwi_parameters,
                 "cmap": "Blues",
             }
-
         return water_mask_dict
 
     xmin = reactive.Value(None)
@@ -244,18 +237,45 @@ def server_water(input, output, session: Session):
             ymin.set(None)
             ymax.set(None)
 
+    @reactive.Calc
+    def get_water_mask_pyramid_dict():
+        # Masks are thin edges, "max" keeps them visible once downsampled. The
+        # pyramids are cached with the packed edges, per image and parameters
+        image_handler = get_water_image_handler()
+        return {
+            water_mask_name: get_image_pyramid(
+                image_handler,
+                water_mask_dict["parameters"],
+                water_mask_dict["mask"].unpack,
+                "max",
+            )
+            for water_mask_name, water_mask_dict in get_water_mask_dict().items()
+        }
+
     @output
     @render.plot
     def generate_water_image():
         image_handler = get_water_image_handler()
-        rgb_im = image_handler.true_color_image
+        rgb_im = get_image_pyramid(
+            image_handler,
+            ("true_color_image",),
+            lambda: image_handler.true_color_image,
+        )
+        window = None
+        if None not in (xmin.get(), xmax.get(), ymin.get(), ymax.get()):
+            min_row, max_row = sorted((ymin.get(), ymax.get()))
+            min_col, max_col = sorted((xmin.get(), xmax.get()))
+            min_row, max_row = max(0, min_row), min(max_row + 1, rgb_im.shape[0])
+            min_col, max_col = max(0, min_col), min(max_col + 1, rgb_im.shape[1])
+            if min_row < max_row and min_col < max_col:
+                window = (min_row, max_row, min_col, max_col)
         fig, ax = plt.subplots(1, 1, frameon=False)
-        ax.imshow(rgb_im)
+        rgb_im.imshow(ax, window)
         for water_mask_name, water_mask_dict in get_water_mask_dict().items():
             label = water_mask_dict["label"]
-            mask = water_mask_dict["mask"]
+            mask = get_water_mask_pyramid_dict()[water_mask_name]
             cmap = water_mask_dict["cmap"]
-            ax.imshow(mask, interpolation="nearest", cmap=cmap, alpha=mask * 1.0)
+            mask.imshow(ax, window, interpolation="nearest", cmap=cmap, alpha=mask)
             ax.plot(0, 0, c=cmap[0].lower(), label=label)
             plt.legend()
         # plt.axis("off")
@@ -0,0 +1,73 @@
+import warnings
+
+import numpy
+import pytest
+
+from turbidity_shiny.turbidity.box_statistics import get_box_statistics
+
+
+N_ROWS, N_COLS = 20, 30
+
+
+def create_raster(seed=0):
+    rng = numpy.random.default_rng(seed)
+    raster = rng.random((N_ROWS, N_COLS)) * 10
+    raster[rng.random((N_ROWS, N_COLS)) < 0.2] = numpy.nan
+    return raster
+
+
+def get_reference_box_statistics(raster, row, col, box_size):
+    """
+    numpy.nanmean and numpy.nanstd of the window clipped to the raster by hand.
+    """
+    box_size_offset = box_size // 2
+    row_slice = slice(max(0, row - box_size_offset), row + box_size_offset + 1)
+    col_slice = slice(max(0, col - box_size_offset), col + box_size_offset + 1)
+    box = raster[row_slice, col_slice]
+    # A box without any valid pixel is NaN, as in get_box_statistics
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return numpy.nanmean(box), numpy.nanstd(box)
+
+
+# Points on the four borders and in the corners, where the boxes are clipped
+BORDER_POINT_LIST = [
+    (0, 15),
+    (1, 15),
+    (N_ROWS - 1, 15),
+    (N_ROWS - 2, 15),
+    (10, 0),
+    (10, 1),
+    (10, N_COLS - 1),
+    (10, N_COLS - 2),
+    (0, 0),
+    (0, N_COLS - 1),
+    (N_ROWS - 1, 0),
+    (N_ROWS - 1, N_COLS - 1),
+    (10, 15),
+]
+
+
+@pytest.mark.parametrize("box_size", [1, 3, 5, 7])
+def test_box_statistics_match_nan_statistics_on_clipped_boxes(box_size):
+    raster = create_raster()
+    row_array = numpy.array([row for row, _ in BORDER_POINT_LIST])
+    col_array = numpy.array([col for _, col in BORDER_POINT_LIST])
+    mean_array, std_array = get_box_statistics(raster, row_array, col_array, box_size)
+    for (row, col), mean, std in zip(BORDER_POINT_LIST, mean_array, std_array):
+        reference_mean, reference_std = get_reference_box_statistics(
+            raster, row, col, box_size
+        )
+        numpy.testing.assert_allclose(mean, reference_mean, rtol=1e-10, atol=1e-12)
+        numpy.testing.assert_allclose(std, reference_std, rtol=1e-8, atol=1e-10)
+
+
+@pytest.mark.parametrize(
+    "row, col", [(-1, 10), (10, -1), (N_ROWS, 10), (10, N_COLS), (-5, -5)]
+)
+def test_box_statistics_outside_raster_are_nan(row, col):
+    mean_array, std_array = get_box_statistics(
+        create_raster(), numpy.array([row]), numpy.array([col]), 5
+    )
+    assert numpy.isnan(mean_array[0])
+    assert numpy.isnan(std_array[0])
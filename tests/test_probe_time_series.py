@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import numpy
+import pandas
+import pytest
+
+from turbidity_shiny.turbidity.probe_time_series import ProbeTimeSeries
+
+
+def match_image_date(turbidity_df, image_date, window=0):
+    """
+    Matching of a single image by a scan of every measure, as it was done before
+    ProbeTimeSeries.
+    """
+    image_date = datetime.strptime(image_date[:19], "%Y-%m-%dT%H:%M:%S")
+    image_date = image_date - timedelta(hours=4)
+    argmin_idx_location = (turbidity_df["date"] - image_date).abs().argmin()
+    window_slice = slice(argmin_idx_location - window, argmin_idx_location + window)
+    turbidity = turbidity_df.loc[window_slice]["filtered_interpolated_turbidity"].mean()
+    time_diff = turbidity_df.loc[argmin_idx_location]["date"] - image_date
+    return turbidity, time_diff
+
+
+def create_probe_data(seed=0):
+    """
+    Measures every 15 minutes for 3 days, in local time, with a few NaN.
+    """
+    rng = numpy.random.default_rng(seed)
+    date_index = pandas.date_range("2023-07-20 00:00", periods=3 * 96, freq="15min")
+    value_array = rng.random(len(date_index)) * 30
+    value_array[rng.random(len(date_index)) < 0.1] = numpy.nan
+    return pandas.DataFrame(
+        {"date": date_index, "filtered_interpolated_turbidity": value_array}
+    )
+
+
+IMAGE_DATE_LIST = [
+    "2023-07-20T15:17:01.000Z",
+    "2023-07-21T15:07:30.000Z",
+    "2023-07-22T14:52:29.000Z",
+    # First and last measures and their neighbours
+    "2023-07-20T04:00:00.000Z",
+    "2023-07-23T03:45:00.000Z",
+    # Out of the range of the measures
+    "2023-07-10T15:17:01.000Z",
+    "2023-07-19T23:00:00.000Z",
+    "2023-07-25T15:17:01.000Z",
+]
+
+
+@pytest.mark.parametrize("window", [0, 1, 2, 5])
+def test_match_is_the_single_image_scan(window):
+    probe_data = create_probe_data()
+    turbidity_array, time_diff_index = ProbeTimeSeries(probe_data).match(
+        IMAGE_DATE_LIST, window
+    )
+    for image_date, turbidity, time_diff in zip(
+        IMAGE_DATE_LIST, turbidity_array, time_diff_index
+    ):
+        reference_turbidity, reference_time_diff = match_image_date(
+            probe_data, image_date, window
+        )
+        numpy.testing.assert_allclose(turbidity, reference_turbidity, rtol=1e-12)
+        assert time_diff == reference_time_diff
+
+
+def test_match_unsorted_data():
+    probe_data = create_probe_data()
+    shuffled_probe_data = probe_data.sample(frac=1, random_state=0)
+    turbidity_array, time_diff_index = ProbeTimeSeries(shuffled_probe_data).match(
+        IMAGE_DATE_LIST, 2
+    )
+    reference_turbidity_array, reference_time_diff_index = ProbeTimeSeries(
+        probe_data
+    ).match(IMAGE_DATE_LIST, 2)
+    numpy.testing.assert_array_equal(turbidity_array, reference_turbidity_array)
+    assert (time_diff_index == reference_time_diff_index).all()
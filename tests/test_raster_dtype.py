@@ -0,0 +1,80 @@
+import numpy
+import pytest
+from satellite_image_handler.utils.normalize_index import create_water_index_raster
+
+from turbidity_shiny.band_store import load_band_store, write_band_store
+from turbidity_shiny.benchmark import SyntheticImageHandler
+from turbidity_shiny.turbidity.turbidity_df import (
+    RASTER_DTYPE_TOLERANCE,
+    get_raster_dtype_difference,
+)
+from turbidity_shiny.turbidity_index import TURBIDITY_INDEX_TYPE_LIST
+
+
+WATER_INDEX_THRESHOLD = -0.05
+
+
+def create_image_handler(float_reflectance=False):
+    image_handler = SyntheticImageHandler("2023-07-20T15:17:01.000Z", (200, 200))
+    if float_reflectance:
+        # Acolite products store float reflectances instead of integers
+        for band_name in ["red_band", "green_band", "blue_band", "nir_band"]:
+            band = getattr(image_handler, band_name)
+            setattr(image_handler, band_name, band / 10_000 + 1e-7)
+    return image_handler
+
+
+def create_stored_image_handler(tmp_path, float_reflectance=False):
+    """
+    Image handler read from a band store, with its float32 water index layer.
+    """
+    store_path = tmp_path / "synthetic.band_store"
+    write_band_store([create_image_handler(float_reflectance)], store_path)
+    return load_band_store(store_path)[0]
+
+
+@pytest.mark.parametrize("stored", [False, True])
+@pytest.mark.parametrize("float_reflectance", [False, True])
+@pytest.mark.parametrize("ndti_smoothed_sigma", [0, 1, 3])
+@pytest.mark.parametrize("type_of_turbidity_index", TURBIDITY_INDEX_TYPE_LIST)
+def test_float32_difference_below_tolerance(
+    tmp_path, type_of_turbidity_index, ndti_smoothed_sigma, float_reflectance, stored
+):
+    image_handler = (
+        create_stored_image_handler(tmp_path, float_reflectance)
+        if stored
+        else create_image_handler(float_reflectance)
+    )
+    (
+        relative_difference,
+        same_nan,
+        mask_difference_count,
+    ) = get_raster_dtype_difference(
+        image_handler,
+        WATER_INDEX_THRESHOLD,
+        ndti_smoothed_sigma,
+        type_of_turbidity_index,
+        dtype=numpy.float32,
+    )
+    assert mask_difference_count == 0
+    assert same_nan
+    assert relative_difference < RASTER_DTYPE_TOLERANCE
+
+
+def test_float32_water_index_flip_is_counted(tmp_path):
+    # A threshold between the float32 and the float64 water index of a pixel
+    # flips that pixel of the float32 water index mask
+    image_handler = create_stored_image_handler(tmp_path)
+    water_index = numpy.asarray(
+        create_water_index_raster(image_handler), dtype=numpy.float64
+    )
+    float32_water_index = water_index.astype(numpy.float32).astype(numpy.float64)
+    flip_index = numpy.flatnonzero(float32_water_index < water_index)[0]
+    water_index_threshold = (
+        float32_water_index.flat[flip_index] + water_index.flat[flip_index]
+    ) / 2
+    _, same_nan, mask_difference_count = get_raster_dtype_difference(
+        image_handler, water_index_threshold, 0, "NDTI", dtype=numpy.float32
+    )
+    assert mask_difference_count >= 1
+    assert not same_nan
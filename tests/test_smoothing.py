@@ -0,0 +1,65 @@
+import numpy
+import pytest
+
+from turbidity_shiny.smoothing import smooth_raster_astropy, smooth_raster_separable
+
+
+# astropy warns about the NaN blocks larger than its kernel, they are on purpose
+pytestmark = pytest.mark.filterwarnings(
+    "ignore::astropy.utils.exceptions.AstropyUserWarning"
+)
+
+
+def create_raster(shape=(60, 80), seed=0):
+    """
+    Random raster with scattered NaN holes and NaN blocks on its edges and
+    corners, the pattern of land and clouds around an estuary.
+    """
+    rng = numpy.random.default_rng(seed)
+    raster = rng.random(shape) * 100
+    raster[rng.random(shape) < 0.1] = numpy.nan
+    raster[:8, :10] = numpy.nan
+    raster[-5:, :] = numpy.nan
+    raster[20:30, -12:] = numpy.nan
+    raster[30:40, 30:45] = numpy.nan
+    return raster
+
+
+@pytest.mark.parametrize("sigma", [0.5, 1, 2, 3])
+def test_separable_matches_astropy(sigma):
+    raster = create_raster()
+    smoothed_raster = smooth_raster_separable(raster, sigma)
+    reference_smoothed_raster = smooth_raster_astropy(raster, sigma)
+    assert smoothed_raster.dtype == numpy.float64
+    numpy.testing.assert_array_equal(
+        numpy.isnan(smoothed_raster), numpy.isnan(reference_smoothed_raster)
+    )
+    numpy.testing.assert_allclose(
+        smoothed_raster, reference_smoothed_raster, rtol=0, atol=1e-10
+    )
+
+
+@pytest.mark.parametrize("sigma", [1, 2])
+def test_separable_matches_astropy_float32(sigma):
+    raster = create_raster().astype(numpy.float32)
+    smoothed_raster = smooth_raster_separable(raster, sigma)
+    reference_smoothed_raster = smooth_raster_astropy(raster, sigma)
+    assert smoothed_raster.dtype == numpy.float32
+    numpy.testing.assert_array_equal(
+        numpy.isnan(smoothed_raster), numpy.isnan(reference_smoothed_raster)
+    )
+    numpy.testing.assert_allclose(
+        smoothed_raster, reference_smoothed_raster, rtol=1e-5, atol=1e-4
+    )
+
+
+def test_separable_fully_masked_window_is_nan():
+    # A block wider than the kernel has pixels without any valid neighbour
+    raster = create_raster()
+    raster[10:30, 10:30] = numpy.nan
+    smoothed_raster = smooth_raster_separable(raster, 1)
+    reference_smoothed_raster = smooth_raster_astropy(raster, 1)
+    assert numpy.isnan(smoothed_raster[20, 20])
+    numpy.testing.assert_array_equal(
+        numpy.isnan(smoothed_raster), numpy.isnan(reference_smoothed_raster)
+    )
@@ -0,0 +1,180 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+from shiny import reactive, req, ui
+from shiny.session import get_current_session
+
+
+# Threads shared by the background tasks of every session
+BACKGROUND_TASK_MAX_WORKERS = int(
+    os.environ.get("TURBIDITY_SHINY_BACKGROUND_WORKERS", 4)
+)
+BACKGROUND_TASK_POLL_SECONDS = 0.25
+
+_background_executor = None
+_background_executor_lock = threading.Lock()
+
+
+def get_background_executor(max_workers=BACKGROUND_TASK_MAX_WORKERS):
+    """
+    Process-wide thread pool of the background tasks, created on first use.
+    """
+    global _background_executor
+    with _background_executor_lock:
+        if _background_executor is None:
+            _background_executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="background_task"
+            )
+        return _background_executor
+
+
+class TaskCancelledError(Exception):
+    """
+    Raised inside a background task by its progress callback once the task has
+    been superseded or cancelled.
+    """
+
+
+class TaskProgress:
+    """
+    Progress callback given to a background task as ``progress_callback``.
+
+    The task calls ``progress_callback(value, total)`` from its main loop, which
+    also raises TaskCancelledError when the task has been cancelled.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self.total = None
+        self._cancelled = threading.Event()
+
+    def __call__(self, value, total=None):
+        if self._cancelled.is_set():
+            raise TaskCancelledError
+        self.value = value
+        self.total = total
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def fraction(self):
+        if not self.total:
+            return None
+        return min(self.value / self.total, 1)
+
+    def cancel(self):
+        self._cancelled.set()
+
+
+class BackgroundTask:
+    """
+    Run the latest request of a computation in a worker thread.
+
+    Submitting a new request cancels the previous one: it is dropped if it did
+    not start, and stopped at its next progress_callback call otherwise.
+    """
+
+    def __init__(self, max_workers=BACKGROUND_TASK_MAX_WORKERS):
+        self.max_workers = max_workers
+        self.generation = 0
+        self.future = None
+        self.progress = None
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Run ``function(*args, progress_callback=progress, **kwargs)`` and return
+        the generation of the request.
+        """
+        with self._lock:
+            self._cancel()
+            self.generation += 1
+            self.progress = TaskProgress()
+            self.future = get_background_executor(self.max_workers).submit(
+                function, *args, progress_callback=self.progress, **kwargs
+            )
+            return self.generation
+
+    def cancel(self):
+        with self._lock:
+            self._cancel()
+
+    def _cancel(self):
+        if self.future is not None:
+            self.future.cancel()
+            self.progress.cancel()
+
+
+def create_background_calc(
+    function,
+    get_argument_tuple,
+    message,
+    poll_seconds=BACKGROUND_TASK_POLL_SECONDS,
+):
+    """
+    Reactive Calc of ``function(*get_argument_tuple())`` computed by a
+    BackgroundTask, so the event loop of the session is never blocked.
+
+    get_argument_tuple is evaluated reactively on the event loop. When its
+    inputs change, the running computation is cancelled and a new one is
+    started: superseded requests are dropped, never queued. While it runs, a
+    progress bar with ``message`` is shown, and the Calc raises a silent
+    exception so the outputs using it wait for the result. Errors of function
+    are raised by the Calc.
+
+    Must be called from a server function.
+
+    Example:
+    >>> get_turbidity_df = create_background_calc(
+    ...     create_turbidity_df, lambda: (input.estuary_name(), ...), "Calcul"
+    ... )
+    """
+    session = get_current_session()
+    task = BackgroundTask()
+    session.on_ended(task.cancel)
+    submitted_generation = reactive.Value(None)
+    # (generation, result, error) of the last finished request
+    result_value = reactive.Value(None)
+    progress_list = []
+
+    @reactive.Effect
+    def submit_background_task():
+        # The running request is stale as soon as its arguments are invalidated,
+        # even if the new ones are not available yet
+        task.cancel()
+        submitted_generation.set(None)
+        argument_tuple = get_argument_tuple()
+        submitted_generation.set(task.submit(function, *argument_tuple))
+
+    @reactive.Effect
+    def poll_background_task():
+        generation = submitted_generation.get()
+        if generation is None:
+            if len(progress_list) > 0:
+                progress_list.pop().close()
+            return
+        if len(progress_list) == 0:
+            progress_list.append(ui.Progress(session=session))
+        if not task.future.done():
+            progress_list[0].set(task.progress.fraction, message)
+            reactive.invalidate_later(poll_seconds)
+            return
+        progress_list.pop().close()
+        try:
+            result_value.set((generation, task.future.result(), None))
+        except Exception as error:
+            result_value.set((generation, None, error))
+
+    @reactive.Calc
+    def get_background_result():
+        result = result_value.get()
+        req(result is not None and result[0] == submitted_generation.get())
+        _, value, error = result
+        if error is not None:
+            raise error
+        return value
+
+    return get_background_result
@@ -0,0 +1,249 @@
+import copy
+import json
+from pathlib import Path
+import pickle
+import re
+
+import numpy
+from satellite_image_handler.utils.normalize_index import create_water_index_raster
+
+from turbidity_shiny.utils import load_pickle_data
+
+
+BAND_STORE_INDEX_NAME = "index.json"
+BAND_STORE_VERSION = 1
+# Arrays smaller than this stay in the pickled skeleton of the image handler
+MIN_STORED_ARRAY_SIZE = 1024
+# Arrays computed from the image handler at build time, not attributes of the handler
+DERIVED_ARRAY_NAME_SET = {"bridge_mask", "water_index"}
+WATER_INDEX_DTYPE = numpy.float32
+
+
+def get_band_store_path(pickle_path):
+    """
+    Band store directory matching a pickle path.
+
+    "data/turbidity/dunk_2023.pkl" and "data/dunk_2022.lzma.pkl" are stored in
+    "data/turbidity/dunk_2023" and "data/dunk_2022".
+    """
+    return Path(re.sub(r"(\.lzma|\.gz)?\.pkl$", "", str(pickle_path)))
+
+
+def get_image_directory_name(date):
+    return re.sub(r"[^0-9A-Za-z]", "", date)
+
+
+def split_image_handler_arrays(image_handler):
+    """
+    Split an image handler in a skeleton without its large arrays and those arrays.
+
+    Arrays are looked for in the handler attributes and in its dict attributes.
+
+    Returns:
+        tuple:
+            1. Shallow copy of the handler with the large arrays set to None.
+            2. dict: Mapping of the array name, "attribute" or "attribute/key",
+               to the array.
+    """
+    skeleton = copy.copy(image_handler)
+    array_dict = {}
+    for attribute, value in vars(image_handler).items():
+        if isinstance(value, numpy.ndarray) and value.size >= MIN_STORED_ARRAY_SIZE:
+            array_dict[attribute] = value
+            setattr(skeleton, attribute, None)
+        elif isinstance(value, dict) and any(
+            isinstance(item, numpy.ndarray) and item.size >= MIN_STORED_ARRAY_SIZE
+            for item in value.values()
+        ):
+            skeleton_value = dict(value)
+            for key, item in value.items():
+                if (
+                    isinstance(item, numpy.ndarray)
+                    and item.size >= MIN_STORED_ARRAY_SIZE
+                ):
+                    array_dict[f"{attribute}/{key}"] = item
+                    skeleton_value[key] = None
+            setattr(skeleton, attribute, skeleton_value)
+    return skeleton, array_dict
+
+
+def load_band_store_index(store_path):
+    index_path = Path(store_path) / BAND_STORE_INDEX_NAME
+    if not index_path.exists():
+        return {"version": BAND_STORE_VERSION, "images": []}
+    with open(index_path, "r") as f:
+        return json.load(f)
+
+
+def save_band_store_index(index, store_path):
+    index_path = Path(store_path) / BAND_STORE_INDEX_NAME
+    tmp_index_path = index_path.with_suffix(".tmp")
+    with open(tmp_index_path, "w") as f:
+        json.dump(index, f, indent=2)
+    tmp_index_path.replace(index_path)
+
+
+def write_image_handler(image_handler, store_path, bridge_mask=True, water_index=True):
+    """
+    Write one image handler in the band store directory and return its metadata.
+
+    Every large array is saved as a .npy file, the rest of the handler is
+    pickled in "skeleton.pkl". With bridge_mask, the output of
+    get_mask_from_bridge_points_handler is also saved. With water_index, the
+    output of create_water_index_raster is saved as float32.
+    """
+    directory_name = get_image_directory_name(image_handler.date)
+    image_path = Path(store_path) / directory_name
+    image_path.mkdir(parents=True, exist_ok=True)
+    skeleton, array_dict = split_image_handler_arrays(image_handler)
+    if bridge_mask is True:
+        array_dict["bridge_mask"] = numpy.asarray(
+            image_handler.get_mask_from_bridge_points_handler()
+        )
+    if water_index is True:
+        array_dict["water_index"] = numpy.asarray(
+            create_water_index_raster(image_handler), dtype=WATER_INDEX_DTYPE
+        )
+    array_file_dict = {}
+    for array_name, array in array_dict.items():
+        file_name = f"{array_name.replace('/', '__')}.npy"
+        numpy.save(image_path / file_name, numpy.ascontiguousarray(array))
+        array_file_dict[array_name] = file_name
+    with open(image_path / "skeleton.pkl", "wb") as f:
+        pickle.dump(skeleton, f)
+    return {
+        "date": image_handler.date,
+        "directory": directory_name,
+        "arrays": array_file_dict,
+    }
+
+
+def add_image_handler_list_to_band_store(
+    image_handler_list, store_path, bridge_mask=True, water_index=True
+):
+    """
+    Add image handlers to a band store, replacing the images with the same date.
+    The index is kept sorted by date and written last.
+    """
+    store_path = Path(store_path)
+    store_path.mkdir(parents=True, exist_ok=True)
+    index = load_band_store_index(store_path)
+    image_metadata_dict = {
+        image_metadata["date"]: image_metadata for image_metadata in index["images"]
+    }
+    for image_handler in image_handler_list:
+        image_metadata_dict[image_handler.date] = write_image_handler(
+            image_handler, store_path, bridge_mask, water_index
+        )
+    index["images"] = [
+        image_metadata_dict[date] for date in sorted(image_metadata_dict)
+    ]
+    save_band_store_index(index, store_path)
+    return index
+
+
+def write_band_store(
+    image_handler_list, store_path, bridge_mask=True, water_index=True
+):
+    """
+    Write a list of image handlers as a band store, see load_band_store.
+
+    Layout:
+        <store_path>/index.json: Dates and array files of every image.
+        <store_path>/<date>/skeleton.pkl: Image handler without its large arrays.
+        <store_path>/<date>/<array>.npy: Bands, scene classification, bridge mask,
+            water index...
+    """
+    return add_image_handler_list_to_band_store(
+        image_handler_list, store_path, bridge_mask, water_index
+    )
+
+
+class StoredImageHandler:
+    """
+    Image handler read from a band store.
+
+    The skeleton is unpickled on first use and its arrays are opened with
+    numpy.memmap, so only the pages of the bands actually read are loaded from
+    disk. Every attribute and method of the original handler is available.
+    """
+
+    def __init__(self, store_path, image_metadata):
+        self.date = image_metadata["date"]
+        self._store_path = Path(store_path)
+        self._image_metadata = image_metadata
+        self._image_handler = None
+
+    @property
+    def image_path(self):
+        return self._store_path / self._image_metadata["directory"]
+
+    def load_array(self, array_name):
+        file_name = self._image_metadata["arrays"][array_name]
+        return numpy.load(self.image_path / file_name, mmap_mode="c")
+
+    def has_array(self, array_name):
+        return array_name in self._image_metadata["arrays"]
+
+    @property
+    def image_handler(self):
+        if self._image_handler is None:
+            image_handler = load_pickle_data(str(self.image_path / "skeleton.pkl"))
+            for array_name in self._image_metadata["arrays"]:
+                if array_name in DERIVED_ARRAY_NAME_SET:
+                    continue
+                array = self.load_array(array_name)
+                if "/" in array_name:
+                    attribute, key = array_name.split("/", 1)
+                    getattr(image_handler, attribute)[key] = array
+                else:
+                    setattr(image_handler, array_name, array)
+            self._image_handler = image_handler
+        return self._image_handler
+
+    def get_mask_from_bridge_points_handler(self):
+        if self.has_array("bridge_mask"):
+            return self.load_array("bridge_mask")
+        return self.image_handler.get_mask_from_bridge_points_handler()
+
+    def __getstate__(self):
+        # Pickle only the store location, the arrays are reopened lazily
+        state = dict(self.__dict__)
+        state["_image_handler"] = None
+        return state
+
+    def __getattr__(self, name):
+        # Private names are never delegated, which also keeps pickle working
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.image_handler, name)
+
+
+def load_band_store(store_path, progress_callback=None):
+    """
+    Load the image handlers of a band store, sorted by date.
+
+    progress_callback, when given, is called as progress_callback(value, total)
+    before each image, see turbidity_shiny.background_task.TaskProgress.
+    """
+    index = load_band_store_index(store_path)
+    image_handler_list = []
+    for image_index, image_metadata in enumerate(index["images"]):
+        if progress_callback is not None:
+            progress_callback(image_index, len(index["images"]))
+        image_handler_list.append(StoredImageHandler(store_path, image_metadata))
+    return image_handler_list
+
+
+def load_image_handler_list(pickle_path, progress_callback=None):
+    """
+    Load a list of image handlers from its band store when it exists, otherwise
+    from the pickle file. progress_callback is called before each image of a
+    band store, or once before the pickle file is read.
+    """
+    store_path = get_band_store_path(pickle_path)
+    if (store_path / BAND_STORE_INDEX_NAME).exists():
+        return load_band_store(store_path, progress_callback)
+    if progress_callback is not None:
+        progress_callback(0, 1)
+    return load_pickle_data(str(pickle_path))
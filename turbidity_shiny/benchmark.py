@@ -0,0 +1,538 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import json
+import os
+from pathlib import Path
+import tempfile
+import time
+import tracemalloc
+
+import numpy
+import pandas
+from scipy import ndimage
+
+from turbidity_shiny.band_store import write_band_store
+from turbidity_shiny.dataset_registry import DATASET_REGISTRY
+from turbidity_shiny.turbidity.load_data import (
+    load_turbidity_data,
+    load_turbidity_fixed_data,
+)
+from turbidity_shiny.turbidity.probe_store import (
+    get_probe_csv_path,
+    load_probe_data,
+)
+from turbidity_shiny.turbidity.raster_cache import RASTER_CACHE
+from turbidity_shiny.turbidity.turbidity_df import (
+    RASTER_DTYPE_TOLERANCE,
+    create_turbidity_df,
+    create_turbidity_fixed_df,
+    get_raster_dtype_difference,
+    get_smoothed_turbidity_index_water_index_mask,
+    get_smoothed_turbidity_index_water_index_mask_window,
+)
+from turbidity_shiny.turbidity_index import (
+    RASTER_DTYPE,
+    TURBIDITY_INDEX_TYPE_LIST,
+    create_turbidity_index_raster,
+    create_turbidity_index_raster_dict,
+)
+
+
+BENCHMARK_ESTUARY_NAME = "synthetic"
+BENCHMARK_TYPE_OF_TURBIDITY_INDEX_LIST = [
+    "NDTI",
+    "Bande Rouge (665nm)",
+    "Bande Infra Rouge (833nm)",
+    "(665nm)/(833nm)",
+]
+# Scene classification of Sentinel-2: 4 vegetation, 6 water, 8 to 10 clouds
+SCENE_CLF_VEGETATION = 4
+SCENE_CLF_WATER = 6
+SCENE_CLF_CLOUD = 9
+
+
+class SyntheticImageHandler:
+    """
+    Stand-in of a Sentinel image handler for benchmarks, without any file.
+
+    The scene is a river crossing the image from left to right, crossed by a
+    bridge at a third of its width, with random cloud patches. The bands are
+    uint16 reflectances, water pixels have a low NIR and a high green
+    reflectance. Pixel coordinates follow a north-up geotransform.
+
+    Args:
+        date (str): Acquisition date, e.g. "2023-07-20T15:17:01.000Z".
+        shape (tuple): (rows, cols) of the scene.
+        seed (int): Seed of the random bands and clouds.
+        origin (tuple): (longitude, latitude) of the top left pixel.
+        pixel_size (float): Pixel size in degrees.
+    """
+
+    def __init__(self, date, shape, seed=0, origin=(-64.7, 46.5), pixel_size=0.0001):
+        rng = numpy.random.default_rng(seed)
+        self.date = date
+        self.origin = origin
+        self.pixel_size = pixel_size
+        n_rows, n_cols = shape
+        row_array = numpy.arange(n_rows)[:, None]
+        col_array = numpy.arange(n_cols)[None, :]
+        river_center = n_rows / 2 + n_rows / 8 * numpy.sin(col_array / n_cols * 6)
+        water_mask = numpy.abs(row_array - river_center) < n_rows / 6
+        cloud_mask = (
+            ndimage.gaussian_filter(rng.random(shape), sigma=max(shape) / 50) > 0.55
+        )
+        self.red_band = self.create_band(rng, shape, water_mask, 300, 900)
+        self.green_band = self.create_band(rng, shape, water_mask, 900, 700)
+        self.blue_band = self.create_band(rng, shape, water_mask, 600, 500)
+        self.nir_band = self.create_band(rng, shape, water_mask, 150, 3000)
+        self.scene_clf = numpy.where(
+            water_mask, SCENE_CLF_WATER, SCENE_CLF_VEGETATION
+        ).astype(numpy.uint8)
+        self.scene_clf[cloud_mask] = SCENE_CLF_CLOUD
+        self.true_color_image = numpy.clip(
+            numpy.stack((self.red_band, self.green_band, self.blue_band), axis=-1)
+            / 3000,
+            0,
+            1,
+        ).astype(numpy.float32)
+        self.bridge_mask = numpy.ones(shape, dtype=bool)
+        bridge_col = n_cols // 3
+        self.bridge_mask[:, bridge_col : bridge_col + max(1, n_cols // 100)] = False
+
+    @staticmethod
+    def create_band(rng, shape, water_mask, water_mean, land_mean):
+        band = numpy.where(water_mask, water_mean, land_mean) + rng.normal(
+            0, 0.1 * min(water_mean, land_mean), shape
+        )
+        return numpy.clip(band, 1, 10_000).astype(numpy.uint16)
+
+    def get_row_col_index_from_longitide_latitude(self, longitude, latitude):
+        row = (self.origin[1] - numpy.asarray(latitude)) / self.pixel_size
+        col = (numpy.asarray(longitude) - self.origin[0]) / self.pixel_size
+        return row, col
+
+    def get_longitude_latitude_from_row_col_index(self, row, col):
+        longitude = self.origin[0] + numpy.asarray(col) * self.pixel_size
+        latitude = self.origin[1] - numpy.asarray(row) * self.pixel_size
+        return longitude, latitude
+
+    def get_mask_from_bridge_points_handler(self):
+        return self.bridge_mask
+
+    def get_smoothed_water_mask(self, sigma, threshold):
+        water_mask = (self.scene_clf == SCENE_CLF_WATER).astype(float)
+        return ndimage.gaussian_filter(water_mask, sigma) > threshold
+
+
+def create_synthetic_image_handler_list(
+    n_images, shape, start_date=datetime(2023, 6, 1, 15, 17, 1), seed=0
+):
+    """
+    One synthetic image every 5 days from start_date.
+    """
+    return [
+        SyntheticImageHandler(
+            (start_date + timedelta(days=5 * image_idx)).strftime(
+                "%Y-%m-%dT%H:%M:%S.000Z"
+            ),
+            shape,
+            seed=seed + image_idx,
+        )
+        for image_idx in range(n_images)
+    ]
+
+
+def create_synthetic_turbidity_data(image_handler_list, n_points, seed=0):
+    """
+    In-situ measures and locations in the format of the field work JSON files,
+    with every point measured on the date of every image.
+
+    Returns:
+        tuple:
+            1. list: Content of "<estuary>_measures.json".
+            2. dict: Content of "<estuary>_location.json".
+    """
+    rng = numpy.random.default_rng(seed)
+    image_handler = image_handler_list[0]
+    n_rows, n_cols = image_handler.red_band.shape
+    row_array = rng.uniform(0, n_rows - 1, n_points)
+    col_array = rng.uniform(0, n_cols - 1, n_points)
+    (
+        longitude_array,
+        latitude_array,
+    ) = image_handler.get_longitude_latitude_from_row_col_index(row_array, col_array)
+    turbidity_location_data = {
+        f"Point {point_idx}": {
+            "geo_coordinates": {
+                "lon": float(longitude_array[point_idx]),
+                "lat": float(latitude_array[point_idx]),
+            }
+        }
+        for point_idx in range(n_points)
+    }
+    turbidity_measures_data = [
+        {
+            "date": image_handler.date[:10],
+            "spatial_turbidity_measurement": {
+                "measurements_list": [
+                    {
+                        "notes": notes,
+                        "measures": list(rng.uniform(1, 40, 3)),
+                        "time": "10:00",
+                    }
+                    for notes in turbidity_location_data
+                ]
+            },
+        }
+        for image_handler in image_handler_list
+    ]
+    return turbidity_measures_data, turbidity_location_data
+
+
+def create_synthetic_probe_data(image_handler_list, n_rows, seed=0):
+    """
+    Probe measures every 15 minutes from the day before the first image, in the
+    format returned by load_probe_data.
+    """
+    rng = numpy.random.default_rng(seed)
+    first_date = datetime.strptime(image_handler_list[0].date[:19], "%Y-%m-%dT%H:%M:%S")
+    date_index = pandas.date_range(
+        first_date - timedelta(days=1), periods=n_rows, freq="15min"
+    )
+    fixed_turbidity_data = pandas.DataFrame(
+        {
+            "date": date_index,
+            "filtered_interpolated_turbidity": rng.uniform(1, 40, n_rows),
+        }
+    )
+    fixed_turbidity_data.loc[
+        rng.random(n_rows) < 0.05, "filtered_interpolated_turbidity"
+    ] = numpy.nan
+    return fixed_turbidity_data
+
+
+def write_synthetic_data_tree(
+    root_path, image_handler_list, n_points, n_probe_rows, seed=0
+):
+    """
+    Write the files read by the loaders, for the estuary BENCHMARK_ESTUARY_NAME
+    and the year 2023, in the layout of the application:
+    "<root_path>/pkg/data/..." for the band stores and "<root_path>/data/..."
+    for the field work JSON and the probe csv.
+
+    Returns:
+        Path: "<root_path>/pkg", the directory to run the loaders from.
+    """
+    root_path = Path(root_path)
+    package_path = root_path / "pkg"
+    estuary_name = BENCHMARK_ESTUARY_NAME
+    write_band_store(
+        image_handler_list, package_path / "data" / "turbidity" / f"{estuary_name}_2023"
+    )
+    write_band_store(
+        image_handler_list,
+        package_path / "data" / "turbidity_fixed" / "2023" / "sen2cor" / estuary_name,
+    )
+    turbidity_measures_data, turbidity_location_data = create_synthetic_turbidity_data(
+        image_handler_list, n_points, seed
+    )
+    field_work_path = root_path / "data" / "field_work" / "json"
+    json_data_dict = {
+        field_work_path
+        / "summer_2023"
+        / f"{estuary_name}_measures.json": (turbidity_measures_data),
+        field_work_path
+        / "summer_2023"
+        / f"{estuary_name}_location.json": (turbidity_location_data),
+        field_work_path
+        / "summer_2023"
+        / "modified_location"
+        / f"{estuary_name}_location.json": turbidity_location_data,
+        field_work_path
+        / "probe"
+        / f"{estuary_name}_2023.json": {
+            "turbidity_probe": {
+                "geo_coordinates": next(iter(turbidity_location_data.values()))[
+                    "geo_coordinates"
+                ]
+            }
+        },
+    }
+    for json_path, json_data in json_data_dict.items():
+        json_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(json_path, "w") as f:
+            json.dump(json_data, f)
+    probe_data = create_synthetic_probe_data(image_handler_list, n_probe_rows, seed)
+    probe_data["Date and Time"] = probe_data.pop("date").dt.strftime("%Y-%d-%m %H:%M")
+    package_path.mkdir(parents=True, exist_ok=True)
+    csv_path = package_path / get_probe_csv_path(estuary_name, "2023")
+    csv_path.parent.mkdir(parents=True, exist_ok=True)
+    probe_data[["Date and Time", "filtered_interpolated_turbidity"]].to_csv(
+        csv_path, index=False
+    )
+    return package_path
+
+
+@contextmanager
+def working_directory(path):
+    previous_path = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous_path)
+
+
+def benchmark_stage(stage, function, repeat=1):
+    """
+    Run ``function()`` ``repeat`` times and measure it.
+
+    Returns:
+        dict: stage, best and mean duration in seconds, and the peak of the
+        memory allocated during the runs, in bytes (numpy allocations are
+        tracked by tracemalloc).
+    """
+    duration_list = []
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            function()
+            duration_list.append(time.perf_counter() - start_time)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "stage": stage,
+        "best_seconds": min(duration_list),
+        "mean_seconds": sum(duration_list) / len(duration_list),
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def run_benchmark(
+    scene_size=1000,
+    n_images=4,
+    n_points=50,
+    n_probe_rows=20_000,
+    repeat=3,
+    water_index_threshold=-0.05,
+    box_size=3,
+    ndti_smoothed_sigma=1,
+    seed=0,
+):
+    """
+    Benchmark every stage of the turbidity pipeline on synthetic data, offline.
+
+    Stages: turbidity index rasters, smoothed masked index without and with the
+    raster cache and on a zoomed window, create_turbidity_df, create_turbidity_fixed_df, and the
+    loaders on a temporary data tree (band stores, JSON, probe csv conversion
+    and Parquet store).
+
+    Returns:
+        pandas.DataFrame: One row per stage, see benchmark_stage.
+    """
+    shape = (scene_size, scene_size)
+    image_handler_list = create_synthetic_image_handler_list(n_images, shape, seed=seed)
+    image_handler = image_handler_list[0]
+    turbidity_measures_data, turbidity_location_data = create_synthetic_turbidity_data(
+        image_handler_list, n_points, seed
+    )
+    fixed_turbidity_data = create_synthetic_probe_data(
+        image_handler_list, n_probe_rows, seed
+    )
+    turbidity_geo_coordinate_dict = {
+        "2023": next(iter(turbidity_location_data.values()))["geo_coordinates"]
+    }
+    result_list = []
+    for type_of_turbidity_index in BENCHMARK_TYPE_OF_TURBIDITY_INDEX_LIST:
+        result_list.append(
+            benchmark_stage(
+                f"create_turbidity_index_raster[{type_of_turbidity_index}]",
+                lambda: create_turbidity_index_raster(
+                    image_handler.red_band,
+                    image_handler.green_band,
+                    image_handler.nir_band,
+                    type_of_turbidity_index,
+                    image_handler,
+                ),
+                repeat,
+            )
+        )
+    for dtype in [numpy.float64, numpy.float32]:
+        result_list.append(
+            benchmark_stage(
+                f"create_turbidity_index_raster_dict[{numpy.dtype(dtype).name}]",
+                lambda: create_turbidity_index_raster_dict(
+                    image_handler.red_band,
+                    image_handler.green_band,
+                    image_handler.nir_band,
+                    BENCHMARK_TYPE_OF_TURBIDITY_INDEX_LIST,
+                    image_handler,
+                    dtype,
+                ),
+                repeat,
+            )
+        )
+    smoothed_parameters = (water_index_threshold, ndti_smoothed_sigma, "NDTI", True)
+    result_list.append(
+        benchmark_stage(
+            "get_smoothed_turbidity_index_water_index_mask[no cache]",
+            lambda: get_smoothed_turbidity_index_water_index_mask(
+                image_handler, *smoothed_parameters, raster_cache=None
+            ),
+            repeat,
+        )
+    )
+    # A 200x200 zoomed view around the center of the scene
+    window = (
+        scene_size // 2 - 100,
+        scene_size // 2 + 100,
+        scene_size // 2 - 100,
+        scene_size // 2 + 100,
+    )
+    result_list.append(
+        benchmark_stage(
+            "get_smoothed_turbidity_index_water_index_mask_window[no cache]",
+            lambda: get_smoothed_turbidity_index_water_index_mask_window(
+                image_handler, window, *smoothed_parameters, raster_cache=None
+            ),
+            repeat,
+        )
+    )
+    RASTER_CACHE.clear()
+    get_smoothed_turbidity_index_water_index_mask(image_handler, *smoothed_parameters)
+    result_list.append(
+        benchmark_stage(
+            "get_smoothed_turbidity_index_water_index_mask[cached]",
+            lambda: get_smoothed_turbidity_index_water_index_mask(
+                image_handler, *smoothed_parameters
+            ),
+            repeat,
+        )
+    )
+
+    def run_create_turbidity_df():
+        RASTER_CACHE.clear()
+        return create_turbidity_df(
+            image_handler_list,
+            turbidity_measures_data,
+            turbidity_location_data,
+            water_index_threshold,
+            box_size,
+            ndti_smoothed_sigma,
+            "NDTI",
+            True,
+            True,
+            False,
+        )
+
+    def run_create_turbidity_fixed_df():
+        RASTER_CACHE.clear()
+        return create_turbidity_fixed_df(
+            image_handler_list,
+            fixed_turbidity_data,
+            turbidity_geo_coordinate_dict,
+            water_index_threshold,
+            box_size,
+            ndti_smoothed_sigma,
+            "Bande Infra Rouge (833nm)",
+            True,
+            turdibidty_df_window=2,
+        )
+
+    result_list.append(
+        benchmark_stage("create_turbidity_df", run_create_turbidity_df, repeat)
+    )
+    result_list.append(
+        benchmark_stage(
+            "create_turbidity_fixed_df", run_create_turbidity_fixed_df, repeat
+        )
+    )
+    RASTER_CACHE.clear()
+
+    with tempfile.TemporaryDirectory() as root_path:
+        package_path = write_synthetic_data_tree(
+            root_path, image_handler_list, n_points, n_probe_rows, seed
+        )
+        with working_directory(package_path):
+            DATASET_REGISTRY.clear()
+            result_list.append(
+                benchmark_stage(
+                    "load_probe_data[csv conversion]",
+                    lambda: load_probe_data(BENCHMARK_ESTUARY_NAME, "2023"),
+                )
+            )
+            result_list.append(
+                benchmark_stage(
+                    "load_probe_data[parquet store]",
+                    lambda: load_probe_data(BENCHMARK_ESTUARY_NAME, "2023"),
+                    repeat,
+                )
+            )
+            result_list.append(
+                benchmark_stage(
+                    "load_turbidity_data",
+                    lambda: load_turbidity_data(
+                        BENCHMARK_ESTUARY_NAME, "Modifiée manuellement", "Sen2Cor"
+                    ),
+                    repeat,
+                )
+            )
+            result_list.append(
+                benchmark_stage(
+                    "load_turbidity_fixed_data",
+                    lambda: load_turbidity_fixed_data(
+                        BENCHMARK_ESTUARY_NAME, "Sen2Cor", "2023"
+                    ),
+                    repeat,
+                )
+            )
+    return pandas.DataFrame(result_list)
+
+
+def run_raster_dtype_check(
+    scene_size=1000,
+    water_index_threshold=-0.05,
+    ndti_smoothed_sigma_list=(0, 1, 3),
+    seed=0,
+):
+    """
+    Compare the RASTER_DTYPE smoothed turbidity index rasters to the float64 ones
+    on a synthetic image, for every type of turbidity index.
+
+    Returns:
+        pandas.DataFrame: One row per type of index and sigma, with the relative
+        difference and the number of water index mask pixels which differ of
+        get_raster_dtype_difference, and whether the difference is below
+        RASTER_DTYPE_TOLERANCE.
+    """
+    image_handler = SyntheticImageHandler(
+        "2023-07-20T15:17:01.000Z", (scene_size, scene_size), seed
+    )
+    result_list = []
+    for type_of_turbidity_index in TURBIDITY_INDEX_TYPE_LIST:
+        for ndti_smoothed_sigma in ndti_smoothed_sigma_list:
+            (
+                relative_difference,
+                same_nan,
+                mask_difference_count,
+            ) = get_raster_dtype_difference(
+                image_handler,
+                water_index_threshold,
+                ndti_smoothed_sigma,
+                type_of_turbidity_index,
+            )
+            result_list.append(
+                {
+                    "type_of_turbidity_index": type_of_turbidity_index,
+                    "ndti_smoothed_sigma": ndti_smoothed_sigma,
+                    "dtype": RASTER_DTYPE.name,
+                    "relative_difference": relative_difference,
+                    "same_nan": same_nan,
+                    "mask_difference_count": mask_difference_count,
+                    "within_tolerance": same_nan
+                    and relative_difference <= RASTER_DTYPE_TOLERANCE,
+                }
+            )
+    return pandas.DataFrame(result_list)
@@ -0,0 +1,460 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import re
+import shutil
+
+import numpy
+import rasterio
+from rasterio.transform import rowcol
+from rasterio.warp import transform as transform_coordinates
+from rasterio.windows import Window
+from satellite_image_handler import sentinel_image_handler
+from satellite_image_handler.utils.bridge_points_handler import BridgePointsHandler
+from tqdm import tqdm
+
+from turbidity_shiny.band_store import (
+    get_band_store_path,
+    get_image_directory_name,
+    load_band_store_index,
+    save_band_store_index,
+    write_image_handler,
+)
+from turbidity_shiny.catalog import (
+    CURATED_DATASET_LIST,
+    PRODUCT_CATALOG_PATH,
+    connect_catalog,
+    import_good_dates,
+    query_product_list,
+    scan_product_directory,
+    set_cloud_fraction,
+)
+
+
+DATASET_LIST = ["water", "turbidity", "turbidity_fixed"]
+ESTUARY_NAME_LIST = ["bouctouche", "cocagne", "dunk", "morell", "west"]
+ATMOSPHERIC_CORRECTION_LIST = ["Sen2Cor", "Acolite"]
+# Name of the image handler class of each estuary in
+# satellite_image_handler.sentinel_image_handler
+IMAGE_HANDLER_CLASS_NAME_DICT = {
+    "bouctouche": "BouctoucheSentinelImageHandler",
+    "cocagne": "CocagneSentinelImageHandler",
+    "dunk": "DunkSentinelImageHandler",
+    "morell": "MorellSentinelImageHandler",
+    "west": "WestSentinelImageHandler",
+}
+# Directory of the Sentinel-2 products of each atmospheric correction
+SENTINEL2_DATA_PATH_DICT = {
+    "Sen2Cor": "../data/sentinel2_data",
+    "Acolite": "../data/sentinel2_data",
+}
+BRIDGE_POINTS_PATH = "../data/points_ponts"
+# Acquisition datetime in a Sentinel-2 product name,
+# e.g. S2A_MSIL2A_20230720T151701_N0509_R025_T20TLS_20230720T213522.SAFE
+PRODUCT_DATETIME_PATTERN = re.compile(r"(\d{8}T\d{6})")
+
+# Cloud screening of the water dataset: the reference image is the cloud-free
+# image at this index in the products of the year sorted by date
+NO_CLOUD_IDX_DICT = {
+    "bouctouche": 15,
+    "cocagne": 15,
+    "west": 7,
+    "morell": 2,
+    "dunk": 1,
+}
+WATER_MASK_THRESHOLD_DICT = {
+    "bouctouche": 0.65,
+    "cocagne": 0.65,
+    "west": 0.65,
+    "morell": 0.45,
+    "dunk": 0.65,
+}
+WATER_MASK_SIGMA = 2
+CLOUD_SCENE_CLASS_LIST = [3, 8, 9, 10]
+# Scene classification raster of a Sen2Cor product, relative to its .SAFE
+# directory
+SCENE_CLF_PATH_PATTERN = "GRANULE/*/IMG_DATA/R20m/*_SCL_20m.jp2"
+# Offset, in pixels, of the point of a water pixel located in the scene
+# classification raster: strictly inside the pixel whether the handler
+# coordinates are the pixel centers or corners
+WATER_PIXEL_OFFSET = 0.25
+MAX_CLOUD_FRACTION = 0.01
+# A worker process is replaced after this many products, so the memory of a
+# product is given back to the system before the next one is read
+BUILD_MAX_TASKS_PER_CHILD = 1
+
+
+def get_product_datetime(product_path):
+    """
+    Acquisition datetime "YYYYMMDDTHHMMSS" of a Sentinel-2 product, parsed from
+    its name. None when the name has no datetime.
+    """
+    match = PRODUCT_DATETIME_PATTERN.search(Path(product_path).name)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def get_image_metadata_datetime(image_metadata):
+    """
+    Acquisition datetime "YYYYMMDDTHHMMSS" of an image of a band store index.
+    """
+    if "product" in image_metadata:
+        return get_product_datetime(image_metadata["product"])
+    return get_image_directory_name(image_metadata["date"])[:15]
+
+
+def get_store_pickle_path(dataset, estuary_name, year, atmospheric_correction):
+    """
+    Pickle path of a dataset, the one given to load_image_handler_list by
+    load_data.py. The band store is written next to it, see get_band_store_path.
+    """
+    if dataset == "water":
+        return f"data/{estuary_name}_{year}.lzma.pkl"
+    if dataset == "turbidity":
+        if atmospheric_correction == "Sen2Cor":
+            return f"data/turbidity/{estuary_name}_{year}.pkl"
+        return f"data/turbidity/acolite/{estuary_name}_{year}.pkl"
+    if dataset == "turbidity_fixed":
+        return (
+            f"data/turbidity_fixed/{year}/{atmospheric_correction.lower()}/"
+            f"{estuary_name}.pkl"
+        )
+    raise ValueError(f"dataset must be one of {DATASET_LIST}, got {dataset}")
+
+
+def get_good_dates_path_list(dataset, year):
+    """
+    good_dates.json files of a curated dataset, imported in the product catalog.
+    "data/turbidity_fixed/good_dates.json" was written by the Save button of
+    the fixed turbidity tab.
+    """
+    if dataset == "turbidity":
+        return ["data/turbidity/good_dates.json"]
+    if dataset == "turbidity_fixed":
+        return [
+            f"data/turbidity_fixed/{year}/good_dates.json",
+            "data/turbidity_fixed/good_dates.json",
+        ]
+    return []
+
+
+def get_product_path_list(
+    connection,
+    dataset,
+    estuary_name,
+    year,
+    atmospheric_correction,
+    max_cloud_fraction=None,
+):
+    """
+    Sentinel-2 products of a dataset acquired during year, sorted by
+    acquisition datetime, read from the product catalog.
+
+    The catalog is updated first with the new products of the directory and,
+    once, with the good_dates.json file of the dataset. Only the products of
+    the curated days are kept for a curated dataset. With max_cloud_fraction,
+    the products known to be cloudier are left out.
+    """
+    product_directory = (
+        Path(SENTINEL2_DATA_PATH_DICT[atmospheric_correction]) / estuary_name
+    )
+    scan_product_directory(connection, estuary_name, product_directory)
+    curated_dataset = None
+    if dataset in CURATED_DATASET_LIST:
+        curated_dataset = dataset
+        for good_dates_path in get_good_dates_path_list(dataset, year):
+            import_good_dates(connection, dataset, good_dates_path)
+    product_list = query_product_list(
+        connection,
+        estuary_name,
+        year,
+        dataset=curated_dataset,
+        max_cloud_fraction=max_cloud_fraction,
+        product_directory=product_directory,
+    )
+    return [Path(product_path) for product_path, _, _ in product_list]
+
+
+def get_product_path_dict(
+    connection,
+    dataset,
+    estuary_name,
+    year,
+    atmospheric_correction,
+    max_cloud_fraction=None,
+):
+    """
+    Products of get_product_path_list by acquisition datetime
+    "YYYYMMDDTHHMMSS", the key of the images of a band store.
+    """
+    return {
+        get_product_datetime(product_path): product_path
+        for product_path in get_product_path_list(
+            connection,
+            dataset,
+            estuary_name,
+            year,
+            atmospheric_correction,
+            max_cloud_fraction,
+        )
+    }
+
+
+def create_image_handler(estuary_name, product_path, bridge_points=True):
+    image_handler_class = getattr(
+        sentinel_image_handler, IMAGE_HANDLER_CLASS_NAME_DICT[estuary_name]
+    )
+    if bridge_points is False:
+        return image_handler_class(str(product_path))
+    bridge_points_handler = BridgePointsHandler(f"{BRIDGE_POINTS_PATH}/{estuary_name}")
+    return image_handler_class(str(product_path), bridge_points_handler)
+
+
+def get_water_pixel_dict(estuary_name, product_path):
+    """
+    Water pixels of the reference cloud-free product, used to measure the
+    clouds over the water of the other products.
+
+    Returns:
+        dict:
+            - "index": Flat indexes of the water pixels in the image.
+            - "longitude", "latitude": Coordinates of the water pixels, to
+              find them in the scene classification raster of any product.
+            - "image_size": Number of pixels of the image.
+    """
+    image_handler = create_image_handler(estuary_name, product_path, False)
+    water_mask = image_handler.get_smoothed_water_mask(
+        sigma=WATER_MASK_SIGMA, threshold=WATER_MASK_THRESHOLD_DICT[estuary_name]
+    )
+    row_array, col_array = numpy.nonzero(water_mask)
+    longitude, latitude = image_handler.get_longitude_latitude_from_row_col_index(
+        row_array + WATER_PIXEL_OFFSET, col_array + WATER_PIXEL_OFFSET
+    )
+    return {
+        "index": numpy.flatnonzero(water_mask),
+        "longitude": numpy.asarray(longitude, dtype=float),
+        "latitude": numpy.asarray(latitude, dtype=float),
+        "image_size": water_mask.size,
+    }
+
+
+def get_product_scene_clf_path(product_path):
+    """
+    Scene classification raster of a Sen2Cor product, None when the product
+    has none.
+    """
+    scene_clf_path_list = sorted(Path(product_path).glob(SCENE_CLF_PATH_PATTERN))
+    if len(scene_clf_path_list) == 0:
+        return None
+    return scene_clf_path_list[0]
+
+
+def read_water_scene_clf(scene_clf_path, water_pixel_dict):
+    """
+    Scene classification of the water pixels, read from the window of the
+    scene classification raster which holds them. The water pixels outside of
+    the raster are 0, the no data class.
+    """
+    with rasterio.open(scene_clf_path) as dataset:
+        x_array, y_array = transform_coordinates(
+            "EPSG:4326",
+            dataset.crs,
+            water_pixel_dict["longitude"],
+            water_pixel_dict["latitude"],
+        )
+        row_array, col_array = rowcol(dataset.transform, x_array, y_array)
+        row_array, col_array = numpy.asarray(row_array), numpy.asarray(col_array)
+        inside_mask = (
+            (row_array >= 0)
+            & (row_array < dataset.height)
+            & (col_array >= 0)
+            & (col_array < dataset.width)
+        )
+        water_scene_clf = numpy.zeros(row_array.shape, dtype=numpy.uint8)
+        if not numpy.any(inside_mask):
+            return water_scene_clf
+        row_array, col_array = row_array[inside_mask], col_array[inside_mask]
+        min_row, min_col = row_array.min(), col_array.min()
+        window = Window(
+            min_col,
+            min_row,
+            col_array.max() - min_col + 1,
+            row_array.max() - min_row + 1,
+        )
+        scene_clf = dataset.read(1, window=window)
+    water_scene_clf[inside_mask] = scene_clf[row_array - min_row, col_array - min_col]
+    return water_scene_clf
+
+
+def get_cloud_fraction(water_scene_clf, image_size):
+    """
+    Fraction of the pixels of the image which are cloudy pixels over the water,
+    from the scene classification of the water pixels.
+    """
+    cloud_count = numpy.count_nonzero(
+        numpy.isin(water_scene_clf, CLOUD_SCENE_CLASS_LIST)
+    )
+    return cloud_count / image_size
+
+
+def build_image(
+    estuary_name,
+    product_path,
+    store_path,
+    bridge_mask=True,
+    water_index=True,
+    water_pixel_dict=None,
+):
+    """
+    Create the image handler of a product and write it in the band store.
+
+    Runs in a worker process, which holds a single product. With
+    water_pixel_dict, see get_water_pixel_dict, the product is first screened
+    on the scene classification of its water pixels, read from its SCL_20m
+    raster: a cloudy product is dropped before its bands are read. A product
+    without that raster is screened on the scene classification of its image
+    handler instead.
+
+    Returns:
+        tuple:
+            1. dict: Image metadata of the index with the product name, None
+               when the product is rejected as cloudy.
+            2. float: Cloud fraction over the water, None without
+               water_pixel_dict.
+    """
+    cloud_fraction = None
+    if water_pixel_dict is not None:
+        scene_clf_path = get_product_scene_clf_path(product_path)
+        if scene_clf_path is not None:
+            cloud_fraction = get_cloud_fraction(
+                read_water_scene_clf(scene_clf_path, water_pixel_dict),
+                water_pixel_dict["image_size"],
+            )
+            if cloud_fraction >= MAX_CLOUD_FRACTION:
+                return None, cloud_fraction
+    image_handler = create_image_handler(
+        estuary_name, product_path, bridge_points=bridge_mask
+    )
+    if water_pixel_dict is not None and cloud_fraction is None:
+        cloud_fraction = get_cloud_fraction(
+            numpy.ravel(image_handler.scene_clf)[water_pixel_dict["index"]],
+            water_pixel_dict["image_size"],
+        )
+        if cloud_fraction >= MAX_CLOUD_FRACTION:
+            return None, cloud_fraction
+    image_metadata = write_image_handler(
+        image_handler, store_path, bridge_mask, water_index
+    )
+    image_metadata["product"] = Path(product_path).name
+    return image_metadata, cloud_fraction
+
+
+def build_band_store(
+    dataset,
+    estuary_name,
+    year,
+    atmospheric_correction="Sen2Cor",
+    max_workers=None,
+    rebuild=False,
+    catalog_path=PRODUCT_CATALOG_PATH,
+):
+    """
+    Build the band store of a dataset for one estuary and year.
+
+    The products are selected in the product catalog, see
+    get_product_path_dict. The build is incremental: only the selected products
+    whose acquisition datetime is not in the store yet are processed, in a
+    process pool. For the water dataset, the cloud fraction of every processed
+    product is saved in the catalog, and the products already known to be
+    cloudy are not processed again. Images of the store whose product is no
+    longer selected, e.g. no longer curated, are removed. The index is saved
+    after every product, so an interrupted build is resumed. With rebuild,
+    every product is processed again.
+
+    Returns:
+        tuple: Number of products processed and number of images in the store.
+    """
+    store_path = get_band_store_path(
+        get_store_pickle_path(dataset, estuary_name, year, atmospheric_correction)
+    )
+    store_path.mkdir(parents=True, exist_ok=True)
+    connection = connect_catalog(catalog_path)
+    try:
+        product_path_dict = get_product_path_dict(
+            connection,
+            dataset,
+            estuary_name,
+            year,
+            atmospheric_correction,
+            max_cloud_fraction=(
+                MAX_CLOUD_FRACTION if dataset == "water" and not rebuild else None
+            ),
+        )
+        index = load_band_store_index(store_path)
+        image_metadata_dict = {
+            get_image_metadata_datetime(image_metadata): image_metadata
+            for image_metadata in index["images"]
+        }
+
+        def remove_image(product_datetime):
+            image_metadata = image_metadata_dict.pop(product_datetime)
+            shutil.rmtree(store_path / image_metadata["directory"], ignore_errors=True)
+
+        def save_index():
+            index["images"] = sorted(
+                image_metadata_dict.values(), key=lambda metadata: metadata["date"]
+            )
+            save_band_store_index(index, store_path)
+
+        for product_datetime in list(image_metadata_dict):
+            if product_datetime not in product_path_dict:
+                remove_image(product_datetime)
+        new_product_path_dict = {
+            product_datetime: product_path
+            for product_datetime, product_path in product_path_dict.items()
+            if rebuild or product_datetime not in image_metadata_dict
+        }
+        build_kwargs = {"bridge_mask": True, "water_index": True}
+        if dataset == "water":
+            build_kwargs = {"bridge_mask": False, "water_index": False}
+            if len(new_product_path_dict) > 0:
+                # The reference is chosen among every product of the year,
+                # sorted by date, products of the same datetime included
+                reference_product_path = get_product_path_list(
+                    connection, dataset, estuary_name, year, atmospheric_correction
+                )[NO_CLOUD_IDX_DICT[estuary_name]]
+                build_kwargs["water_pixel_dict"] = get_water_pixel_dict(
+                    estuary_name, reference_product_path
+                )
+        with ProcessPoolExecutor(
+            max_workers=max_workers, max_tasks_per_child=BUILD_MAX_TASKS_PER_CHILD
+        ) as executor:
+            future_dict = {
+                executor.submit(
+                    build_image, estuary_name, product_path, store_path, **build_kwargs
+                ): product_datetime
+                for product_datetime, product_path in new_product_path_dict.items()
+            }
+            for future in tqdm(
+                as_completed(future_dict),
+                total=len(future_dict),
+                desc=f"{dataset} {estuary_name} {year} {atmospheric_correction}",
+            ):
+                product_datetime = future_dict[future]
+                image_metadata, cloud_fraction = future.result()
+                if cloud_fraction is not None:
+                    set_cloud_fraction(
+                        connection,
+                        new_product_path_dict[product_datetime],
+                        cloud_fraction,
+                    )
+                if image_metadata is None:
+                    if product_datetime in image_metadata_dict:
+                        remove_image(product_datetime)
+                else:
+                    image_metadata_dict[product_datetime] = image_metadata
+                save_index()
+        save_index()
+    finally:
+        connection.close()
+    return len(new_product_path_dict), len(index["images"])
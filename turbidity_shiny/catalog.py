@@ -0,0 +1,256 @@
+import os
+from pathlib import Path
+import re
+import sqlite3
+
+from turbidity_shiny.utils import load_json_data
+
+
+PRODUCT_CATALOG_PATH = "data/sentinel2_catalog.sqlite"
+# Curated datasets, the days kept by the curation are built in their stores
+CURATED_DATASET_LIST = ["turbidity", "turbidity_fixed"]
+# e.g. S2A_MSIL2A_20230720T151701_N0509_R025_T20TLS_20230720T213522.SAFE
+PRODUCT_NAME_PATTERN = re.compile(
+    r"(?P<datetime>\d{8}T\d{6})(?:.*_T(?P<tile>\d{2}[A-Z]{3})(?:_|\.|$))?"
+)
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS product (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    estuary TEXT NOT NULL,
+    acquisition_datetime TEXT NOT NULL,
+    tile TEXT,
+    cloud_fraction REAL
+);
+CREATE INDEX IF NOT EXISTS product_estuary_datetime
+    ON product (estuary, acquisition_datetime);
+CREATE TABLE IF NOT EXISTS curation (
+    dataset TEXT NOT NULL,
+    estuary TEXT NOT NULL,
+    day TEXT NOT NULL,
+    PRIMARY KEY (dataset, estuary, day)
+);
+CREATE TABLE IF NOT EXISTS scanned_directory (
+    directory TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS imported_good_dates (
+    path TEXT PRIMARY KEY
+);
+"""
+
+
+def parse_product_name(product_name):
+    """
+    Acquisition datetime "YYYY-MM-DDTHH:MM:SS" and tile, e.g. "20TLS", of a
+    Sentinel-2 product name. Each is None when it is not in the name.
+    """
+    match = PRODUCT_NAME_PATTERN.search(product_name)
+    if match is None:
+        return None, None
+    compact_datetime = match.group("datetime")
+    acquisition_datetime = (
+        f"{compact_datetime[:4]}-{compact_datetime[4:6]}-{compact_datetime[6:8]}T"
+        f"{compact_datetime[9:11]}:{compact_datetime[11:13]}:{compact_datetime[13:15]}"
+    )
+    return acquisition_datetime, match.group("tile")
+
+
+def normalize_day(day):
+    """
+    "YYYY-MM-DD" of a day written "YYYY-MM-DD", "YYYYMMDD" or as the start of
+    a datetime.
+    """
+    digits = re.sub(r"[^0-9]", "", day)[:8]
+    return f"{digits[:4]}-{digits[4:6]}-{digits[6:8]}"
+
+
+def get_path_prefix_pattern(directory):
+    """
+    LIKE pattern, with "\\" as escape character, of the paths inside directory.
+    """
+    return re.sub(r"([%_\\])", r"\\\1", str(directory) + os.sep) + "%"
+
+
+def connect_catalog(catalog_path=PRODUCT_CATALOG_PATH):
+    """
+    Open the product catalog, created on first use. Use it with
+    contextlib.closing, and as a context manager to commit a transaction.
+    """
+    Path(catalog_path).parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(catalog_path, timeout=30)
+    connection.executescript(CATALOG_SCHEMA)
+    return connection
+
+
+def scan_product_directory(connection, estuary_name, product_directory):
+    """
+    Add the new products of a directory to the catalog and remove the ones
+    which are gone.
+
+    The directory is only listed when its modification time changed since the
+    last scan, which is the case when a product is added or removed.
+
+    Returns:
+        bool: Whether the directory was listed.
+    """
+    product_directory = Path(product_directory)
+    directory = str(product_directory)
+    mtime = product_directory.stat().st_mtime
+    row = connection.execute(
+        "SELECT mtime FROM scanned_directory WHERE directory = ?", (directory,)
+    ).fetchone()
+    if row is not None and row[0] == mtime:
+        return False
+    row_list = []
+    for product_path in product_directory.iterdir():
+        acquisition_datetime, tile = parse_product_name(product_path.name)
+        if acquisition_datetime is None:
+            continue
+        row_list.append(
+            (
+                str(product_path),
+                product_path.name,
+                estuary_name,
+                acquisition_datetime,
+                tile,
+            )
+        )
+    with connection:
+        connection.execute("CREATE TEMP TABLE scanned_path (path TEXT PRIMARY KEY)")
+        connection.executemany(
+            "INSERT INTO scanned_path VALUES (?)", [(row[0],) for row in row_list]
+        )
+        connection.execute(
+            "DELETE FROM product WHERE path LIKE ? ESCAPE '\\' "
+            "AND path NOT IN (SELECT path FROM scanned_path)",
+            (get_path_prefix_pattern(product_directory),),
+        )
+        connection.execute("DROP TABLE scanned_path")
+        connection.executemany(
+            "INSERT OR IGNORE INTO product "
+            "(path, name, estuary, acquisition_datetime, tile) VALUES (?, ?, ?, ?, ?)",
+            row_list,
+        )
+        connection.execute(
+            "INSERT OR REPLACE INTO scanned_directory VALUES (?, ?)",
+            (directory, mtime),
+        )
+    return True
+
+
+def import_good_dates(connection, dataset, good_dates_path):
+    """
+    Add the days of a good_dates.json file, {estuary: [day, ...]}, to the
+    curation of dataset. Every file is imported once, the catalog is then the
+    reference.
+    """
+    good_dates_path = Path(good_dates_path)
+    if not good_dates_path.exists():
+        return
+    row = connection.execute(
+        "SELECT 1 FROM imported_good_dates WHERE path = ?", (str(good_dates_path),)
+    ).fetchone()
+    if row is not None:
+        return
+    good_dates_dict = load_json_data(str(good_dates_path))
+    with connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO curation VALUES (?, ?, ?)",
+            [
+                (dataset, estuary_name, normalize_day(good_date))
+                for estuary_name, good_date_list in good_dates_dict.items()
+                for good_date in good_date_list
+            ],
+        )
+        connection.execute(
+            "INSERT INTO imported_good_dates VALUES (?)", (str(good_dates_path),)
+        )
+
+
+def set_curation(connection, dataset, estuary_name, day, good=True):
+    """
+    Mark the products of a day as good, or not, for dataset.
+    """
+    if dataset not in CURATED_DATASET_LIST:
+        raise ValueError(
+            f"dataset must be one of {CURATED_DATASET_LIST}, got {dataset}"
+        )
+    with connection:
+        if good is True:
+            connection.execute(
+                "INSERT OR IGNORE INTO curation VALUES (?, ?, ?)",
+                (dataset, estuary_name, normalize_day(day)),
+            )
+        else:
+            connection.execute(
+                "DELETE FROM curation WHERE dataset = ? AND estuary = ? AND day = ?",
+                (dataset, estuary_name, normalize_day(day)),
+            )
+
+
+def get_curated_day_list(connection, dataset, estuary_name, year=None):
+    query = "SELECT day FROM curation WHERE dataset = ? AND estuary = ?"
+    parameter_list = [dataset, estuary_name]
+    if year is not None:
+        query += " AND day >= ? AND day < ?"
+        parameter_list += [f"{year}-01-01", f"{int(year) + 1}-01-01"]
+    return [
+        row[0] for row in connection.execute(query + " ORDER BY day", parameter_list)
+    ]
+
+
+def query_product_list(
+    connection,
+    estuary_name,
+    year,
+    dataset=None,
+    max_cloud_fraction=None,
+    product_directory=None,
+):
+    """
+    Products of an estuary acquired during year, sorted by acquisition
+    datetime, as (path, acquisition_datetime, cloud_fraction) tuples.
+
+    With dataset, only the products of the days curated for it are returned.
+    With max_cloud_fraction, the products whose cloud fraction is known and
+    above it are left out. With product_directory, only its products are
+    returned.
+    """
+    query = (
+        "SELECT product.path, product.acquisition_datetime, product.cloud_fraction "
+        "FROM product"
+    )
+    condition_list = [
+        "product.estuary = ?",
+        "product.acquisition_datetime >= ?",
+        "product.acquisition_datetime < ?",
+    ]
+    parameter_list = [estuary_name, f"{year}-01-01", f"{int(year) + 1}-01-01"]
+    if dataset is not None:
+        query += (
+            " JOIN curation ON curation.estuary = product.estuary"
+            " AND curation.day = substr(product.acquisition_datetime, 1, 10)"
+        )
+        condition_list.append("curation.dataset = ?")
+        parameter_list.append(dataset)
+    if max_cloud_fraction is not None:
+        condition_list.append(
+            "(product.cloud_fraction IS NULL OR product.cloud_fraction < ?)"
+        )
+        parameter_list.append(max_cloud_fraction)
+    if product_directory is not None:
+        condition_list.append("product.path LIKE ? ESCAPE '\\'")
+        parameter_list.append(get_path_prefix_pattern(product_directory))
+    query += " WHERE " + " AND ".join(condition_list)
+    query += " ORDER BY product.acquisition_datetime, product.path"
+    return connection.execute(query, parameter_list).fetchall()
+
+
+def set_cloud_fraction(connection, product_path, cloud_fraction):
+    with connection:
+        connection.execute(
+            "UPDATE product SET cloud_fraction = ? WHERE path = ?",
+            (cloud_fraction, str(product_path)),
+        )
@@ -0,0 +1,158 @@
+from collections import OrderedDict
+import os
+import threading
+
+import numpy
+import pandas
+
+
+DATASET_REGISTRY_MAX_BYTES = int(
+    os.environ.get("TURBIDITY_SHINY_DATASET_MAX_BYTES", 4 * 1024 * 1024 * 1024)
+)
+
+
+def get_dataset_nbytes(data, seen=None):
+    """
+    Estimate the memory held by a dataset: arrays, DataFrames, containers and the
+    attributes of objects such as image handlers. Memory-mapped arrays are not
+    counted since their pages belong to the OS page cache.
+    """
+    seen = set() if seen is None else seen
+    if id(data) in seen:
+        return 0
+    seen.add(id(data))
+    if isinstance(data, numpy.memmap):
+        return 0
+    if isinstance(data, numpy.ndarray):
+        return data.nbytes
+    if isinstance(data, (pandas.DataFrame, pandas.Series)):
+        return int(numpy.sum(data.memory_usage(deep=False)))
+    if isinstance(data, (list, tuple, set)):
+        return sum(get_dataset_nbytes(value, seen) for value in data)
+    if isinstance(data, dict):
+        return sum(get_dataset_nbytes(value, seen) for value in data.values())
+    if hasattr(data, "__dict__"):
+        return get_dataset_nbytes(vars(data), seen)
+    return 0
+
+
+class DatasetRegistry:
+    """
+    Process-wide, thread-safe registry of loaded datasets shared by every Shiny session.
+
+    A dataset is loaded once per key and every owner (one per session and tab)
+    holds a reference to at most one key: acquiring a new key releases the
+    previous one. When the datasets exceed ``max_bytes``, the least recently
+    used datasets without any reference are dropped.
+
+    Example:
+    >>> data = DATASET_REGISTRY.acquire("session_id/turbidity", key, load_function)
+    >>> DATASET_REGISTRY.release("session_id/turbidity")
+    """
+
+    def __init__(self, max_bytes=DATASET_REGISTRY_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes_dict = {}
+        self._reference_count_dict = {}
+        self._owner_key_dict = {}
+        self._loading_lock_dict = {}
+        self._loader_count_dict = {}
+        self._lock = threading.RLock()
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(self._nbytes_dict.values())
+
+    def get_reference_count(self, key):
+        with self._lock:
+            return self._reference_count_dict.get(key, 0)
+
+    def acquire(self, owner, key, load_function):
+        """
+        Return the dataset of ``key``, loading it with ``load_function()`` if it is
+        not in the registry, and make ``owner`` reference it.
+        """
+        with self._lock:
+            loading_lock = self._loading_lock_dict.setdefault(key, threading.Lock())
+            self._loader_count_dict[key] = self._loader_count_dict.get(key, 0) + 1
+        try:
+            # Only one thread loads a given key, the others wait and reuse it
+            with loading_lock:
+                with self._lock:
+                    data = self._entries.get(key)
+                    if data is not None:
+                        self._reference(owner, key)
+                if data is None:
+                    data = load_function()
+                    nbytes = get_dataset_nbytes(data)
+                    # The entry is referenced as soon as it is inserted, so it
+                    # can never be evicted before its owner gets it
+                    with self._lock:
+                        self._entries[key] = data
+                        self._nbytes_dict[key] = nbytes
+                        self._reference(owner, key)
+        finally:
+            with self._lock:
+                self._loader_count_dict[key] -= 1
+                if self._loader_count_dict[key] == 0:
+                    del self._loader_count_dict[key]
+                    del self._loading_lock_dict[key]
+                self._evict()
+        return data
+
+    def release(self, owner):
+        """
+        Drop the reference of ``owner``, typically when its session ends.
+        """
+        with self._lock:
+            self._release(owner)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes_dict.clear()
+            self._reference_count_dict.clear()
+            self._owner_key_dict.clear()
+
+    def _reference(self, owner, key):
+        self._entries.move_to_end(key)
+        if self._owner_key_dict.get(owner) != key:
+            self._release(owner)
+            self._owner_key_dict[owner] = key
+            self._reference_count_dict[key] = self._reference_count_dict.get(key, 0) + 1
+
+    def _release(self, owner):
+        key = self._owner_key_dict.pop(owner, None)
+        if key is not None:
+            self._reference_count_dict[key] -= 1
+            if self._reference_count_dict[key] == 0:
+                del self._reference_count_dict[key]
+
+    def _evict(self):
+        for key in list(self._entries):
+            if sum(self._nbytes_dict.values()) <= self.max_bytes:
+                break
+            # A key being acquired is kept, its loading lock is left to the
+            # threads waiting on it
+            if (
+                self._reference_count_dict.get(key, 0) == 0
+                and self._loader_count_dict.get(key, 0) == 0
+            ):
+                del self._entries[key]
+                del self._nbytes_dict[key]
+
+
+DATASET_REGISTRY = DatasetRegistry()
+
+
+def get_session_owner(session, name):
+    """
+    Registry owner of one tab of a Shiny session. Its reference is released when
+    the session ends.
+    """
+    owner = f"{session.id}/{name}"
+    session.on_ended(lambda: DATASET_REGISTRY.release(owner))
+    return owner
@@ -0,0 +1,192 @@
+import numpy
+
+from turbidity_shiny.turbidity.raster_cache import RASTER_CACHE
+
+
+# Width in pixels of the image plots, no need to draw more pixels than this
+MAX_DISPLAY_SIZE = 900
+MIN_PYRAMID_LEVEL_SIZE = 128
+
+
+def downsample_raster(raster, reduction="mean"):
+    """
+    Halve the resolution of a 2D raster, or of a 3D (rows, cols, channels) image,
+    by reducing each 2x2 block of pixels.
+
+    Args:
+        raster (numpy.ndarray): Raster to downsample, NaN are ignored.
+        reduction (str): "mean" or "max". Use "max" for thin masks such as edges.
+
+    Returns:
+        numpy.ndarray: Raster with half the rows and columns (rounded up), with
+        the same dtype as the input.
+    """
+    dtype = raster.dtype
+    n_rows, n_cols = raster.shape[:2]
+    padded_shape = (n_rows + n_rows % 2, n_cols + n_cols % 2) + raster.shape[2:]
+    if dtype == bool and reduction == "max":
+        # A mask is padded with False, which never changes the max
+        padded_raster = raster
+        if padded_shape != raster.shape:
+            padded_raster = numpy.zeros(padded_shape, dtype=bool)
+            padded_raster[:n_rows, :n_cols] = raster
+        blocks = padded_raster.reshape(
+            (padded_shape[0] // 2, 2, padded_shape[1] // 2, 2) + raster.shape[2:]
+        )
+        return numpy.any(blocks, axis=(1, 3))
+    # NaN marks the padding and the missing pixels, a float input is reduced in
+    # its own dtype
+    if numpy.issubdtype(dtype, numpy.floating):
+        work_dtype = dtype
+    elif dtype == bool:
+        work_dtype = numpy.float32
+    else:
+        work_dtype = numpy.float64
+    if padded_shape == raster.shape:
+        padded_raster = raster.astype(work_dtype, copy=False)
+    else:
+        padded_raster = numpy.full(padded_shape, numpy.nan, dtype=work_dtype)
+        padded_raster[:n_rows, :n_cols] = raster
+    blocks = padded_raster.reshape(
+        (padded_shape[0] // 2, 2, padded_shape[1] // 2, 2) + raster.shape[2:]
+    )
+    valid_count = numpy.sum(~numpy.isnan(blocks), axis=(1, 3), dtype=work_dtype)
+    with numpy.errstate(invalid="ignore"):
+        if reduction == "max":
+            filled_blocks = numpy.where(numpy.isnan(blocks), -numpy.inf, blocks)
+            downsampled_raster = numpy.max(filled_blocks, axis=(1, 3))
+        else:
+            downsampled_raster = numpy.nansum(blocks, axis=(1, 3)) / valid_count
+    downsampled_raster[valid_count == 0] = numpy.nan
+    if dtype == bool:
+        return (
+            downsampled_raster > 0.5 if reduction == "mean" else downsampled_raster > 0
+        )
+    if numpy.issubdtype(dtype, numpy.integer):
+        return numpy.round(numpy.nan_to_num(downsampled_raster)).astype(dtype)
+    return downsampled_raster.astype(dtype, copy=False)
+
+
+class ImagePyramid:
+    """
+    Precomputed downsampled versions of a raster, each level half the size of the
+    previous one, to draw any crop with about MAX_DISPLAY_SIZE pixels.
+
+    The first level is the raster itself and is not copied. It is counted in
+    nbytes when it owns its memory, which is the case of a raster computed for
+    the pyramid, and not when it is a view or a memmap of an image handler
+    array. The raster may be a window of a scene whose first pixel is at row
+    and column origin: windows and extents are then in the pixel coordinates of
+    the scene.
+    """
+
+    def __init__(
+        self,
+        raster,
+        reduction="mean",
+        min_level_size=MIN_PYRAMID_LEVEL_SIZE,
+        origin=(0, 0),
+    ):
+        self.shape = raster.shape
+        self.origin = tuple(origin)
+        self.level_list = [raster]
+        while max(self.level_list[-1].shape[:2]) > min_level_size:
+            self.level_list.append(downsample_raster(self.level_list[-1], reduction))
+        for level in self.level_list[1:]:
+            level.flags.writeable = False
+
+    @property
+    def nbytes(self):
+        raster = self.level_list[0]
+        owns_raster = raster.base is None and not isinstance(raster, numpy.memmap)
+        level_list = self.level_list if owns_raster else self.level_list[1:]
+        return sum(level.nbytes for level in level_list)
+
+    def get_level_index(self, height, width, max_size=MAX_DISPLAY_SIZE):
+        level_index = 0
+        while (
+            level_index < len(self.level_list) - 1
+            and max(height, width) / 2**level_index > max_size
+        ):
+            level_index += 1
+        return level_index
+
+    def get_crop(self, min_row, max_row, min_col, max_col, max_size=MAX_DISPLAY_SIZE):
+        """
+        Crop rows min_row:max_row and columns min_col:max_col from the coarsest
+        level that still has max_size pixels on the longest side.
+
+        Returns:
+            tuple:
+                1. numpy.ndarray: The crop.
+                2. tuple: Its (left, right, bottom, top) extent in pixel
+                   coordinates of the full resolution raster, for imshow.
+        """
+        level_index = self.get_level_index(
+            max_row - min_row, max_col - min_col, max_size
+        )
+        factor = 2**level_index
+        origin_row, origin_col = self.origin
+        min_row, max_row = min_row - origin_row, max_row - origin_row
+        min_col, max_col = min_col - origin_col, max_col - origin_col
+        min_row, min_col = max(0, min_row), max(0, min_col)
+        level_min_row, level_min_col = min_row // factor, min_col // factor
+        level_max_row = -(-max_row // factor)
+        level_max_col = -(-max_col // factor)
+        crop = self.level_list[level_index][
+            level_min_row:level_max_row, level_min_col:level_max_col
+        ]
+        level_max_row = min(level_max_row, crop.shape[0] + level_min_row)
+        level_max_col = min(level_max_col, crop.shape[1] + level_min_col)
+        extent = (
+            origin_col + level_min_col * factor - 0.5,
+            origin_col + level_max_col * factor - 0.5,
+            origin_row + level_max_row * factor - 0.5,
+            origin_row + level_min_row * factor - 0.5,
+        )
+        return crop, extent
+
+    def imshow(self, ax, window=None, max_size=MAX_DISPLAY_SIZE, **imshow_kwargs):
+        """
+        Draw the window (min_row, max_row, min_col, max_col), or the whole raster,
+        on a matplotlib axe. An array ``alpha`` must be an ImagePyramid too.
+        """
+        if window is None:
+            origin_row, origin_col = self.origin
+            window = (
+                origin_row,
+                origin_row + self.shape[0],
+                origin_col,
+                origin_col + self.shape[1],
+            )
+        crop, extent = self.get_crop(*window, max_size)
+        alpha = imshow_kwargs.get("alpha")
+        if isinstance(alpha, ImagePyramid):
+            # matplotlib only resamples a float alpha, a mask is cast per crop
+            alpha_crop = alpha.get_crop(*window, max_size)[0]
+            if alpha_crop.dtype == bool:
+                alpha_crop = alpha_crop.astype(numpy.float32)
+            imshow_kwargs["alpha"] = alpha_crop
+        return ax.imshow(crop, extent=extent, **imshow_kwargs)
+
+
+def get_image_pyramid(
+    image_handler,
+    parameters,
+    compute_function,
+    reduction="mean",
+    raster_cache=RASTER_CACHE,
+):
+    """
+    Return the ImagePyramid of the raster ``compute_function()`` of an image,
+    kept in ``raster_cache`` under ``("image_pyramid", *parameters)``.
+    """
+
+    def compute_image_pyramid():
+        return ImagePyramid(numpy.asarray(compute_function()), reduction)
+
+    return raster_cache.get_or_compute(
+        image_handler,
+        ("image_pyramid", reduction) + tuple(parameters),
+        compute_image_pyramid,
+    )
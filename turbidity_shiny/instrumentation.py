@@ -0,0 +1,273 @@
+from collections import Counter
+from contextvars import ContextVar
+import functools
+import inspect
+import os
+import threading
+import time
+import tracemalloc
+
+import pandas
+from shiny import reactive, render
+from shiny.reactive._core import get_current_context
+from starlette.responses import PlainTextResponse
+
+from turbidity_shiny.dataset_registry import DATASET_REGISTRY
+from turbidity_shiny.turbidity.raster_cache import RASTER_CACHE
+
+
+INSTRUMENTATION_ENABLED = os.environ.get("TURBIDITY_SHINY_INSTRUMENTATION", "0") == "1"
+# tracemalloc slows every allocation down, imports included, so the memory
+# metrics have their own switch
+INSTRUMENTATION_TRACE_MEMORY = (
+    os.environ.get("TURBIDITY_SHINY_INSTRUMENTATION_MEMORY", "0") == "1"
+)
+# Decorators wrapped by install_instrumentation, with the kind of their functions
+INSTRUMENTED_DECORATOR_DICT = {
+    (reactive, "Calc"): "calc",
+    (reactive, "Effect"): "effect",
+    (render, "plot"): "render",
+    (render, "text"): "render",
+    (render, "ui"): "render",
+    (render, "table"): "render",
+    (render, "image"): "render",
+    (render, "data_frame"): "render",
+}
+# Source of the invalidations that do not come from an instrumented function:
+# input messages, invalidate_later timers...
+SESSION_SOURCE = "session"
+
+_running_name_stack = ContextVar("running_name_stack", default=())
+
+
+class ReactiveMetrics:
+    """
+    Thread-safe metrics of the instrumented reactive functions, keyed by name.
+
+    For every function: execution count, errors (including the silent ones of
+    req), wall time, memory allocated during the executions, the instrumented
+    function running when it was called (its caller) and the one running when
+    it was invalidated (its invalidation source).
+    """
+
+    def __init__(self):
+        self._metric_dict = {}
+        self._lock = threading.Lock()
+
+    def _get_metric(self, name, kind):
+        metric = self._metric_dict.get(name)
+        if metric is None:
+            metric = {
+                "kind": kind,
+                "count": 0,
+                "error_count": 0,
+                "total_seconds": 0.0,
+                "max_seconds": 0.0,
+                "last_seconds": 0.0,
+                "allocated_bytes": 0,
+                "caller_counter": Counter(),
+                "invalidation_counter": Counter(),
+            }
+            self._metric_dict[name] = metric
+        return metric
+
+    def record_execution(self, name, kind, seconds, allocated_bytes, caller, error):
+        with self._lock:
+            metric = self._get_metric(name, kind)
+            metric["count"] += 1
+            metric["error_count"] += int(error)
+            metric["total_seconds"] += seconds
+            metric["max_seconds"] = max(metric["max_seconds"], seconds)
+            metric["last_seconds"] = seconds
+            metric["allocated_bytes"] += allocated_bytes
+            metric["caller_counter"][caller] += 1
+
+    def record_invalidation(self, name, kind, source):
+        with self._lock:
+            self._get_metric(name, kind)["invalidation_counter"][source] += 1
+
+    def clear(self):
+        with self._lock:
+            self._metric_dict.clear()
+
+    def to_dataframe(self):
+        """
+        One row per function, the slowest in total first.
+        """
+        with self._lock:
+            row_list = [
+                {
+                    "name": name,
+                    "kind": metric["kind"],
+                    "count": metric["count"],
+                    "error_count": metric["error_count"],
+                    "total_seconds": metric["total_seconds"],
+                    "mean_seconds": metric["total_seconds"] / max(metric["count"], 1),
+                    "max_seconds": metric["max_seconds"],
+                    "allocated_mb": metric["allocated_bytes"] / 1024**2,
+                    "callers": ", ".join(
+                        f"{caller} ({count})"
+                        for caller, count in metric["caller_counter"].most_common()
+                    ),
+                    "invalidated_by": ", ".join(
+                        f"{source} ({count})"
+                        for source, count in metric[
+                            "invalidation_counter"
+                        ].most_common()
+                    ),
+                }
+                for name, metric in self._metric_dict.items()
+            ]
+        if len(row_list) == 0:
+            return pandas.DataFrame(columns=["name", "kind", "count", "total_seconds"])
+        return pandas.DataFrame(row_list).sort_values(
+            "total_seconds", ascending=False, ignore_index=True
+        )
+
+    def to_text(self):
+        """
+        Metrics in the Prometheus text format, with the raster cache and the
+        dataset registry gauges.
+        """
+        line_list = []
+        with self._lock:
+            for name, metric in sorted(self._metric_dict.items()):
+                labels = f'name="{name}",kind="{metric["kind"]}"'
+                line_list += [
+                    f"turbidity_shiny_reactive_executions_total{{{labels}}} {metric['count']}",
+                    f"turbidity_shiny_reactive_errors_total{{{labels}}} {metric['error_count']}",
+                    f"turbidity_shiny_reactive_seconds_total{{{labels}}} {metric['total_seconds']:.6f}",
+                    f"turbidity_shiny_reactive_seconds_max{{{labels}}} {metric['max_seconds']:.6f}",
+                    f"turbidity_shiny_reactive_allocated_bytes_total{{{labels}}} {metric['allocated_bytes']}",
+                ]
+                for caller, count in sorted(metric["caller_counter"].items()):
+                    line_list.append(
+                        f'turbidity_shiny_reactive_calls_total{{{labels},caller="{caller}"}} {count}'
+                    )
+                for source, count in sorted(metric["invalidation_counter"].items()):
+                    line_list.append(
+                        f'turbidity_shiny_reactive_invalidations_total{{{labels},source="{source}"}} {count}'
+                    )
+        line_list += [
+            f"turbidity_shiny_raster_cache_bytes {RASTER_CACHE.nbytes}",
+            f"turbidity_shiny_raster_cache_entries {len(RASTER_CACHE)}",
+            f"turbidity_shiny_raster_cache_hits_total {RASTER_CACHE.hits}",
+            f"turbidity_shiny_raster_cache_misses_total {RASTER_CACHE.misses}",
+            f"turbidity_shiny_dataset_registry_bytes {DATASET_REGISTRY.nbytes}",
+        ]
+        return "\n".join(line_list) + "\n"
+
+
+REACTIVE_METRICS = ReactiveMetrics()
+
+
+def get_function_name(function):
+    function = inspect.unwrap(function)
+    name = f"{getattr(function, '__module__', '')}.{getattr(function, '__name__', repr(function))}"
+    # Anonymous effects are all named "_"
+    if name.endswith("._") and hasattr(function, "__code__"):
+        name += f":{function.__code__.co_firstlineno}"
+    return name
+
+
+def instrument_function(function, kind, metrics=REACTIVE_METRICS):
+    """
+    Wrap a reactive function to record its executions and invalidations in metrics.
+    """
+    name = get_function_name(function)
+
+    def start():
+        running_name_stack = _running_name_stack.get()
+        caller = (
+            running_name_stack[-1] if len(running_name_stack) > 0 else SESSION_SOURCE
+        )
+        try:
+            get_current_context().on_invalidate(
+                lambda: metrics.record_invalidation(
+                    name,
+                    kind,
+                    (_running_name_stack.get() or (SESSION_SOURCE,))[-1],
+                )
+            )
+        except RuntimeError:
+            # Not called from a reactive context
+            pass
+        token = _running_name_stack.set(running_name_stack + (name,))
+        memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        return caller, token, memory, time.perf_counter()
+
+    def stop(caller, token, memory, start_time, error):
+        seconds = time.perf_counter() - start_time
+        allocated_bytes = (
+            max(tracemalloc.get_traced_memory()[0] - memory, 0)
+            if tracemalloc.is_tracing()
+            else 0
+        )
+        _running_name_stack.reset(token)
+        metrics.record_execution(name, kind, seconds, allocated_bytes, caller, error)
+
+    if inspect.iscoroutinefunction(function):
+
+        @functools.wraps(function)
+        async def instrumented_function(*args, **kwargs):
+            state = start()
+            error = True
+            try:
+                result = await function(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                stop(*state, error)
+
+    else:
+
+        @functools.wraps(function)
+        def instrumented_function(*args, **kwargs):
+            state = start()
+            error = True
+            try:
+                result = function(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                stop(*state, error)
+
+    return instrumented_function
+
+
+def instrument_decorator(decorator, kind, metrics=REACTIVE_METRICS):
+    """
+    Wrap a shiny decorator used as ``@decorator`` or ``@decorator(**kwargs)``.
+    """
+
+    @functools.wraps(decorator)
+    def instrumented_decorator(fn=None, **kwargs):
+        if fn is None:
+            return lambda fn: decorator(
+                instrument_function(fn, kind, metrics), **kwargs
+            )
+        return decorator(instrument_function(fn, kind, metrics), **kwargs)
+
+    instrumented_decorator.instrumented = True
+    return instrumented_decorator
+
+
+def install_instrumentation(
+    metrics=REACTIVE_METRICS, trace_memory=INSTRUMENTATION_TRACE_MEMORY
+):
+    """
+    Replace the shiny decorators of INSTRUMENTED_DECORATOR_DICT by instrumented
+    ones. It must run before the server functions are called, the decorators
+    are looked up when the reactive graph of a session is built.
+    """
+    for (module, decorator_name), kind in INSTRUMENTED_DECORATOR_DICT.items():
+        decorator = getattr(module, decorator_name)
+        if getattr(decorator, "instrumented", False):
+            continue
+        setattr(module, decorator_name, instrument_decorator(decorator, kind, metrics))
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+async def metrics_endpoint(request):
+    return PlainTextResponse(REACTIVE_METRICS.to_text())
@@ -0,0 +1,60 @@
+import importlib
+import logging
+import time
+
+from shiny import reactive
+
+
+logger = logging.getLogger(__name__)
+
+# Startup timings of every tab server, for every session of the process
+TAB_STARTUP_TIMING_LIST = []
+
+
+class LazyTabServer:
+    """
+    Start the server function of a tab only when the tab is first selected.
+
+    Both the import of the server module, with its heavy dependencies, and the
+    construction of its reactive graph are deferred. The duration of each step
+    is logged and kept in TAB_STARTUP_TIMING_LIST.
+
+    Args:
+        tab_server_dict (dict): Mapping of the tab name to the (module name,
+            server function name) of the tab.
+        input, output, session: Arguments of the Shiny server function.
+    """
+
+    def __init__(self, tab_server_dict, input, output, session):
+        self.tab_server_dict = tab_server_dict
+        self.input = input
+        self.output = output
+        self.session = session
+        self.started_tab_set = set()
+
+    def start(self, tab):
+        if tab in self.started_tab_set or tab not in self.tab_server_dict:
+            return
+        self.started_tab_set.add(tab)
+        module_name, server_function_name = self.tab_server_dict[tab]
+        start_time = time.perf_counter()
+        module = importlib.import_module(module_name)
+        import_time = time.perf_counter()
+        # The reactive graph of the tab must not depend on the caller context
+        with reactive.isolate():
+            getattr(module, server_function_name)(self.input, self.output, self.session)
+        end_time = time.perf_counter()
+        timing = {
+            "session": self.session.id,
+            "tab": tab,
+            "import_seconds": import_time - start_time,
+            "server_seconds": end_time - import_time,
+        }
+        TAB_STARTUP_TIMING_LIST.append(timing)
+        logger.info(
+            "Tab %s started in %.3fs (import %.3fs, server %.3fs)",
+            tab,
+            end_time - start_time,
+            timing["import_seconds"],
+            timing["server_seconds"],
+        )
@@ -0,0 +1,95 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# Threads shared by the prefetchers of every session, 0 disables the prefetch
+PREFETCH_MAX_WORKERS = int(os.environ.get("TURBIDITY_SHINY_PREFETCH_WORKERS", 2))
+# Images prefetched around the one shown, the next one first
+PREFETCH_OFFSET_LIST = [1, -1]
+
+_prefetch_executor = None
+_prefetch_executor_lock = threading.Lock()
+
+
+def get_prefetch_executor(max_workers=PREFETCH_MAX_WORKERS):
+    """
+    Process-wide thread pool of the prefetchers, created on first use.
+    """
+    global _prefetch_executor
+    with _prefetch_executor_lock:
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="raster_prefetch"
+            )
+        return _prefetch_executor
+
+
+def get_neighbour_index_list(index, length, offset_list=PREFETCH_OFFSET_LIST):
+    """
+    Indexes index + offset of offset_list which are inside a list of length length.
+    """
+    return [index + offset for offset in offset_list if 0 <= index + offset < length]
+
+
+class RasterPrefetcher:
+    """
+    Run raster computations in background threads so they are in the raster
+    cache when they are needed, typically the neighbours of the image shown.
+
+    Every call to prefetch starts a new generation: the tasks of the previous
+    generations that did not start yet are cancelled. A task that is already
+    running is not interrupted, its raster stays in the cache. One prefetcher is
+    used per session tab, the threads are shared.
+
+    Example:
+    >>> prefetcher = RasterPrefetcher()
+    >>> prefetcher.prefetch([functools.partial(compute_rasters, image_handler)])
+    """
+
+    def __init__(self, max_workers=PREFETCH_MAX_WORKERS):
+        self.max_workers = max_workers
+        self._generation = 0
+        self._future_list = []
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def prefetch(self, task_list):
+        """
+        Cancel the stale tasks and run the functions of task_list, in order,
+        without arguments. Their results are dropped.
+        """
+        with self._lock:
+            generation = self._cancel()
+            if self.max_workers <= 0:
+                return
+            executor = get_prefetch_executor(self.max_workers)
+            self._future_list = [
+                executor.submit(self._run, generation, task) for task in task_list
+            ]
+
+    def cancel(self):
+        with self._lock:
+            self._cancel()
+
+    def _cancel(self):
+        self._generation += 1
+        for future in self._future_list:
+            future.cancel()
+        self._future_list = []
+        return self._generation
+
+    def _run(self, generation, task):
+        # The task may have been queued behind tasks of other sessions
+        if generation != self._generation:
+            return
+        try:
+            task()
+        except Exception:
+            logger.warning("Raster prefetch failed", exc_info=True)
@@ -0,0 +1,87 @@
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy
+
+
+class HighlightScatterPlot:
+    """
+    Scatter plot of measures by group where only the highlighted points change
+    between renders.
+
+    The figure, its axes, labels, legend and one collection per group are built
+    once. Rendering a new highlight only moves points between the base and the
+    highlight collections of each group, the axes limits stay the same so the
+    click coordinates used by ``near_points`` do not move either.
+
+    Args:
+        x (numpy.ndarray): X value of every point.
+        y (numpy.ndarray): Y value of every point.
+        group_array (numpy.ndarray): Group of every point, points of a group
+            missing from ``group_color_dict`` are not drawn.
+        group_color_dict (dict): Mapping of the group label to its color, the
+            highlighted points use the "dark" version of the color.
+        xlabel, ylabel, title (str): Labels of the axes.
+
+    Example:
+    >>> plot = HighlightScatterPlot(x, y, dates, {"2023-05-11": "red"}, "NDTI", "FNU", "")
+    >>> fig = plot.render(locations == "Point 1", base_alpha=0.5)
+    """
+
+    def __init__(self, x, y, group_array, group_color_dict, xlabel, ylabel, title):
+        self.x = numpy.asarray(x, dtype=float)
+        self.y = numpy.asarray(y, dtype=float)
+        self.group_array = numpy.asarray(group_array)
+        # Not registered in pyplot, the same figure is returned by every render
+        self.figure = Figure(frameon=False, layout="tight")
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.subplots(1, 1)
+        self.group_mask_dict = {}
+        self.base_collection_dict = {}
+        self.highlight_collection_dict = {}
+        for group, color in group_color_dict.items():
+            group_mask = self.group_array == group
+            self.group_mask_dict[group] = group_mask
+            self.base_collection_dict[group] = self.ax.scatter(
+                self.x[group_mask],
+                self.y[group_mask],
+                s=10,
+                c=color,
+                label=group,
+                marker=".",
+            )
+            self.highlight_collection_dict[group] = self.ax.scatter(
+                self.x[group_mask],
+                self.y[group_mask],
+                s=10,
+                c=f"dark{color}",
+                marker="x",
+            )
+        self.ax.set_xlabel(xlabel)
+        self.ax.set_ylabel(ylabel)
+        self.ax.set_title(title)
+        self.ax.legend()
+        self.figure.patch.set_visible(False)
+        self.highlight_mask = None
+
+    def render(self, highlight_mask, base_alpha=1):
+        """
+        Highlight the points of ``highlight_mask`` and return the figure.
+        """
+        highlight_mask = numpy.asarray(highlight_mask, dtype=bool)
+        if self.highlight_mask is None or not numpy.array_equal(
+            highlight_mask, self.highlight_mask
+        ):
+            for group, group_mask in self.group_mask_dict.items():
+                self.base_collection_dict[group].set_offsets(
+                    self.get_offsets(group_mask & ~highlight_mask)
+                )
+                self.highlight_collection_dict[group].set_offsets(
+                    self.get_offsets(group_mask & highlight_mask)
+                )
+            self.highlight_mask = highlight_mask
+        for base_collection in self.base_collection_dict.values():
+            base_collection.set_alpha(base_alpha)
+        return self.figure
+
+    def get_offsets(self, mask):
+        return numpy.column_stack((self.x[mask], self.y[mask]))
@@ -0,0 +1,97 @@
+import os
+
+from astropy.convolution import Gaussian1DKernel, Gaussian2DKernel, convolve
+import numpy
+from scipy import ndimage
+
+
+GAUSSIAN_KERNEL_SIZE = 7
+SMOOTHING_BACKEND = os.environ.get("TURBIDITY_SHINY_SMOOTHING_BACKEND", "separable")
+
+
+def smooth_raster_astropy(raster, sigma, kernel_size=GAUSSIAN_KERNEL_SIZE):
+    """
+    Reference implementation: astropy convolve with a normalized 2D Gaussian
+    kernel, NaN interpolation and a boundary filled with 0.
+    """
+    gaussian_kernel = Gaussian2DKernel(
+        x_stddev=sigma,
+        y_stddev=sigma,
+        x_size=kernel_size,
+        y_size=kernel_size,
+    )
+    return convolve(raster, gaussian_kernel)
+
+
+def smooth_raster_separable(raster, sigma, kernel_size=GAUSSIAN_KERNEL_SIZE):
+    """
+    Separable implementation of smooth_raster_astropy.
+
+    The values, with NaN replaced by 0, and the weights, 1 where the raster is
+    not NaN, are convolved separately with two 1D Gaussian passes and then
+    divided. As in astropy, pixels outside the raster count as 0 valued pixels
+    with a full weight, and pixels without any valid neighbour are NaN.
+
+    Args:
+        raster (numpy.ndarray): 2D raster, NaN are interpolated.
+        sigma (float): Standard deviation of the Gaussian in pixels.
+        kernel_size (int): Odd size of the kernel.
+
+    Returns:
+        numpy.ndarray: Smoothed raster, in the dtype of a float32 raster and in
+        float64 otherwise.
+    """
+    raster = numpy.asarray(raster)
+    if raster.dtype != numpy.float32:
+        raster = raster.astype(float)
+    gaussian_kernel = Gaussian1DKernel(sigma, x_size=kernel_size).array
+    gaussian_kernel = gaussian_kernel / gaussian_kernel.sum()
+    valid_mask = ~numpy.isnan(raster)
+    value_sum = numpy.where(valid_mask, raster, raster.dtype.type(0))
+    weight_sum = valid_mask.astype(raster.dtype)
+    for axis in (0, 1):
+        value_sum = ndimage.correlate1d(
+            value_sum, gaussian_kernel, axis=axis, mode="constant", cval=0.0
+        )
+        weight_sum = ndimage.correlate1d(
+            weight_sum, gaussian_kernel, axis=axis, mode="constant", cval=1.0
+        )
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        smoothed_raster = value_sum / weight_sum
+    smoothed_raster[weight_sum == 0] = numpy.nan
+    return smoothed_raster
+
+
+SMOOTHING_BACKEND_DICT = {
+    "astropy": smooth_raster_astropy,
+    "separable": smooth_raster_separable,
+}
+
+
+def smooth_raster(raster, sigma, kernel_size=GAUSSIAN_KERNEL_SIZE, backend=None):
+    """
+    NaN interpolating Gaussian smoothing of a raster.
+
+    Args:
+        raster (numpy.ndarray): 2D raster.
+        sigma (float): Standard deviation of the Gaussian in pixels.
+        kernel_size (int): Odd size of the kernel.
+        backend (str): Key of SMOOTHING_BACKEND_DICT, SMOOTHING_BACKEND by
+            default, which is set with the TURBIDITY_SHINY_SMOOTHING_BACKEND
+            environment variable.
+
+    Returns:
+        numpy.ndarray: Smoothed raster, float32 for a float32 raster and float64
+        otherwise.
+    """
+    backend = SMOOTHING_BACKEND if backend is None else backend
+    if backend not in SMOOTHING_BACKEND_DICT:
+        raise ValueError(
+            f"Unknown smoothing backend {backend}, expected one of {list(SMOOTHING_BACKEND_DICT)}"
+        )
+    dtype = (
+        numpy.float32 if numpy.asarray(raster).dtype == numpy.float32 else numpy.float64
+    )
+    return SMOOTHING_BACKEND_DICT[backend](raster, sigma, kernel_size).astype(
+        dtype, copy=False
+    )
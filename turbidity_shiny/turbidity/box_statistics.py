@@ -0,0 +1,183 @@
+import numpy
+
+
+def get_row_col_index_array(image_handler, longitude_array, latitude_array):
+    """
+    Convert arrays of longitude and latitude to the nearest pixel row and column.
+
+    Args:
+        image_handler: Sentinel image handler of the raster.
+        longitude_array (numpy.ndarray): Longitudes of the points.
+        latitude_array (numpy.ndarray): Latitudes of the points.
+
+    Returns:
+        tuple: Two int numpy.ndarray, the rows and the columns of the points.
+    """
+    longitude_array = numpy.asarray(longitude_array, dtype=float)
+    latitude_array = numpy.asarray(latitude_array, dtype=float)
+    if len(longitude_array) == 0:
+        return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+    row_col = numpy.round(
+        numpy.asarray(
+            image_handler.get_row_col_index_from_longitide_latitude(
+                longitude_array, latitude_array
+            ),
+            dtype=float,
+        )
+    ).astype(int)
+    return row_col[0].reshape(-1), row_col[1].reshape(-1)
+
+
+def get_clipped_box(raster, row, col, box_size):
+    """
+    Return the box_size x box_size window centered on (row, col), clipped to the raster.
+
+    Unlike a plain slice, a window crossing the first row or column is clipped
+    instead of wrapping around through negative indices.
+    """
+    box_size_offset = box_size // 2
+    min_row = max(0, row - box_size_offset)
+    min_col = max(0, col - box_size_offset)
+    max_row = max(0, row + box_size_offset + 1)
+    max_col = max(0, col + box_size_offset + 1)
+    return raster[min_row:max_row, min_col:max_col]
+
+
+def create_summed_area_tables(raster):
+    """
+    Calculates the summed-area tables (integral images) of a raster containing NaN.
+
+    Args:
+        raster (numpy.ndarray): 2D float32 or float64 raster, NaN marks pixels
+            to ignore.
+
+    Returns:
+        dict: Tables of shape (rows + 1, cols + 1) with a leading row and column
+        of zeros:
+            - "sum": Cumulative sum of the valid values minus "offset".
+            - "square_sum": Cumulative sum of the squared shifted values.
+            - "count": Cumulative count of the valid values.
+            - "offset": Value subtracted before summing, improves the precision
+              of the standard deviation on large rasters.
+
+    Notes:
+        - Any box sum is then obtained with four lookups, whatever its size.
+    """
+    valid = ~numpy.isnan(raster)
+    offset = (
+        float(numpy.mean(raster, where=valid, dtype=numpy.float64))
+        if valid.any()
+        else 0.0
+    )
+    # The tables are accumulated in float64 whatever the dtype of the raster
+    shifted_raster = numpy.where(
+        valid, numpy.subtract(raster, offset, dtype=numpy.float64), 0.0
+    )
+    summed_area_tables = {"offset": offset}
+    for name, values in [
+        ("sum", shifted_raster),
+        ("square_sum", shifted_raster**2),
+        ("count", valid.astype(numpy.int64)),
+    ]:
+        table = numpy.zeros(
+            (raster.shape[0] + 1, raster.shape[1] + 1), dtype=values.dtype
+        )
+        numpy.cumsum(values, axis=0, out=table[1:, 1:])
+        numpy.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+        summed_area_tables[name] = table
+    return summed_area_tables
+
+
+def get_box_statistics_from_summed_area_tables(
+    summed_area_tables, row_array, col_array, box_size
+):
+    """
+    Calculates the NaN-aware mean and standard deviation of boxes centered on many points.
+
+    Args:
+        summed_area_tables (dict): Output of create_summed_area_tables.
+        row_array (numpy.ndarray): Rows of the box centers.
+        col_array (numpy.ndarray): Columns of the box centers.
+        box_size (int): Width of the square box, in pixels.
+
+    Returns:
+        tuple: Two numpy.ndarray, the mean and the standard deviation of each box.
+
+    Notes:
+        - Boxes are clipped to the raster.
+        - The standard deviation is the population one, same as numpy.nanstd.
+        - The statistics are NaN when the box center is outside the raster or
+          when the box contains no valid pixel.
+    """
+    count_table = summed_area_tables["count"]
+    n_rows, n_cols = count_table.shape[0] - 1, count_table.shape[1] - 1
+    row_array = numpy.asarray(row_array, dtype=int)
+    col_array = numpy.asarray(col_array, dtype=int)
+    box_size_offset = box_size // 2
+    min_row = numpy.clip(row_array - box_size_offset, 0, n_rows)
+    max_row = numpy.clip(row_array + box_size_offset + 1, 0, n_rows)
+    min_col = numpy.clip(col_array - box_size_offset, 0, n_cols)
+    max_col = numpy.clip(col_array + box_size_offset + 1, 0, n_cols)
+
+    def box_sum(table):
+        return (
+            table[max_row, max_col]
+            - table[min_row, max_col]
+            - table[max_row, min_col]
+            + table[min_row, min_col]
+        )
+
+    count = box_sum(count_table)
+    inside = (
+        (row_array >= 0)
+        & (row_array < n_rows)
+        & (col_array >= 0)
+        & (col_array < n_cols)
+        & (count > 0)
+    )
+    safe_count = numpy.where(inside, count, 1)
+    shifted_mean = box_sum(summed_area_tables["sum"]) / safe_count
+    variance = (
+        box_sum(summed_area_tables["square_sum"]) / safe_count - shifted_mean**2
+    )
+    mean = numpy.where(inside, shifted_mean + summed_area_tables["offset"], numpy.nan)
+    variance = numpy.where(count > 1, numpy.clip(variance, 0, None), 0.0)
+    std = numpy.where(inside, numpy.sqrt(variance), numpy.nan)
+    return mean, std
+
+
+def get_box_statistics(raster, row_array, col_array, box_size, summed_area_tables=None):
+    """
+    Calculates the NaN-aware mean and standard deviation of boxes centered on many points.
+
+    The summed-area tables are built once for the raster, pass them with
+    ``summed_area_tables`` to reuse them across calls.
+    """
+    if summed_area_tables is None:
+        summed_area_tables = create_summed_area_tables(raster)
+    return get_box_statistics_from_summed_area_tables(
+        summed_area_tables, row_array, col_array, box_size
+    )
+
+
+def get_box_statistics_from_longitude_latitude(
+    image_handler,
+    raster,
+    longitude_array,
+    latitude_array,
+    box_size,
+    summed_area_tables=None,
+):
+    """
+    Calculates the NaN-aware mean and standard deviation of the raster around many
+    geographic points, converting all the coordinates at once.
+
+    Returns:
+        tuple: Two numpy.ndarray, the mean and the standard deviation of each box.
+    """
+    row_array, col_array = get_row_col_index_array(
+        image_handler, longitude_array, latitude_array
+    )
+    return get_box_statistics(
+        raster, row_array, col_array, box_size, summed_area_tables
+    )
@@ -1,10 +1,11 @@
 import pandas
 
+from turbidity_shiny.band_store import load_image_handler_list
+from turbidity_shiny.dataset_registry import DATASET_REGISTRY
+from turbidity_shiny.turbidity.probe_store import load_probe_data
+from turbidity_shiny.turbidity.probe_time_series import ProbeTimeSeries
 from turbidity_shiny.utils import (
     load_json_data,
-    load_pickle_data,
-    convert_string_date_to_datetime_2022,
-    convert_string_date_to_datetime_2023,
     get_turbidity_geo_coordinates_from_path,
 )
 
@@ -18,8 +19,27 @@ GEO_COORDINATE_PATH_DICT = {
 }
 
 
+def get_step_progress_callback(progress_callback, step_index, step_count):
+    """
+    Progress callback of the step step_index of a loader made of step_count
+    steps: the progress (value, total) of the step is reported to
+    progress_callback as (step_index + value / total, step_count).
+    """
+    if progress_callback is None:
+        return None
+
+    def step_progress_callback(value, total):
+        progress_callback(step_index + (value / total if total else 0), step_count)
+
+    return step_progress_callback
+
+
 def load_turbidity_data(
-    estuary_name, modified_turbidity_location, atmoshperic_correction
+    estuary_name,
+    modified_turbidity_location,
+    atmoshperic_correction,
+    owner=None,
+    progress_callback=None,
 ):
     """
     Load turbidity data for a specific estuary.
@@ -27,6 +47,10 @@ def load_turbidity_data(
     Parameters:
     - estuary_name (str): The name of the estuary. It is case-insensitive.
     - modified_turbidity_location (str): The location type for turbidity data, either "Original" or "Modifiée manuellement".
+    - owner (str, optional): Registry owner, see get_session_owner. When given, the data is shared
+      with every session through DATASET_REGISTRY and must not be modified.
+    - progress_callback (callable, optional): Called as progress_callback(value, total) before each
+      image and each loading step, see turbidity_shiny.background_task.TaskProgress.
 
     Returns:
     tuple: A tuple containing three elements:
@@ -37,13 +61,39 @@ def load_turbidity_data(
     Example:
     >>> image_handler_list, turbidity_measures_data, turbidity_location_data = load_turbidity_data("estuary_1", "Original")
     """
+    # Also checks the cancellation before waiting for another session loading
+    # the same dataset
+    if progress_callback is not None:
+        progress_callback(0, 2)
+    if owner is not None:
+        return DATASET_REGISTRY.acquire(
+            owner,
+            (
+                "turbidity",
+                estuary_name.lower(),
+                modified_turbidity_location,
+                atmoshperic_correction,
+            ),
+            lambda: load_turbidity_data(
+                estuary_name,
+                modified_turbidity_location,
+                atmoshperic_correction,
+                progress_callback=progress_callback,
+            ),
+        )
     estuary_name = estuary_name.lower()
+    image_progress_callback = get_step_progress_callback(progress_callback, 0, 2)
     if atmoshperic_correction == "Sen2Cor":
-        image_handler_list = load_pickle_data(f"data/turbidity/{estuary_name}_2023.pkl")
+        image_handler_list = load_image_handler_list(
+            f"data/turbidity/{estuary_name}_2023.pkl", image_progress_callback
+        )
     elif atmoshperic_correction == "Acolite":
-        image_handler_list = load_pickle_data(
-            f"data/turbidity/acolite/{estuary_name}_2023.pkl"
+        image_handler_list = load_image_handler_list(
+            f"data/turbidity/acolite/{estuary_name}_2023.pkl",
+            image_progress_callback,
         )
+    if progress_callback is not None:
+        progress_callback(1, 2)
     turbidity_measures_data = load_json_data(
         f"../data/field_work/json/summer_2023/{estuary_name}_measures.json"
     )
@@ -58,58 +108,89 @@ def load_turbidity_data(
     return image_handler_list, turbidity_measures_data, turbidity_location_data
 
 
-def load_and_clean_turbidity_fixed_data(csv_path: str, year) -> pandas.DataFrame:
-    """
-    Load csv data with ";" delimeter. Rename coloumns with lower caracters.
-    Date is also converted
-    """
-    data = pandas.read_csv(csv_path)
-    data.columns = [col.lower() for col in data.columns]
-    if year == "2023":
-        data["date"] = data["date and time"].apply(convert_string_date_to_datetime_2023)
-    if year == "2022":
-        data["date"] = data["date"].apply(convert_string_date_to_datetime_2022)
-    return data
-
-
-def load_turbidity_fixed_data(estuary_name, atmoshperic_correction, years):
+def load_turbidity_fixed_data(
+    estuary_name, atmoshperic_correction, years, owner=None, progress_callback=None
+):
     """
     Load turbidity fixed data for a specific estuary.
 
     Parameters:
     - estuary_name (str): The name of the estuary. It is case-insensitive.
+    - owner (str, optional): Registry owner, see get_session_owner. When given, the data is shared
+      with every session through DATASET_REGISTRY and must not be modified.
+    - progress_callback (callable, optional): Called as progress_callback(value, total) before each
+      image and after each year, see turbidity_shiny.background_task.TaskProgress.
 
     Returns:
     tuple: A tuple containing three elements:
         1. list: Image handler list loaded from the pickled data file.
-        2. pandas.DataFrane: Turbidity measures data loaded from the csv file.
+        2. ProbeTimeSeries: Time-sorted turbidity measures loaded from the csv files.
         3. dict: Turbidity location data loaded from the appropriate JSON file.
 
     Example:
     >>> image_handler_list, turbidity_measures_data, turbidity_location_data = load_turbidity_fixed_data("estuary_1")
     """
-    atmoshperic_correction = atmoshperic_correction.lower()
     years_list = years.split("/")
+    if progress_callback is not None:
+        progress_callback(0, len(years_list))
+    if owner is not None:
+        return DATASET_REGISTRY.acquire(
+            owner,
+            (
+                "turbidity_fixed",
+                estuary_name.lower(),
+                atmoshperic_correction.lower(),
+                years,
+            ),
+            lambda: load_turbidity_fixed_data(
+                estuary_name,
+                atmoshperic_correction,
+                years,
+                progress_callback=progress_callback,
+            ),
+        )
+    atmoshperic_correction = atmoshperic_correction.lower()
     estuary_name = estuary_name.lower()
     image_handler_list = []
     fixed_turbidity_data_list = []
     turbidity_geo_coordinate_dict = {}
-    for year in years_list:
+    for year_index, year in enumerate(years_list):
         image_handler_list.extend(
-            load_pickle_data(
-                f"data/turbidity_fixed/{year}/{atmoshperic_correction}/{estuary_name}.pkl"
-            )
-        )
-        fixed_turbidity_data_list.append(
-            load_and_clean_turbidity_fixed_data(
-                f"../data/{year}_data/outlier_removal/{estuary_name}.csv", year
+            load_image_handler_list(
+                f"data/turbidity_fixed/{year}/{atmoshperic_correction}/{estuary_name}.pkl",
+                get_step_progress_callback(
+                    progress_callback, year_index, len(years_list)
+                ),
             )
         )
+        fixed_turbidity_data_list.append(load_probe_data(estuary_name, year))
         turbidity_geo_coordinate_dict[year] = get_turbidity_geo_coordinates_from_path(
             f"../data/field_work/json/probe/{estuary_name}_{year}.json"
         )
+        if progress_callback is not None:
+            progress_callback(year_index + 1, len(years_list))
 
-    fixed_turbidity_data = pandas.concat(fixed_turbidity_data_list).reset_index(
-        drop=True
-    )
+    fixed_turbidity_data = ProbeTimeSeries(pandas.concat(fixed_turbidity_data_list))
     return image_handler_list, fixed_turbidity_data, turbidity_geo_coordinate_dict
+
+
+def load_water_image_handler_list(estuary_name, owner=None):
+    """
+    Load the 2022 cloud free image handlers of an estuary used by the water detection tab.
+
+    Parameters:
+    - estuary_name (str): The name of the estuary. It is case-insensitive.
+    - owner (str, optional): Registry owner, see get_session_owner. When given, the data is shared
+      with every session through DATASET_REGISTRY and must not be modified.
+
+    Returns:
+    list: Image handler list.
+    """
+    estuary_name = estuary_name.lower()
+    if owner is not None:
+        return DATASET_REGISTRY.acquire(
+            owner,
+            ("water", estuary_name),
+            lambda: load_water_image_handler_list(estuary_name),
+        )
+    return load_image_handler_list(f"data/{estuary_name}_2022.lzma.pkl")
@@ -0,0 +1,129 @@
+import os
+from pathlib import Path
+import tempfile
+
+import pandas
+
+from turbidity_shiny.utils import convert_string_date_series_to_datetime
+
+
+PROBE_STORE_DIRECTORY = "../data/probe_store"
+PROBE_COLUMN_LIST = ["date", "filtered_interpolated_turbidity"]
+PROBE_DATE_COLUMN_DICT = {
+    "2022": ("date", "%Y-%m-%d"),
+    "2023": ("date and time", "%Y-%d-%m"),
+}
+
+
+def get_probe_csv_path(estuary_name, year):
+    return Path(f"../data/{year}_data/outlier_removal/{estuary_name}.csv")
+
+
+def get_probe_store_path(estuary_name, year, store_directory=PROBE_STORE_DIRECTORY):
+    """
+    Parquet file of the probe measures of one estuary and one year, partitioned
+    as "<store_directory>/estuary=<estuary_name>/year=<year>/data.parquet".
+    """
+    return (
+        Path(store_directory)
+        / f"estuary={estuary_name}"
+        / f"year={year}"
+        / "data.parquet"
+    )
+
+
+def load_and_clean_turbidity_fixed_data(csv_path: str, year) -> pandas.DataFrame:
+    """
+    Load csv data with ";" delimeter. Rename coloumns with lower caracters.
+    Date is also converted
+    """
+    data = pandas.read_csv(csv_path)
+    data.columns = [col.lower() for col in data.columns]
+    date_column, date_format = PROBE_DATE_COLUMN_DICT[year]
+    data["date"] = convert_string_date_series_to_datetime(
+        data[date_column], date_format
+    )
+    return data
+
+
+def convert_probe_csv_to_probe_store(csv_path, year, store_path):
+    """
+    Convert a probe csv file to its parquet file with a datetime64 "date" column,
+    sorted by date. The file is written to a unique temporary file of the same
+    directory and then renamed.
+    """
+    data = load_and_clean_turbidity_fixed_data(csv_path, year)[PROBE_COLUMN_LIST]
+    data = data.sort_values("date", kind="stable").reset_index(drop=True)
+    store_path = Path(store_path)
+    store_path.parent.mkdir(parents=True, exist_ok=True)
+    # Every writer has its own temporary file, two conversions of the same
+    # store never write to the same file
+    with tempfile.NamedTemporaryFile(
+        dir=store_path.parent,
+        prefix=f".{store_path.stem}.",
+        suffix=".tmp",
+        delete=False,
+    ) as tmp_store_file:
+        tmp_store_path = tmp_store_file.name
+    try:
+        data.to_parquet(tmp_store_path, engine="pyarrow", index=False)
+        os.replace(tmp_store_path, store_path)
+    except BaseException:
+        Path(tmp_store_path).unlink(missing_ok=True)
+        raise
+    return data
+
+
+def load_probe_store(
+    store_path, column_list=PROBE_COLUMN_LIST, start_date=None, end_date=None
+):
+    """
+    Read the columns column_list of a probe parquet file, only the rows with a
+    date between start_date and end_date (included) when they are given.
+    """
+    filters = []
+    if start_date is not None:
+        filters.append(("date", ">=", pandas.Timestamp(start_date)))
+    if end_date is not None:
+        filters.append(("date", "<=", pandas.Timestamp(end_date)))
+    return pandas.read_parquet(
+        store_path,
+        engine="pyarrow",
+        columns=column_list,
+        filters=filters if len(filters) > 0 else None,
+    )
+
+
+def load_probe_data(
+    estuary_name,
+    year,
+    start_date=None,
+    end_date=None,
+    store_directory=PROBE_STORE_DIRECTORY,
+):
+    """
+    Load the probe measures of one estuary and one year from the probe store.
+
+    The csv file is converted to the store the first time, and again when it is
+    more recent than its parquet file. When the store can not be written, the
+    csv file is read directly.
+
+    Returns:
+        pandas.DataFrame: "date" and "filtered_interpolated_turbidity" columns.
+    """
+    csv_path = get_probe_csv_path(estuary_name, year)
+    store_path = get_probe_store_path(estuary_name, year, store_directory)
+    if csv_path.exists() and (
+        not store_path.exists() or csv_path.stat().st_mtime > store_path.stat().st_mtime
+    ):
+        try:
+            convert_probe_csv_to_probe_store(csv_path, year, store_path)
+        except OSError:
+            data = load_and_clean_turbidity_fixed_data(csv_path, year)
+            date_mask = pandas.Series(True, index=data.index)
+            if start_date is not None:
+                date_mask &= data["date"] >= pandas.Timestamp(start_date)
+            if end_date is not None:
+                date_mask &= data["date"] <= pandas.Timestamp(end_date)
+            return data.loc[date_mask, PROBE_COLUMN_LIST].reset_index(drop=True)
+    return load_probe_store(store_path, PROBE_COLUMN_LIST, start_date, end_date)
@@ -0,0 +1,105 @@
+import numpy
+import pandas
+
+
+# The image dates are in UTC, the probe dates in local time (UTC-4)
+PROBE_TIME_OFFSET = pandas.Timedelta(hours=4)
+
+
+def get_probe_date_from_image_date_list(image_date_list):
+    """
+    Convert image handler dates ("2023-07-20T15:17:01.000Z") to the probe local time.
+    """
+    return (
+        pandas.to_datetime(
+            [image_date[:19] for image_date in image_date_list],
+            format="%Y-%m-%dT%H:%M:%S",
+        )
+        - PROBE_TIME_OFFSET
+    )
+
+
+class ProbeTimeSeries:
+    """
+    Time-sorted fixed probe measures, indexed to match many image dates at once.
+
+    The nearest measure of every date is found with a single searchsorted call
+    and the mean of the ``window`` measures around it from cumulative sums of
+    the values and of the non-NaN counts, instead of a scan of every measure
+    per image.
+
+    Args:
+        data (pandas.DataFrame): Probe measures with a "date" column.
+        value_column (str): Column of the measures.
+
+    Example:
+    >>> probe_time_series = ProbeTimeSeries(fixed_turbidity_data)
+    >>> turbidity_array, time_diff_index = probe_time_series.match(image_date_list, window=2)
+    """
+
+    def __init__(self, data, value_column="filtered_interpolated_turbidity"):
+        self.data = data.sort_values("date", kind="stable").reset_index(drop=True)
+        self.value_column = value_column
+        self.date_array = self.data["date"].to_numpy(dtype="datetime64[ns]")
+        value_array = self.data[value_column].to_numpy(dtype=float)
+        valid_mask = ~numpy.isnan(value_array)
+        self.value_cumsum = numpy.concatenate(
+            ([0.0], numpy.cumsum(numpy.where(valid_mask, value_array, 0.0)))
+        )
+        self.count_cumsum = numpy.concatenate(([0], numpy.cumsum(valid_mask)))
+
+    def __len__(self):
+        return len(self.date_array)
+
+    def get_nearest_index(self, date_array):
+        """
+        Row of the nearest measure of every date. On a tie, or with repeated
+        probe dates, the first row in time is kept.
+        """
+        date_array = numpy.asarray(date_array, dtype="datetime64[ns]")
+        after_index = numpy.searchsorted(self.date_array, date_array, side="left")
+        before_index = numpy.clip(after_index - 1, 0, len(self) - 1)
+        after_index = numpy.clip(after_index, 0, len(self) - 1)
+        before_distance = numpy.abs(date_array - self.date_array[before_index])
+        after_distance = numpy.abs(self.date_array[after_index] - date_array)
+        nearest_index = numpy.where(
+            before_distance <= after_distance, before_index, after_index
+        )
+        # First row of a run of equal dates
+        return numpy.searchsorted(
+            self.date_array, self.date_array[nearest_index], side="left"
+        )
+
+    def get_window_mean(self, index_array, window=0):
+        """
+        Mean of the non-NaN measures of rows index - window to index + window.
+        """
+        start_index = numpy.clip(index_array - window, 0, len(self))
+        end_index = numpy.clip(index_array + window + 1, 0, len(self))
+        count = self.count_cumsum[end_index] - self.count_cumsum[start_index]
+        value_sum = self.value_cumsum[end_index] - self.value_cumsum[start_index]
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            return numpy.where(count > 0, value_sum / count, numpy.nan)
+
+    def match(self, image_date_list, window=0):
+        """
+        Match image handler dates with the probe measures.
+
+        Args:
+            image_date_list (list): Dates of the image handlers.
+            window (int): Number of measures before and after the nearest one
+                averaged with it.
+
+        Returns:
+            tuple:
+                1. numpy.ndarray: Mean turbidity around the nearest measure of
+                   every image.
+                2. pandas.TimedeltaIndex: Probe date minus image date of the
+                   nearest measure of every image.
+        """
+        probe_date_array = get_probe_date_from_image_date_list(image_date_list)
+        nearest_index = self.get_nearest_index(probe_date_array)
+        time_diff_index = pandas.TimedeltaIndex(
+            self.date_array[nearest_index] - probe_date_array.to_numpy()
+        )
+        return self.get_window_mean(nearest_index, window), time_diff_index
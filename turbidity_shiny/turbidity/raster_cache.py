@@ -0,0 +1,153 @@
+from collections import OrderedDict
+import os
+import threading
+import weakref
+
+import numpy
+
+
+RASTER_CACHE_MAX_BYTES = int(
+    os.environ.get("TURBIDITY_SHINY_RASTER_CACHE_MAX_BYTES", 1024 * 1024 * 1024)
+)
+
+
+def get_image_handler_key(image_handler):
+    """
+    Key identifying an image handler inside a raster cache.
+
+    The acquisition date alone is not unique: the same date exists for several
+    estuaries and for both atmospheric corrections. The handler identity is
+    therefore part of the key, and the cache keeps a weak reference to the
+    handler so a recycled ``id`` can never return a stale raster.
+    """
+    return (id(image_handler), image_handler.date)
+
+
+def get_raster_nbytes(raster):
+    """
+    Number of bytes held by a cached value (array, tuple of arrays, dict of arrays
+    or any object with a ``nbytes`` attribute).
+    """
+    if isinstance(raster, numpy.ndarray):
+        return raster.nbytes
+    if isinstance(raster, (tuple, list)):
+        return sum(get_raster_nbytes(value) for value in raster)
+    if isinstance(raster, dict):
+        return sum(get_raster_nbytes(value) for value in raster.values())
+    return getattr(raster, "nbytes", 0)
+
+
+def set_raster_read_only(raster):
+    if isinstance(raster, numpy.ndarray):
+        raster.flags.writeable = False
+    elif isinstance(raster, (tuple, list)):
+        for value in raster:
+            set_raster_read_only(value)
+    elif isinstance(raster, dict):
+        for value in raster.values():
+            set_raster_read_only(value)
+    return raster
+
+
+class RasterCache:
+    """
+    Thread-safe LRU cache of full-scene rasters with a memory budget.
+
+    Entries are keyed by ``(get_image_handler_key(image_handler), *parameters)``.
+    When the total size of the cached rasters exceeds ``max_bytes``, the least
+    recently used entries are evicted. Cached arrays are made read-only since
+    they are shared between every caller. A raster requested by several threads
+    at once is only computed by the first one.
+    """
+
+    def __init__(self, max_bytes=RASTER_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._computing_lock_dict = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def get(self, image_handler, parameters):
+        with self._lock:
+            raster = self._get(image_handler, parameters)
+            if raster is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return raster
+
+    def set(self, image_handler, parameters, raster):
+        key = (get_image_handler_key(image_handler), parameters)
+        raster = set_raster_read_only(raster)
+        nbytes = get_raster_nbytes(raster)
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            if nbytes > self.max_bytes:
+                return raster
+            self._entries[key] = (weakref.ref(image_handler), raster, nbytes)
+            self._nbytes += nbytes
+            self._evict()
+        return raster
+
+    def get_or_compute(self, image_handler, parameters, compute_function):
+        """
+        Return the cached raster for ``(image_handler, parameters)``, computing
+        it with ``compute_function()`` and storing it on a miss.
+        """
+        raster = self.get(image_handler, parameters)
+        if raster is not None:
+            return raster
+        key = (get_image_handler_key(image_handler), parameters)
+        with self._lock:
+            computing_lock = self._computing_lock_dict.setdefault(key, threading.Lock())
+        # Only one thread computes a given raster, the others (e.g. a renderer
+        # waiting for the prefetcher) wait and reuse it
+        with computing_lock:
+            with self._lock:
+                raster = self._get(image_handler, parameters)
+            if raster is None:
+                try:
+                    raster = self.set(image_handler, parameters, compute_function())
+                finally:
+                    with self._lock:
+                        self._computing_lock_dict.pop(key, None)
+        return raster
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def _get(self, image_handler, parameters):
+        key = (get_image_handler_key(image_handler), parameters)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        image_handler_ref, raster, _ = entry
+        if image_handler_ref() is not image_handler:
+            self._pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return raster
+
+    def _pop(self, key):
+        _, _, nbytes = self._entries.pop(key)
+        self._nbytes -= nbytes
+
+    def _evict(self):
+        while self._nbytes > self.max_bytes and len(self._entries) > 0:
+            key = next(iter(self._entries))
+            self._pop(key)
+
+
+RASTER_CACHE = RasterCache()
@@ -0,0 +1,456 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from itertools import product
+from pathlib import Path
+
+import numpy
+import pandas
+from outliers import smirnov_grubbs as grubbs
+from scipy.stats import linregress
+
+from turbidity_shiny.turbidity_index import create_turbidity_index_raster_dict
+from turbidity_shiny.turbidity.box_statistics import (
+    create_summed_area_tables,
+    get_box_statistics_from_summed_area_tables,
+    get_clipped_box,
+    get_row_col_index_array,
+)
+from turbidity_shiny.turbidity.load_data import (
+    load_turbidity_data,
+    load_turbidity_fixed_data,
+)
+from turbidity_shiny.turbidity.turbidity_df import (
+    create_image_handler_date_dict,
+    create_smoothed_turbidity_index_from_water_index_mask,
+    create_water_index_mask,
+    get_water_index_raster,
+)
+
+
+SITU_RESULT_DIRECTORY = "data/result_turbidity_ponctuelle_ac"
+FIXED_RESULT_DIRECTORY = "data/result_turbidity_fixed_ac"
+SITU_OUTLIER_THRESHOLD = 70
+FIXED_LAST_VALID_DATE = datetime(2023, 11, 19)
+
+DEFAULT_WATER_INDEX_THRESHOLD_LIST = [-0.1, -0.05, 0.0, 0.05, 0.1]
+DEFAULT_BOX_SIZE_LIST = [1, 3, 5, 7]
+DEFAULT_NDTI_SMOOTHED_SIGMA_LIST = [0, 1, 2, 3]
+DEFAULT_SITU_TYPE_OF_TURBIDITY_INDEX_LIST = [
+    "NDTI",
+    "Bande Rouge (665nm)",
+    "Bande Infra Rouge (833nm)",
+]
+DEFAULT_FIXED_TYPE_OF_TURBIDITY_INDEX_LIST = [
+    "NDTI",
+    "Bande Rouge (665nm)",
+    "Bande Infra Rouge (833nm)",
+    "(665nm)/(833nm)",
+]
+DEFAULT_TURBIDITY_DF_WINDOW_LIST = [0, 1, 2, 4]
+Y_NAME_LIST = ["measure", "log_measure"]
+
+
+def iterate_smoothed_turbidity_index(
+    image_handler,
+    type_of_turbidity_index_list,
+    water_index_threshold_list,
+    ndti_smoothed_sigma_list,
+):
+    """
+    Yield every smoothed turbidity index raster of the grid for one image.
+
+    Rasters are built stage by stage (turbidity index, water index mask,
+    smoothing) so each stage is computed once and shared by all the grid points
+    with the same prefix. The turbidity indices of every type share the band
+    casts, see create_turbidity_index_raster_dict.
+
+    Yields:
+        tuple: (type_of_turbidity_index, water_index_threshold,
+        ndti_smoothed_sigma, raster)
+    """
+    water_index = get_water_index_raster(image_handler, raster_cache=None)
+    bridge_mask = image_handler.get_mask_from_bridge_points_handler()
+    water_index_mask_dict = {
+        water_index_threshold: create_water_index_mask(
+            water_index, water_index_threshold, bridge_mask
+        )
+        for water_index_threshold in water_index_threshold_list
+    }
+    del water_index
+    # Every index in one pass over the bands, each is dropped once used
+    turbidity_index_dict = create_turbidity_index_raster_dict(
+        image_handler.red_band,
+        image_handler.green_band,
+        image_handler.nir_band,
+        type_of_turbidity_index_list,
+        image_handler,
+    )
+    for type_of_turbidity_index in type_of_turbidity_index_list:
+        turbidity_index = turbidity_index_dict.pop(type_of_turbidity_index)
+        for water_index_threshold, ndti_smoothed_sigma in product(
+            water_index_threshold_list, ndti_smoothed_sigma_list
+        ):
+            yield (
+                type_of_turbidity_index,
+                water_index_threshold,
+                ndti_smoothed_sigma,
+                create_smoothed_turbidity_index_from_water_index_mask(
+                    turbidity_index,
+                    water_index_mask_dict[water_index_threshold],
+                    ndti_smoothed_sigma,
+                ),
+            )
+
+
+def get_linear_regression_result(x, y):
+    """
+    Linear regression of y on x, with NaN results when it is undefined.
+    """
+    if len(x) < 3 or numpy.all(x == x[0]):
+        return {
+            "r2": numpy.nan,
+            "pvalue": numpy.nan,
+            "slope": numpy.nan,
+            "intercept": numpy.nan,
+        }
+    regression = linregress(x, y)
+    return {
+        "r2": regression.rvalue**2,
+        "pvalue": regression.pvalue,
+        "slope": regression.slope,
+        "intercept": regression.intercept,
+    }
+
+
+def create_situ_result_df(
+    estuary_name,
+    atmospheric_correction,
+    modified_turbidity_location="Modifiée manuellement",
+    water_index_threshold_list=DEFAULT_WATER_INDEX_THRESHOLD_LIST,
+    box_size_list=DEFAULT_BOX_SIZE_LIST,
+    ndti_smoothed_sigma_list=DEFAULT_NDTI_SMOOTHED_SIGMA_LIST,
+    type_of_turbidity_index_list=DEFAULT_SITU_TYPE_OF_TURBIDITY_INDEX_LIST,
+):
+    """
+    Evaluate the whole hyperparameter grid for the spatial in-situ measures of
+    one estuary and one atmospheric correction.
+
+    Measures above SITU_OUTLIER_THRESHOLD FNU are excluded, same as the default
+    of the Turbidité tab.
+
+    Returns:
+        pandas.DataFrame: One row per grid point and y_name, with the columns
+        read by server_satellite_situ.
+    """
+    (
+        image_handler_list,
+        turbidity_measures_data,
+        turbidity_location_data,
+    ) = load_turbidity_data(
+        estuary_name, modified_turbidity_location, atmospheric_correction
+    )
+    image_handler_dict = create_image_handler_date_dict(image_handler_list)
+    measure_list = []
+    x_list_dict = {}
+    for measurement_dicts in turbidity_measures_data:
+        image_handler = image_handler_dict.get(measurement_dicts["date"])
+        if image_handler is None:
+            continue
+        measurements_list = [
+            measures
+            for measures in measurement_dicts["spatial_turbidity_measurement"][
+                "measurements_list"
+            ]
+            if numpy.median(measures["measures"]) < SITU_OUTLIER_THRESHOLD
+        ]
+        if len(measurements_list) == 0:
+            continue
+        measure_list.extend(
+            numpy.median(measures["measures"]) for measures in measurements_list
+        )
+        geo_coordinates_list = [
+            turbidity_location_data[measures["notes"]]["geo_coordinates"]
+            for measures in measurements_list
+        ]
+        row_array, col_array = get_row_col_index_array(
+            image_handler,
+            [geo_coordinates["lon"] for geo_coordinates in geo_coordinates_list],
+            [geo_coordinates["lat"] for geo_coordinates in geo_coordinates_list],
+        )
+        for (
+            type_of_turbidity_index,
+            water_index_threshold,
+            ndti_smoothed_sigma,
+            raster,
+        ) in iterate_smoothed_turbidity_index(
+            image_handler,
+            type_of_turbidity_index_list,
+            water_index_threshold_list,
+            ndti_smoothed_sigma_list,
+        ):
+            summed_area_tables = create_summed_area_tables(raster)
+            for box_size in box_size_list:
+                (
+                    turbidity_index_value_array,
+                    _,
+                ) = get_box_statistics_from_summed_area_tables(
+                    summed_area_tables, row_array, col_array, box_size
+                )
+                key = (
+                    water_index_threshold,
+                    box_size,
+                    ndti_smoothed_sigma,
+                    type_of_turbidity_index,
+                )
+                x_list_dict.setdefault(key, []).append(turbidity_index_value_array)
+
+    measure_array = numpy.array(measure_list, dtype=float)
+    y_dict = {"measure": measure_array, "log_measure": numpy.log(measure_array)}
+    result_list = []
+    for key, x_list in x_list_dict.items():
+        x = numpy.concatenate(x_list)
+        for y_name in Y_NAME_LIST:
+            y = y_dict[y_name]
+            valid = numpy.isfinite(x) & numpy.isfinite(y)
+            result_list.append(
+                {
+                    "atmospheric_correction": atmospheric_correction,
+                    "ndwi_threshold": key[0],
+                    "box_size": key[1],
+                    "ndti_smoothed_sigma": key[2],
+                    "type_of_turbidity_index": key[3],
+                    "y_name": y_name,
+                    "number_of_obs": len(x),
+                    "number_of_valid_obs": int(valid.sum()),
+                    **get_linear_regression_result(x[valid], y[valid]),
+                    "data_dict": {"x": x[valid], "y": y[valid]},
+                }
+            )
+    return pandas.DataFrame(result_list)
+
+
+def create_fixed_result_df(
+    estuary_name,
+    atmospheric_correction,
+    years,
+    water_index_threshold_list=DEFAULT_WATER_INDEX_THRESHOLD_LIST,
+    box_size_list=DEFAULT_BOX_SIZE_LIST,
+    ndti_smoothed_sigma_list=DEFAULT_NDTI_SMOOTHED_SIGMA_LIST,
+    type_of_turbidity_index_list=DEFAULT_FIXED_TYPE_OF_TURBIDITY_INDEX_LIST,
+    turbidity_df_window_list=DEFAULT_TURBIDITY_DF_WINDOW_LIST,
+):
+    """
+    Evaluate the whole hyperparameter grid for the fixed probe of one estuary,
+    one atmospheric correction and one year (or "2022/2023").
+
+    Images are kept with the same rules as create_turbidity_fixed_df, and the
+    Grubbs outliers of the measures are removed before the regression.
+
+    Returns:
+        pandas.DataFrame: One row per grid point, y_name and window, with the
+        columns read by server_satellite_fixed.
+    """
+    (
+        image_handler_list,
+        fixed_turbidity_data,
+        turbidity_geo_coordinate_dict,
+    ) = load_turbidity_fixed_data(estuary_name, atmospheric_correction, years)
+    image_date_list = [image_handler.date for image_handler in image_handler_list]
+    _, time_diff_index = fixed_turbidity_data.match(image_date_list)
+    turbidity_array_dict = {
+        window: fixed_turbidity_data.match(image_date_list, window)[0]
+        for window in turbidity_df_window_list
+    }
+    measure_list_dict = {window: [] for window in turbidity_df_window_list}
+    x_list_dict = {}
+    for image_idx, image_handler in enumerate(image_handler_list):
+        image_date = datetime.strptime(image_handler.date[:19], "%Y-%m-%dT%H:%M:%S")
+        time_diff = time_diff_index[image_idx]
+        if numpy.abs(time_diff).days != 0 or image_date >= FIXED_LAST_VALID_DATE:
+            continue
+        for window in turbidity_df_window_list:
+            measure_list_dict[window].append(turbidity_array_dict[window][image_idx])
+        turbidity_geo_coordinate = turbidity_geo_coordinate_dict[image_handler.date[:4]]
+        row_array, col_array = get_row_col_index_array(
+            image_handler,
+            [turbidity_geo_coordinate["lon"]],
+            [turbidity_geo_coordinate["lat"]],
+        )
+        for (
+            type_of_turbidity_index,
+            water_index_threshold,
+            ndti_smoothed_sigma,
+            raster,
+        ) in iterate_smoothed_turbidity_index(
+            image_handler,
+            type_of_turbidity_index_list,
+            water_index_threshold_list,
+            ndti_smoothed_sigma_list,
+        ):
+            for box_size in box_size_list:
+                box = get_clipped_box(raster, row_array[0], col_array[0], box_size)
+                key = (
+                    water_index_threshold,
+                    box_size,
+                    ndti_smoothed_sigma,
+                    type_of_turbidity_index,
+                )
+                x_list_dict.setdefault(key, []).append(
+                    numpy.nanmean(box) if numpy.any(~numpy.isnan(box)) else numpy.nan
+                )
+
+    result_list = []
+    for key, x_list in x_list_dict.items():
+        for window, y_name in product(turbidity_df_window_list, Y_NAME_LIST):
+            x = numpy.array(x_list, dtype=float)
+            y = numpy.array(measure_list_dict[window], dtype=float)
+            # Same as create_turbidity_fixed_df, images without measure are dropped
+            x, y = x[~numpy.isnan(y)], y[~numpy.isnan(y)]
+            if y_name == "log_measure":
+                y = numpy.log(y)
+            valid = numpy.isfinite(x) & numpy.isfinite(y)
+            x_valid, y_valid = x[valid], y[valid]
+            non_outlier_index = numpy.ones(len(y_valid), dtype=bool)
+            if len(y_valid) > 2:
+                non_outlier_index = ~numpy.isin(
+                    y_valid, grubbs.max_test_outliers(y_valid, alpha=0.05)
+                )
+            x_without_outlier = x_valid[non_outlier_index]
+            y_without_outlier = y_valid[non_outlier_index]
+            result_list.append(
+                {
+                    "atmospheric_correction": atmospheric_correction,
+                    "ndwi_threshold": key[0],
+                    "box_size": key[1],
+                    "ndti_smoothed_sigma": key[2],
+                    "type_of_turbidity_index": key[3],
+                    "y_name": y_name,
+                    "turbidity_df_window": window,
+                    "number_of_obs": len(x),
+                    "number_of_valid_obs": int(valid.sum()),
+                    "number_of_valid_obs_without_outlier": len(y_without_outlier),
+                    **get_linear_regression_result(
+                        x_without_outlier, y_without_outlier
+                    ),
+                    "data_dict": {
+                        "x": x_valid,
+                        "y": y_valid,
+                        "x_without_outlier": x_without_outlier,
+                        "y_without_outlier": y_without_outlier,
+                    },
+                }
+            )
+    return pandas.DataFrame(result_list)
+
+
+def get_result_path(mode, estuary_name, years=None):
+    """
+    Path of the result feather file read by the satellite/in-situ tabs.
+    """
+    estuary_name = estuary_name.lower()
+    if mode == "situ":
+        return Path(SITU_RESULT_DIRECTORY) / f"{estuary_name}_result.feather"
+    elif mode == "fixed":
+        return (
+            Path(FIXED_RESULT_DIRECTORY)
+            / years.replace("/", "-")
+            / f"{estuary_name}_estuary_result.feather"
+        )
+    raise ValueError(f"Unknown sweep mode {mode}")
+
+
+def get_part_path(mode, estuary_name, atmospheric_correction, years=None):
+    """
+    Path of the intermediate feather file of one sweep job, used to resume.
+    """
+    result_path = get_result_path(mode, estuary_name, years)
+    return (
+        result_path.parent
+        / "parts"
+        / f"{estuary_name.lower()}_{atmospheric_correction.lower()}.feather"
+    )
+
+
+def run_sweep_job(mode, estuary_name, atmospheric_correction, years, grid_kwargs):
+    if mode == "situ":
+        result_df = create_situ_result_df(
+            estuary_name, atmospheric_correction, **grid_kwargs
+        )
+    else:
+        result_df = create_fixed_result_df(
+            estuary_name, atmospheric_correction, years, **grid_kwargs
+        )
+    part_path = get_part_path(mode, estuary_name, atmospheric_correction, years)
+    part_path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first so an interrupted job is never resumed from
+    tmp_path = part_path.with_suffix(".tmp")
+    result_df.reset_index(drop=True).to_feather(tmp_path)
+    tmp_path.replace(part_path)
+    return part_path
+
+
+def combine_sweep_parts(mode, estuary_name, atmospheric_correction_list, years=None):
+    """
+    Concatenate the job feather files of an estuary into the result feather file.
+    """
+    part_df_list = [
+        pandas.read_feather(
+            get_part_path(mode, estuary_name, atmospheric_correction, years)
+        )
+        for atmospheric_correction in atmospheric_correction_list
+    ]
+    result_path = get_result_path(mode, estuary_name, years)
+    pandas.concat(part_df_list, ignore_index=True).to_feather(result_path)
+    return result_path
+
+
+def run_sweep(
+    mode,
+    estuary_name_list,
+    atmospheric_correction_list,
+    years=None,
+    grid_kwargs=None,
+    max_workers=None,
+    resume=True,
+):
+    """
+    Run the sweep of every (estuary, atmospheric correction) job in a process pool.
+
+    Each job writes its own feather file as soon as it is done. With resume, jobs
+    whose file already exists are skipped, so an interrupted sweep can be
+    restarted. The result feather file of an estuary is written once all of its
+    jobs are done.
+    """
+    grid_kwargs = {} if grid_kwargs is None else grid_kwargs
+    job_list = [
+        (estuary_name, atmospheric_correction)
+        for estuary_name, atmospheric_correction in product(
+            estuary_name_list, atmospheric_correction_list
+        )
+        if not (
+            resume
+            and get_part_path(
+                mode, estuary_name, atmospheric_correction, years
+            ).exists()
+        )
+    ]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        future_dict = {
+            executor.submit(
+                run_sweep_job,
+                mode,
+                estuary_name,
+                atmospheric_correction,
+                years,
+                grid_kwargs,
+            ): (estuary_name, atmospheric_correction)
+            for estuary_name, atmospheric_correction in job_list
+        }
+        for future in as_completed(future_dict):
+            estuary_name, atmospheric_correction = future_dict[future]
+            part_path = future.result()
+            print(f"{estuary_name} {atmospheric_correction} done: {part_path}")
+    return [
+        combine_sweep_parts(mode, estuary_name, atmospheric_correction_list, years)
+        for estuary_name in estuary_name_list
+    ]
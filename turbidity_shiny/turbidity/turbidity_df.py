@@ -1,13 +1,30 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 import numpy
 import pandas
-from astropy.convolution import Gaussian2DKernel
-from astropy.convolution import convolve
 from outliers import smirnov_grubbs as grubbs
 
 from satellite_image_handler.utils.normalize_index import create_water_index_raster
 
-from turbidity_shiny.turbidity_index import create_turbidity_index_raster
+from turbidity_shiny.band_store import StoredImageHandler
+from turbidity_shiny.smoothing import GAUSSIAN_KERNEL_SIZE, smooth_raster
+from turbidity_shiny.turbidity_index import (
+    RASTER_DTYPE,
+    TURBIDITY_INDEX_BAND_DICT,
+    create_turbidity_index_raster,
+)
+from turbidity_shiny.utils import ColumnarDataFrameBuilder
+from turbidity_shiny.turbidity.box_statistics import (
+    create_summed_area_tables,
+    get_box_statistics_from_longitude_latitude,
+    get_clipped_box,
+)
+from turbidity_shiny.turbidity.probe_time_series import ProbeTimeSeries
+from turbidity_shiny.turbidity.raster_cache import RASTER_CACHE
+
+
+# Maximum relative difference of the RASTER_DTYPE rasters to the float64 ones,
+# see get_raster_dtype_difference
+RASTER_DTYPE_TOLERANCE = 1e-5
 
 
 def create_image_handler_date_dict(image_handler_list):
@@ -28,19 +45,54 @@ def create_turbidity_df(
     exclude_points_from_bridge_points_handler,
     exlude_outlier,
     use_log_measure,
+    progress_callback=None,
 ):
+    turbidity_df = extract_turbidity_df(
+        image_handler_list,
+        turbidity_measures_data,
+        turbidity_location_data,
+        water_index_threshold,
+        box_size,
+        ndti_smoothed_sigma,
+        type_of_turbidity_index,
+        exclude_points_from_bridge_points_handler,
+        progress_callback,
+    )
+    return transform_turbidity_df(turbidity_df, exlude_outlier, use_log_measure)
+
+
+def extract_turbidity_df(
+    image_handler_list,
+    turbidity_measures_data,
+    turbidity_location_data,
+    water_index_threshold,
+    box_size,
+    ndti_smoothed_sigma,
+    type_of_turbidity_index,
+    exclude_points_from_bridge_points_handler,
+    progress_callback=None,
+):
+    """
+    Raster extraction stage of create_turbidity_df: the turbidity index statistics
+    of every in situ measure. It only depends on the raster parameters, the
+    display filters are applied by transform_turbidity_df.
+
+    progress_callback, when given, is called as progress_callback(value, total)
+    with the number of measurement days done.
+    """
     image_handler_dict = create_image_handler_date_dict(image_handler_list)
-    turbidity_df = pandas.DataFrame(
-        columns=[
-            "date",
-            "location",
-            "measure",
-            "turbidity_index_value",
-            "turbidity_index_std",
-        ]
+    turbidity_df_builder = ColumnarDataFrameBuilder(
+        {
+            "date": object,
+            "location": object,
+            "measure": float,
+            "turbidity_index_value": float,
+            "turbidity_index_std": float,
+        }
     )
-    i = 0
-    for measurement_dicts in turbidity_measures_data:
+    for measurement_index, measurement_dicts in enumerate(turbidity_measures_data):
+        if progress_callback is not None:
+            progress_callback(measurement_index, len(turbidity_measures_data))
         date = measurement_dicts["date"]
         image_handler = image_handler_dict.get(date)
         if image_handler is None:
@@ -48,48 +100,56 @@ def create_turbidity_df(
         measurements_list = measurement_dicts["spatial_turbidity_measurement"][
             "measurements_list"
         ]
-        for measures in measurements_list:
-            measure = numpy.median(measures["measures"])
-            notes = measures["notes"]
-            geo_coordinates = turbidity_location_data[notes]["geo_coordinates"]
-            row, col = numpy.round(
-                image_handler.get_row_col_index_from_longitide_latitude(
-                    geo_coordinates["lon"], geo_coordinates["lat"]
-                )
-            ).astype(int)
-            smoothed_turbidity_index_water_index_mask = (
-                get_smoothed_turbidity_index_water_index_mask(
-                    image_handler,
-                    water_index_threshold,
-                    ndti_smoothed_sigma,
-                    type_of_turbidity_index,
-                    exclude_points_from_bridge_points_handler,
-                )
+        smoothed_turbidity_index_parameters = (
+            water_index_threshold,
+            ndti_smoothed_sigma,
+            type_of_turbidity_index,
+            exclude_points_from_bridge_points_handler,
+        )
+        smoothed_turbidity_index_water_index_mask = (
+            get_smoothed_turbidity_index_water_index_mask(
+                image_handler, *smoothed_turbidity_index_parameters
             )
-            box_size_offset = box_size // 2
-            box = smoothed_turbidity_index_water_index_mask[
-                row - box_size_offset : row + box_size_offset + 1,
-                col - box_size_offset : col + box_size_offset + 1,
-            ]
-            turbidity_index_value = numpy.nanmean(box)
-            turbidity_index_std = numpy.nanstd(box)
-            turbidity_df.loc[i, "date"] = date
-            turbidity_df.loc[i, "location"] = notes
-            turbidity_df.loc[i, "measure"] = measure
-            turbidity_df.loc[i, "turbidity_index_value"] = turbidity_index_value
-            turbidity_df.loc[i, "turbidity_index_std"] = turbidity_index_std
-            i += 1
-    turbidity_df["measure"] = turbidity_df["measure"].astype(float)
+        )
+        notes_list = [measures["notes"] for measures in measurements_list]
+        geo_coordinates_list = [
+            turbidity_location_data[notes]["geo_coordinates"] for notes in notes_list
+        ]
+        (
+            turbidity_index_value_array,
+            turbidity_index_std_array,
+        ) = get_box_statistics_from_longitude_latitude(
+            image_handler,
+            smoothed_turbidity_index_water_index_mask,
+            [geo_coordinates["lon"] for geo_coordinates in geo_coordinates_list],
+            [geo_coordinates["lat"] for geo_coordinates in geo_coordinates_list],
+            box_size,
+            get_smoothed_turbidity_index_summed_area_tables(
+                image_handler, *smoothed_turbidity_index_parameters
+            ),
+        )
+        for measures, turbidity_index_value, turbidity_index_std in zip(
+            measurements_list, turbidity_index_value_array, turbidity_index_std_array
+        ):
+            turbidity_df_builder.append(
+                date=date,
+                location=measures["notes"],
+                measure=numpy.median(measures["measures"]),
+                turbidity_index_value=turbidity_index_value,
+                turbidity_index_std=turbidity_index_std,
+            )
+    return turbidity_df_builder.to_dataframe()
+
+
+def transform_turbidity_df(turbidity_df, exlude_outlier, use_log_measure):
+    """
+    Post-processing stage of create_turbidity_df, cheap enough to run on every
+    toggle of the display filters. The extracted DataFrame is not modified.
+    """
     if exlude_outlier is True:
         turbidity_df = turbidity_df[turbidity_df["measure"] < 70].reset_index(drop=True)
     if use_log_measure is True:
-        turbidity_df["measure"] = turbidity_df["measure"].apply(numpy.log)
-    turbidity_df["turbidity_index_value"] = turbidity_df[
-        "turbidity_index_value"
-    ].astype(float)
-    turbidity_df["turbidity_index_std"] = turbidity_df["turbidity_index_std"].astype(
-        float
-    )
+        turbidity_df = turbidity_df.assign(measure=numpy.log(turbidity_df["measure"]))
     return turbidity_df
 
 
@@ -99,47 +159,364 @@ def get_smoothed_turbidity_index_water_index_mask(
     ndti_smoothed_sigma,
     type_of_turbidity_index,
     exclude_points_from_bridge_points_handler,
+    raster_cache=RASTER_CACHE,
+    dtype=RASTER_DTYPE,
 ):
+    """
+    Return the smoothed turbidity index raster masked by the water index.
+
+    The raster is computed once per image and parameters and kept in
+    ``raster_cache``, which is shared by the turbidity DataFrame builders and the
+    image renderers. The returned array is read-only. Use ``raster_cache=None``
+    to bypass the cache. It is computed in ``dtype``, RASTER_DTYPE by default.
+    """
+    parameters = (
+        "smoothed_turbidity_index_water_index_mask",
+        water_index_threshold,
+        ndti_smoothed_sigma,
+        type_of_turbidity_index,
+        exclude_points_from_bridge_points_handler,
+        numpy.dtype(dtype).name,
+    )
+
+    def compute_function():
+        return create_smoothed_turbidity_index_water_index_mask(
+            image_handler,
+            water_index_threshold,
+            ndti_smoothed_sigma,
+            type_of_turbidity_index,
+            exclude_points_from_bridge_points_handler,
+            dtype,
+        )
+
+    if raster_cache is None:
+        return compute_function()
+    return raster_cache.get_or_compute(image_handler, parameters, compute_function)
+
+
+def get_smoothed_turbidity_index_summed_area_tables(
+    image_handler,
+    water_index_threshold,
+    ndti_smoothed_sigma,
+    type_of_turbidity_index,
+    exclude_points_from_bridge_points_handler,
+    raster_cache=RASTER_CACHE,
+    dtype=RASTER_DTYPE,
+):
+    """
+    Return the summed-area tables, see create_summed_area_tables, of the raster
+    of get_smoothed_turbidity_index_water_index_mask.
+
+    They are kept in ``raster_cache`` next to the raster, under the same image
+    and parameters, so the box statistics of any box size are four lookups per
+    point once they are built.
+    """
+    parameters = (
+        water_index_threshold,
+        ndti_smoothed_sigma,
+        type_of_turbidity_index,
+        exclude_points_from_bridge_points_handler,
+    )
+
+    def compute_function():
+        return create_summed_area_tables(
+            get_smoothed_turbidity_index_water_index_mask(
+                image_handler, *parameters, raster_cache=raster_cache, dtype=dtype
+            )
+        )
+
+    if raster_cache is None:
+        return compute_function()
+    return raster_cache.get_or_compute(
+        image_handler,
+        ("smoothed_turbidity_index_summed_area_tables",)
+        + parameters
+        + (numpy.dtype(dtype).name,),
+        compute_function,
+    )
+
+
+def get_turbidity_index_halo(
+    type_of_turbidity_index, ndti_smoothed_sigma, kernel_size=GAUSSIAN_KERNEL_SIZE
+):
+    """
+    Width in pixels of the margin around a window that the smoothed turbidity
+    index of the window depends on: half a smoothing kernel per smoothing, the
+    one of the (665nm)/(833nm) bands and the one of ndti_smoothed_sigma.
+    """
+    halo = 0
+    if type_of_turbidity_index == "(665nm)/(833nm)":
+        halo += kernel_size // 2
+    if ndti_smoothed_sigma != 0:
+        halo += kernel_size // 2
+    return halo
+
+
+def get_smoothed_turbidity_index_water_index_mask_window(
+    image_handler,
+    window,
+    water_index_threshold,
+    ndti_smoothed_sigma,
+    type_of_turbidity_index,
+    exclude_points_from_bridge_points_handler,
+    raster_cache=RASTER_CACHE,
+    dtype=RASTER_DTYPE,
+):
+    """
+    Window (min_row, max_row, min_col, max_col), end excluded, of the raster of
+    get_smoothed_turbidity_index_water_index_mask.
+
+    When the full raster is in ``raster_cache``, it is cropped. Otherwise only
+    the window and its halo are computed, see
+    create_smoothed_turbidity_index_water_index_mask_window, and kept in the
+    cache under the window.
+    """
+    parameters = (
+        water_index_threshold,
+        ndti_smoothed_sigma,
+        type_of_turbidity_index,
+        exclude_points_from_bridge_points_handler,
+        numpy.dtype(dtype).name,
+    )
+    min_row, max_row, min_col, max_col = window
+
+    def compute_function():
+        return create_smoothed_turbidity_index_water_index_mask_window(
+            image_handler,
+            window,
+            water_index_threshold,
+            ndti_smoothed_sigma,
+            type_of_turbidity_index,
+            exclude_points_from_bridge_points_handler,
+            dtype,
+        )
+
+    if raster_cache is None:
+        return compute_function()
+    raster = raster_cache.get(
+        image_handler, ("smoothed_turbidity_index_water_index_mask",) + parameters
+    )
+    if raster is not None:
+        return raster[min_row:max_row, min_col:max_col]
+    return raster_cache.get_or_compute(
+        image_handler,
+        ("smoothed_turbidity_index_water_index_mask_window", tuple(window))
+        + parameters,
+        compute_function,
+    )
+
+
+def create_smoothed_turbidity_index_water_index_mask_window(
+    image_handler,
+    window,
+    water_index_threshold,
+    ndti_smoothed_sigma,
+    type_of_turbidity_index,
+    exclude_points_from_bridge_points_handler,
+    dtype=RASTER_DTYPE,
+):
+    """
+    create_smoothed_turbidity_index_water_index_mask computed only on a window
+    (min_row, max_row, min_col, max_col), end excluded, and its halo.
+
+    The bands, the water index and the bridge mask are sliced to the window
+    grown by get_turbidity_index_halo pixels, clipped to the scene. Inside the
+    window, the result is identical to the window of the full-scene raster.
+    """
+    n_rows, n_cols = image_handler.red_band.shape[:2]
+    min_row, max_row, min_col, max_col = window
+    halo = get_turbidity_index_halo(type_of_turbidity_index, ndti_smoothed_sigma)
+    halo_min_row, halo_min_col = max(0, min_row - halo), max(0, min_col - halo)
+    halo_window = (
+        slice(halo_min_row, min(n_rows, max_row + halo)),
+        slice(halo_min_col, min(n_cols, max_col + halo)),
+    )
+    turbidity_index = create_turbidity_index_raster(
+        image_handler.red_band[halo_window],
+        image_handler.green_band[halo_window],
+        image_handler.nir_band[halo_window],
+        type_of_turbidity_index,
+        dtype=dtype,
+        blue_band=(
+            image_handler.blue_band[halo_window]
+            if "blue" in TURBIDITY_INDEX_BAND_DICT[type_of_turbidity_index]
+            else None
+        ),
+    )
+    water_index_mask = create_water_index_mask(
+        get_water_index_raster(image_handler)[halo_window],
+        water_index_threshold,
+        image_handler.get_mask_from_bridge_points_handler()[halo_window]
+        if exclude_points_from_bridge_points_handler is True
+        else None,
+    )
+    smoothed_turbidity_index = create_smoothed_turbidity_index_from_water_index_mask(
+        turbidity_index, water_index_mask, ndti_smoothed_sigma
+    )
+    row_slice = slice(min_row - halo_min_row, max_row - halo_min_row)
+    col_slice = slice(min_col - halo_min_col, max_col - halo_min_col)
+    return smoothed_turbidity_index[row_slice, col_slice]
+
+
+def get_water_index_raster(image_handler, raster_cache=RASTER_CACHE):
+    """
+    Return the water index raster of an image.
+
+    Band stores built with the water index layer return it directly as a float32
+    memory-mapped array. Otherwise it is computed with create_water_index_raster
+    and kept in ``raster_cache`` in RASTER_DTYPE.
+    """
+    if isinstance(image_handler, StoredImageHandler) and image_handler.has_array(
+        "water_index"
+    ):
+        return image_handler.load_array("water_index")
+
+    def compute_function():
+        return create_water_index_raster(image_handler).astype(RASTER_DTYPE, copy=False)
+
+    if raster_cache is None:
+        return compute_function()
+    return raster_cache.get_or_compute(
+        image_handler, ("water_index",), compute_function
+    )
+
+
+def create_smoothed_turbidity_index_water_index_mask(
+    image_handler,
+    water_index_threshold,
+    ndti_smoothed_sigma,
+    type_of_turbidity_index,
+    exclude_points_from_bridge_points_handler,
+    dtype=RASTER_DTYPE,
+    water_index=None,
+):
+    """
+    Smoothed turbidity index raster masked by the water index, see
+    get_smoothed_turbidity_index_water_index_mask. The water index is
+    get_water_index_raster when water_index is not given.
+    """
     turbidity_index = create_turbidity_index_raster(
         image_handler.red_band,
         image_handler.green_band,
         image_handler.nir_band,
         type_of_turbidity_index,
         image_handler,
+        dtype,
+    )
+    if water_index is None:
+        water_index = get_water_index_raster(image_handler)
+    water_index_mask = create_water_index_mask(
+        water_index,
+        water_index_threshold,
+        image_handler.get_mask_from_bridge_points_handler()
+        if exclude_points_from_bridge_points_handler is True
+        else None,
+    )
+    return create_smoothed_turbidity_index_from_water_index_mask(
+        turbidity_index, water_index_mask, ndti_smoothed_sigma
     )
-    water_index = create_water_index_raster(image_handler)
+
+
+def create_water_index_mask(water_index, water_index_threshold, bridge_mask=None):
+    """
+    Threshold the water index raster, optionally removing the bridge pixels.
+    """
     water_index_mask = water_index > water_index_threshold
-    if exclude_points_from_bridge_points_handler is True:
-        water_index_mask = (
-            water_index_mask * image_handler.get_mask_from_bridge_points_handler()
-        )
-    turbidity_index_water_mask = water_index_mask * turbidity_index
-    turbidity_index_water_mask[water_index_mask == 0.0] = numpy.nan
+    if bridge_mask is not None:
+        water_index_mask = water_index_mask * bridge_mask
+    return water_index_mask
+
+
+def create_smoothed_turbidity_index_from_water_index_mask(
+    turbidity_index, water_index_mask, ndti_smoothed_sigma
+):
+    """
+    Mask the turbidity index outside the water with NaN, then smooth it with a
+    NaN interpolating Gaussian filter when ndti_smoothed_sigma is not 0.
+
+    The turbidity index and the water index mask stages can be reused across
+    calls, which is what the hyperparameter sweep relies on. The result has the
+    dtype of the turbidity index.
+    """
+    land_mask = water_index_mask == 0
+    turbidity_index_water_mask = numpy.where(
+        land_mask, numpy.nan, turbidity_index
+    ).astype(turbidity_index.dtype, copy=False)
     if ndti_smoothed_sigma == 0:
         return turbidity_index_water_mask
     else:
-        gaussian_kernel = Gaussian2DKernel(
-            x_stddev=ndti_smoothed_sigma,
-            y_stddev=ndti_smoothed_sigma,
-            x_size=7,
-            y_size=7,
+        convole_ndti_water_mask = smooth_raster(
+            turbidity_index_water_mask, ndti_smoothed_sigma
         )
-        convole_ndti_water_mask = convolve(turbidity_index_water_mask, gaussian_kernel)
-        convole_ndti_water_mask[water_index_mask == 0.0] = numpy.nan
+        convole_ndti_water_mask[land_mask] = numpy.nan
         return convole_ndti_water_mask
 
 
-def get_turbidity_from_image_handle_class_and_turbidity_df(
-    image_handle_class, turbidity_df, window=0
+def get_raster_dtype_difference(
+    image_handler,
+    water_index_threshold,
+    ndti_smoothed_sigma,
+    type_of_turbidity_index,
+    exclude_points_from_bridge_points_handler=True,
+    dtype=RASTER_DTYPE,
 ):
-    image_date = datetime.strptime(image_handle_class.date[:19], "%Y-%m-%dT%H:%M:%S")
-    image_date = image_date - timedelta(hours=4)
-    argmin_idx_location = (turbidity_df["date"] - image_date).abs().argmin()
-    turbidity = turbidity_df.loc[
-        argmin_idx_location - window : argmin_idx_location + window
-    ]["filtered_interpolated_turbidity"].mean()
-    time_diff = turbidity_df.loc[argmin_idx_location]["date"] - image_date
-    return turbidity, time_diff
+    """
+    Compare the smoothed turbidity index raster computed in dtype to a float64
+    reference, without the raster cache.
+
+    The reference water index is computed in float64 with
+    create_water_index_raster, not read from get_water_index_raster, which is
+    the float32 layer of a band store. The pixels of the water index mask which
+    flip at water_index_threshold because of dtype are counted.
+
+    The difference is relative to the largest absolute float64 value, since
+    indices such as NDTI cross 0, over the pixels valid in both rasters. It is
+    expected below RASTER_DTYPE_TOLERANCE for float32: about 1e-7 for the index
+    itself, up to a few 1e-7 after the smoothing sums.
+
+    Returns:
+        tuple:
+            1. float: Maximum absolute difference divided by the maximum absolute
+               float64 value.
+            2. bool: Whether both rasters are NaN for the same pixels.
+            3. int: Number of pixels of the water index mask which differ.
+    """
+    parameters = (
+        water_index_threshold,
+        ndti_smoothed_sigma,
+        type_of_turbidity_index,
+        exclude_points_from_bridge_points_handler,
+    )
+    raster = get_smoothed_turbidity_index_water_index_mask(
+        image_handler, *parameters, raster_cache=None, dtype=dtype
+    )
+    reference_water_index = numpy.asarray(
+        create_water_index_raster(image_handler), dtype=numpy.float64
+    )
+    reference_raster = create_smoothed_turbidity_index_water_index_mask(
+        image_handler, *parameters, numpy.float64, reference_water_index
+    )
+    mask_difference_count = int(
+        numpy.count_nonzero(
+            create_water_index_mask(
+                get_water_index_raster(image_handler, raster_cache=None),
+                water_index_threshold,
+            )
+            != create_water_index_mask(reference_water_index, water_index_threshold)
+        )
+    )
+    nan_mask = numpy.isnan(raster)
+    reference_nan_mask = numpy.isnan(reference_raster)
+    same_nan = bool(numpy.array_equal(nan_mask, reference_nan_mask))
+    valid_mask = ~nan_mask & ~reference_nan_mask
+    if not numpy.any(valid_mask):
+        return 0.0, same_nan, mask_difference_count
+    scale = numpy.max(numpy.abs(reference_raster[valid_mask]))
+    max_difference = numpy.max(
+        numpy.abs(raster[valid_mask] - reference_raster[valid_mask])
+    )
+    relative_difference = float(max_difference / scale) if scale > 0 else 0.0
+    return relative_difference, same_nan, mask_difference_count
 
 
 def create_turbidity_fixed_df(
@@ -154,18 +531,63 @@ def create_turbidity_fixed_df(
     exlude_outlier=False,
     use_log_measure=False,
     turdibidty_df_window=0,
+    progress_callback=None,
 ):
-    turbidity_df = pandas.DataFrame(
-        columns=[
-            "date",
-            "measure",
-            "turbidity_index_value",
-        ]
+    if not isinstance(fixed_turbidity_data, ProbeTimeSeries):
+        fixed_turbidity_data = ProbeTimeSeries(fixed_turbidity_data)
+    turbidity_df = extract_turbidity_fixed_df(
+        image_handler_list,
+        fixed_turbidity_data,
+        turbidity_geo_coordinate_dict,
+        water_index_threshold,
+        box_size,
+        ndti_smoothed_sigma,
+        type_of_turbidity_index,
+        exclude_points_from_bridge_points_handler,
+        progress_callback,
     )
-    for i, image_handler in enumerate(image_handler_list):
-        turbidity, time_diff = get_turbidity_from_image_handle_class_and_turbidity_df(
-            image_handler, fixed_turbidity_data, turdibidty_df_window
-        )
+    return transform_turbidity_fixed_df(
+        turbidity_df, fixed_turbidity_data, exlude_outlier, turdibidty_df_window
+    )
+
+
+def extract_turbidity_fixed_df(
+    image_handler_list,
+    fixed_turbidity_data,
+    turbidity_geo_coordinate_dict,
+    water_index_threshold,
+    box_size,
+    ndti_smoothed_sigma,
+    type_of_turbidity_index,
+    exclude_points_from_bridge_points_handler,
+    progress_callback=None,
+):
+    """
+    Raster extraction stage of create_turbidity_fixed_df: the turbidity index
+    around the probe of every image with a probe measure the same day.
+
+    The nearest measure does not depend on the averaging window, so the probe
+    measures themselves are added by transform_turbidity_fixed_df, from the
+    "image_date" column. progress_callback, when given, is called as
+    progress_callback(value, total) with the number of images done.
+    """
+    turbidity_df_builder = ColumnarDataFrameBuilder(
+        {
+            "date": object,
+            "image_date": object,
+            "turbidity_index_value": float,
+        }
+    )
+    if not isinstance(fixed_turbidity_data, ProbeTimeSeries):
+        fixed_turbidity_data = ProbeTimeSeries(fixed_turbidity_data)
+    _, time_diff_index = fixed_turbidity_data.match(
+        [image_handler.date for image_handler in image_handler_list]
+    )
+    for image_index, (image_handler, time_diff) in enumerate(
+        zip(image_handler_list, time_diff_index)
+    ):
+        if progress_callback is not None:
+            progress_callback(image_index, len(image_handler_list))
         image_date = datetime.strptime(image_handler.date[:19], "%Y-%m-%dT%H:%M:%S")
         if numpy.abs(time_diff).days == 0 and image_date < datetime(2023, 11, 19):
             smoothed_turbidity_index_water_index_mask = (
@@ -185,21 +607,40 @@ def create_turbidity_fixed_df(
                     turbidity_geo_coordinate["lon"], turbidity_geo_coordinate["lat"]
                 )
             ).astype(int)
-            box_size_offset = box_size // 2
-            box = smoothed_turbidity_index_water_index_mask[
-                row - box_size_offset : row + box_size_offset + 1,
-                col - box_size_offset : col + box_size_offset + 1,
-            ]
+            box = get_clipped_box(
+                smoothed_turbidity_index_water_index_mask, row, col, box_size
+            )
             turbidity_index_value = numpy.nanmean(box)
 
-            turbidity_df.loc[i, "date"] = image_handler.date[:10]
-            turbidity_df.loc[i, "measure"] = turbidity
-            turbidity_df.loc[i, "turbidity_index_value"] = turbidity_index_value
-    turbidity_df["measure"] = turbidity_df["measure"].astype(float)
+            turbidity_df_builder.append(
+                date=image_handler.date[:10],
+                image_date=image_handler.date,
+                turbidity_index_value=turbidity_index_value,
+            )
+    return turbidity_df_builder.to_dataframe()
+
+
+def transform_turbidity_fixed_df(
+    turbidity_df, fixed_turbidity_data, exlude_outlier=False, turdibidty_df_window=0
+):
+    """
+    Post-processing stage of create_turbidity_fixed_df: the mean of the
+    turdibidty_df_window probe measures around the nearest one, then the images
+    without measure and, optionally, the Grubbs outliers are dropped.
+    """
+    if not isinstance(fixed_turbidity_data, ProbeTimeSeries):
+        fixed_turbidity_data = ProbeTimeSeries(fixed_turbidity_data)
+    turbidity_array, _ = fixed_turbidity_data.match(
+        list(turbidity_df["image_date"]), turdibidty_df_window
+    )
+    turbidity_df = pandas.DataFrame(
+        {
+            "date": turbidity_df["date"],
+            "measure": turbidity_array,
+            "turbidity_index_value": turbidity_df["turbidity_index_value"],
+        }
+    )
     turbidity_df = turbidity_df[~turbidity_df["measure"].isna()].reset_index(drop=True)
-    turbidity_df["turbidity_index_value"] = turbidity_df[
-        "turbidity_index_value"
-    ].astype(float)
     if exlude_outlier:
         non_outlier_index = ~numpy.isin(
             turbidity_df["measure"],
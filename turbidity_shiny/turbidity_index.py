@@ -1,77 +1,142 @@
-from satellite_image_handler.utils.normalize_index import create_ndti_raster
-from astropy.convolution import Gaussian2DKernel, convolve
-
-
-def create_nsmi_raster(red_band, green_band, blue_band):
-    red_band = red_band.astype(float)
-    green_band = green_band.astype(float)
-    blue_band = blue_band.astype(float)
-    ndti = (red_band + green_band - blue_band) / (red_band + green_band + blue_band)
-    return ndti
+import os
+
+import numpy
+
+from turbidity_shiny.smoothing import smooth_raster
+
+
+# dtype of the turbidity index rasters and of the masked and smoothed rasters
+# derived from them. float32 halves the memory of the cached rasters at the
+# cost of a relative difference with float64 below RASTER_DTYPE_TOLERANCE,
+# see turbidity_df.get_raster_dtype_difference. The Acolite reflectances are
+# floats and are rounded to float32.
+RASTER_DTYPE = numpy.dtype(os.environ.get("TURBIDITY_SHINY_RASTER_DTYPE", "float32"))
+if RASTER_DTYPE not in (numpy.float32, numpy.float64):
+    raise ValueError(
+        f"TURBIDITY_SHINY_RASTER_DTYPE must be float32 or float64, not {RASTER_DTYPE}"
+    )
+
+TURBIDITY_INDEX_TYPE_LIST = [
+    "NDTI",
+    "NSMI",
+    "Bande Rouge (665nm)",
+    "Bande Infra Rouge (833nm)",
+    "(665nm)/(833nm)",
+]
+# Bands read by every type of turbidity index
+TURBIDITY_INDEX_BAND_DICT = {
+    "NDTI": ("red", "green"),
+    "NSMI": ("red", "green", "blue"),
+    "Bande Rouge (665nm)": ("red",),
+    "Bande Infra Rouge (833nm)": ("nir",),
+    "(665nm)/(833nm)": ("red", "nir"),
+}
 
 
 def create_turbidity_index_raster(
-    red_band, green_band, nir_band, type_of_turbidity_index, image_handler=None
+    red_band,
+    green_band,
+    nir_band,
+    type_of_turbidity_index,
+    image_handler=None,
+    dtype=RASTER_DTYPE,
+    blue_band=None,
+):
+    return create_turbidity_index_raster_dict(
+        red_band,
+        green_band,
+        nir_band,
+        [type_of_turbidity_index],
+        image_handler,
+        dtype,
+        blue_band,
+    )[type_of_turbidity_index]
+
+
+def create_turbidity_index_raster_dict(
+    red_band,
+    green_band,
+    nir_band,
+    type_of_turbidity_index_list=TURBIDITY_INDEX_TYPE_LIST,
+    image_handler=None,
+    dtype=RASTER_DTYPE,
+    blue_band=None,
 ):
-    if type_of_turbidity_index == "NDTI":
-        return create_ndti_raster(red_band, green_band)
-    elif type_of_turbidity_index == "NSMI":
-        return create_nsmi_raster(red_band, green_band, image_handler.blue_band)
-    elif type_of_turbidity_index == "Bande Rouge (665nm)":
-        return create_red_band_turbidity_raster(red_band)
-    elif type_of_turbidity_index == "Bande Infra Rouge (833nm)":
-        return create_nir_band_turbidity_raster(nir_band)
-    elif type_of_turbidity_index == "(665nm)/(833nm)":
-        gaussian_kernel = Gaussian2DKernel(
-            x_stddev=1,
-            y_stddev=1,
-            x_size=7,
-            y_size=7,
-        )
-        return convolve(
-            create_red_band_turbidity_raster(red_band), gaussian_kernel
-        ) / convolve(create_red_band_turbidity_raster(nir_band), gaussian_kernel)
-
-
-def create_red_band_turbidity_raster(red_band):
-    """
-    Calculates the Turbidity Index  raster from the input red bands.
-
-    Args:
-        red_band (numpy.ndarray): Array representing the red band.
-
-    Returns:
-        numpy.ndarray: Array representing the turbidity raster.
-
-    Raises:
-        ValueError: If the input bands have different shapes.
-
-    Notes:
-        - The input bands are expected to be in the same spatial extent and coordinate system.
-        - The input bands should be provided as numpy arrays.
-        - The turbidity index is calculated using the formula: red_band
-        - Higher turbidity values indicate higher turbidity or presence of suspended particles.
     """
-    return red_band.astype(float)
-
+    Compute several turbidity index rasters in one pass over the bands.
 
-def create_nir_band_turbidity_raster(nir_band):
-    """
-    Calculates the Turbidity Index  raster from the input nir bands.
+    Each band is cast to ``dtype`` once, and the red + green sum is shared by
+    NDTI and NSMI, instead of a cast of every band and of every temporary per
+    type of index.
 
     Args:
-        nir_band (numpy.ndarray): Array representing the nir band.
+        red_band, green_band, nir_band (numpy.ndarray): Bands of the image.
+        type_of_turbidity_index_list (list): Types of TURBIDITY_INDEX_TYPE_LIST.
+        image_handler: Image handler of the bands, only read for the blue band
+            of NSMI when blue_band is not given.
+        dtype: numpy.float32 or numpy.float64, RASTER_DTYPE by default.
+        blue_band (numpy.ndarray): Blue band, e.g. a window of it.
 
     Returns:
-        numpy.ndarray: Array representing the turbidity raster.
+        dict: Raster of every type of type_of_turbidity_index_list. The rasters
+        of the single band indices are the cast bands, shared by the dict.
 
     Raises:
-        ValueError: If the input bands have different shapes.
+        ValueError: If a type of turbidity index is unknown.
 
-    Notes:
-        - The input bands are expected to be in the same spatial extent and coordinate system.
-        - The input bands should be provided as numpy arrays.
-        - The turbidity index is calculated using the formula: nir_band
-        - Higher turbidity values indicate higher turbidity or presence of suspended particles.
+    Example:
+    >>> turbidity_index_dict = create_turbidity_index_raster_dict(
+    ...     image_handler.red_band, image_handler.green_band, image_handler.nir_band,
+    ...     ["NDTI", "(665nm)/(833nm)"], image_handler, dtype=numpy.float32,
+    ... )
     """
-    return nir_band.astype(float)
+    unknown_type_list = [
+        type_of_turbidity_index
+        for type_of_turbidity_index in type_of_turbidity_index_list
+        if type_of_turbidity_index not in TURBIDITY_INDEX_BAND_DICT
+    ]
+    if len(unknown_type_list) > 0:
+        raise ValueError(f"Unknown type of turbidity index: {unknown_type_list}")
+    band_name_set = {
+        band_name
+        for type_of_turbidity_index in type_of_turbidity_index_list
+        for band_name in TURBIDITY_INDEX_BAND_DICT[type_of_turbidity_index]
+    }
+    if "blue" in band_name_set and blue_band is None:
+        blue_band = image_handler.blue_band
+    band_dict = {}
+    for band_name, band in [
+        ("red", red_band),
+        ("green", green_band),
+        ("nir", nir_band),
+        ("blue", blue_band),
+    ]:
+        if band_name in band_name_set:
+            band_dict[band_name] = band.astype(dtype)
+    red_green_sum = (
+        band_dict["red"] + band_dict["green"]
+        if {"NDTI", "NSMI"} & set(type_of_turbidity_index_list)
+        else None
+    )
+    turbidity_index_dict = {}
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        for type_of_turbidity_index in type_of_turbidity_index_list:
+            if type_of_turbidity_index == "NDTI":
+                turbidity_index = (
+                    band_dict["red"] - band_dict["green"]
+                ) / red_green_sum
+            elif type_of_turbidity_index == "NSMI":
+                turbidity_index = (red_green_sum - band_dict["blue"]) / (
+                    red_green_sum + band_dict["blue"]
+                )
+            elif type_of_turbidity_index == "Bande Rouge (665nm)":
+                turbidity_index = band_dict["red"]
+            elif type_of_turbidity_index == "Bande Infra Rouge (833nm)":
+                turbidity_index = band_dict["nir"]
+            elif type_of_turbidity_index == "(665nm)/(833nm)":
+                turbidity_index = (
+                    smooth_raster(band_dict["red"], 1)
+                    / smooth_raster(band_dict["nir"], 1)
+                ).astype(dtype, copy=False)
+            turbidity_index_dict[type_of_turbidity_index] = turbidity_index
+    return turbidity_index_dict
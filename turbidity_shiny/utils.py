@@ -3,6 +3,8 @@ from datetime import datetime
 import pickle
 import re
 import json
+import numpy
+import pandas
 
 from satellite_image_handler.abstract_satellite_image_handler.abstract_sentinel_image_handler import (
     AbstractSentinelImageHandler,
@@ -85,3 +87,72 @@ def convert_string_date_to_datetime_2022(date_string: str) -> datetime:
     else:
         raise ValueError
     return date
+
+
+def convert_string_date_series_to_datetime(
+    date_series: pandas.Series, date_format: str
+) -> pandas.Series:
+    """
+    Vectorized version of convert_string_date_to_datetime_2022 and
+    convert_string_date_to_datetime_2023.
+
+    Args:
+        date_series (pandas.Series): Strings of 16 or 19 caracters.
+        date_format (str): Format of the day, "%Y-%m-%d" for 2022 and "%Y-%d-%m" for 2023.
+
+    Returns:
+        pandas.Series: datetime64 series.
+
+    Raises:
+        ValueError: If a string is not 16 or 19 caracters long.
+    """
+    date_series = date_series.astype(str)
+    date_length = date_series.str.len()
+    if not date_length.isin([16, 19]).all():
+        raise ValueError("Dates must have 16 or 19 caracters")
+    date_series = date_series.where(date_length == 19, date_series + ":00")
+    return pandas.to_datetime(date_series, format=f"{date_format} %H:%M:%S")
+
+
+class ColumnarDataFrameBuilder:
+    """
+    Accumulate rows column by column and build the pandas.DataFrame once.
+
+    Growing a DataFrame with ``df.loc[i, col] = value`` reallocates it for every
+    new row and upcasts every column to object. Instead, values are appended to
+    one list per column and converted to a typed array in ``to_dataframe``.
+
+    Args:
+        columns (dict): Mapping of column name to dtype. Use ``object`` for
+            strings or Python objects such as lists.
+
+    Example:
+    >>> builder = ColumnarDataFrameBuilder({"date": object, "measure": float})
+    >>> builder.append(date="2023-05-11", measure=1.2)
+    >>> df = builder.to_dataframe()
+    """
+
+    def __init__(self, columns: dict):
+        self.dtypes = dict(columns)
+        self.columns = {name: [] for name in self.dtypes}
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), []))
+
+    def append(self, **row):
+        for name, values in self.columns.items():
+            values.append(row[name])
+
+    def to_dataframe(self) -> pandas.DataFrame:
+        data = {}
+        for name, values in self.columns.items():
+            dtype = self.dtypes[name]
+            if dtype is object:
+                # Assign element-wise so lists are kept as single objects
+                array = numpy.empty(len(values), dtype=object)
+                for i, value in enumerate(values):
+                    array[i] = value
+            else:
+                array = numpy.asarray(values, dtype=dtype)
+            data[name] = array
+        return pandas.DataFrame(data, columns=list(self.columns))
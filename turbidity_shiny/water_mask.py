@@ -0,0 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import numpy
+from satellite_image_handler.utils.normalize_index import create_ndwi_raster
+from scipy import ndimage
+from skimage import filters
+
+from turbidity_shiny.turbidity.raster_cache import RASTER_CACHE
+
+
+# Sobel magnitude above which a pixel is on the edge of a water mask
+WATER_MASK_EDGE_THRESHOLD = 0.25
+# Threads computing the water masks of the water tab, shared by every session
+WATER_MASK_MAX_WORKERS = 2
+
+_water_mask_executor = None
+_water_mask_executor_lock = threading.Lock()
+
+
+def get_water_mask_executor(max_workers=WATER_MASK_MAX_WORKERS):
+    """
+    Process-wide thread pool of the water masks, created on first use.
+    """
+    global _water_mask_executor
+    with _water_mask_executor_lock:
+        if _water_mask_executor is None:
+            _water_mask_executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="water_mask"
+            )
+        return _water_mask_executor
+
+
+class PackedMask:
+    """
+    Boolean raster stored with numpy.packbits, 8 pixels per byte.
+    """
+
+    def __init__(self, mask):
+        mask = numpy.asarray(mask, dtype=bool)
+        self.shape = mask.shape
+        self.packed_mask = numpy.packbits(mask, axis=None)
+        self.packed_mask.flags.writeable = False
+
+    @property
+    def nbytes(self):
+        return self.packed_mask.nbytes
+
+    def unpack(self):
+        return (
+            numpy.unpackbits(self.packed_mask, count=int(numpy.prod(self.shape)))
+            .reshape(self.shape)
+            .astype(bool)
+        )
+
+
+def get_water_mask_edge(water_mask):
+    return filters.sobel(water_mask) >= WATER_MASK_EDGE_THRESHOLD
+
+
+def get_scene_clf_water_mask_edge(
+    image_handler, sigma, threshold, raster_cache=RASTER_CACHE
+):
+    """
+    PackedMask of the edges of the smoothed scene classification water mask,
+    cached per (image, sigma, threshold).
+    """
+    return raster_cache.get_or_compute(
+        image_handler,
+        ("scene_clf_water_mask_edge", sigma, threshold),
+        lambda: PackedMask(
+            get_water_mask_edge(
+                image_handler.get_smoothed_water_mask(sigma=sigma, threshold=threshold)
+            )
+        ),
+    )
+
+
+def get_ndwi_raster(image_handler, raster_cache=RASTER_CACHE):
+    return raster_cache.get_or_compute(
+        image_handler,
+        ("ndwi",),
+        lambda: create_ndwi_raster(image_handler.green_band, image_handler.nir_band),
+    )
+
+
+def get_ndwi_water_mask_edge(
+    image_handler, sigma, threshold_1, threshold_2, raster_cache=RASTER_CACHE
+):
+    """
+    PackedMask of the edges of the NDWI water mask: the NDWI above threshold_1,
+    smoothed by a gaussian filter of sigma and thresholded again by threshold_2.
+    Cached per (image, sigma, threshold_1, threshold_2), the NDWI raster per
+    image.
+    """
+
+    def compute_ndwi_water_mask_edge():
+        ndwi_water_mask = get_ndwi_raster(image_handler, raster_cache) > threshold_1
+        ndwi_water_mask = (
+            ndimage.gaussian_filter(ndwi_water_mask.astype(float), sigma=sigma)
+            > threshold_2
+        )
+        return PackedMask(get_water_mask_edge(ndwi_water_mask))
+
+    return raster_cache.get_or_compute(
+        image_handler,
+        ("ndwi_water_mask_edge", sigma, threshold_1, threshold_2),
+        compute_ndwi_water_mask_edge,
+    )
+
+
+def get_water_mask_edge_dict(
+    image_handler,
+    scene_clf_parameters=None,
+    ndwi_parameters=None,
+    raster_cache=RASTER_CACHE,
+):
+    """
+    Edges of the water masks of an image, computed concurrently when both are
+    requested.
+
+    Args:
+        scene_clf_parameters (tuple): (sigma, threshold) of the scene
+            classification water mask, None to skip it.
+        ndwi_parameters (tuple): (sigma, threshold_1, threshold_2) of the NDWI
+            water mask, None to skip it.
+
+    Returns:
+        dict: PackedMask of "scene_clf_water_mask" and "ndwi_water_mask".
+    """
+    scene_clf_water_mask_edge = None
+    ndwi_water_mask_edge = None
+    if scene_clf_parameters is not None and ndwi_parameters is not None:
+        scene_clf_future = get_water_mask_executor().submit(
+            get_scene_clf_water_mask_edge,
+            image_handler,
+            *scene_clf_parameters,
+            raster_cache=raster_cache,
+        )
+        ndwi_water_mask_edge = get_ndwi_water_mask_edge(
+            image_handler, *ndwi_parameters, raster_cache=raster_cache
+        )
+        scene_clf_water_mask_edge = scene_clf_future.result()
+    elif scene_clf_parameters is not None:
+        scene_clf_water_mask_edge = get_scene_clf_water_mask_edge(
+            image_handler, *scene_clf_parameters, raster_cache=raster_cache
+        )
+    elif ndwi_parameters is not None:
+        ndwi_water_mask_edge = get_ndwi_water_mask_edge(
+            image_handler, *ndwi_parameters, raster_cache=raster_cache
+        )
+    water_mask_edge_dict = {}
+    if scene_clf_water_mask_edge is not None:
+        water_mask_edge_dict["scene_clf_water_mask"] = scene_clf_water_mask_edge
+    if ndwi_water_mask_edge is not None:
+        water_mask_edge_dict["ndwi_water_mask"] = ndwi_water_mask_edge
+    return water_mask_edge_dict